@@ -0,0 +1,221 @@
+#!/usr/bin/env python
+# ***************************************************************************
+# Copyright (c) 2012 Digi International Inc.,
+# All rights not expressly granted are reserved.
+# 
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+# 
+# Digi International Inc. 11001 Bren Road East, Minnetonka, MN 55343
+#
+# ***************************************************************************
+"""
+Frame Reassembly Benchmark
+
+Compares the CPU time, peak memory and socket reads needed to reassemble 
+PublishMessages that arrive in segments, using string concatenation (the 
+previous implementation) and the session's buffered reader (the current 
+implementation).  Large payloads show the cost of copying, a burst of small
+payloads (i.e. '--size 200 --messages 20000') the cost of reading one frame
+at a time.  Call with '-h' for usage.
+
+Each strategy runs in its own process so that peak memory is not shared.
+"""
+from __future__ import print_function
+
+import argparse
+import os
+import resource
+import struct
+import subprocess
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 
+    '..'))
+
+from idigi_monitor_api.push_client import (INCOMPLETE, PUBLISH_MESSAGE, 
+    PushSession, _recv, _read_msg_header, _read_msg, _parse_publish_message)
+
+class SegmentedSocket(object):
+    """
+    Stands in for a socket that endlessly repeats one frame, returning no 
+    more than one segment per call as a socket does when data trickles in.
+    Only the number of bytes requested limits how many frames a call spans.
+    """
+
+    def __init__(self, frame, segment_size):
+        # Repeat small frames so a segment can span several of them.
+        frame = frame * max(1, 4 * segment_size // len(frame))
+        self.frame = memoryview(frame)
+        self.segment_size = segment_size
+        self.offset = 0
+        self.calls = 0
+
+    def recv(self, size):
+        """ Returns up to size bytes, limited to one segment. """
+        return self.frame[self.__advance(size)].tobytes()
+
+    def recv_into(self, buf, size=0):
+        """ Fills buf with up to size bytes, limited to one segment. """
+        segment = self.__advance(size or len(buf))
+        buf[0:segment.stop - segment.start] = self.frame[segment]
+        return segment.stop - segment.start
+
+    def __advance(self, size):
+        """ Returns the slice of the frame to hand out next. """
+        self.calls += 1
+        if self.offset == len(self.frame):
+            self.offset = 0
+        start = self.offset
+        self.offset = min(start + min(size, self.segment_size), 
+            len(self.frame))
+        return slice(start, self.offset)
+
+def build_frame(payload_size):
+    """
+    Returns an uncompressed PublishMessage with a payload of payload_size 
+    random bytes.
+    """
+    body = bytearray(struct.pack('!HHBBL', 1, 1, 0x00, 0x01, payload_size))
+    body += os.urandom(payload_size)
+    return bytearray(struct.pack('!HL', PUBLISH_MESSAGE, len(body))) + body
+
+def reset_peak_memory():
+    """
+    Resets the peak resident set size of this process, where supported.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+    except (IOError, OSError):
+        pass
+
+def peak_memory():
+    """
+    Returns the peak resident set size of this process in KB.
+    """
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (IOError, OSError):
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+class ConcatSession(object):
+    """ Session state as kept by the string concatenation reader. """
+
+    def __init__(self, sock):
+        self.socket = sock
+        self.data = b''
+        self.message_length = 0
+
+def concat_read(session):
+    """
+    Reads one message the way _read_msg_header and _read_msg did before 
+    they read into a buffer, returning its payload.
+    """
+    while len(session.data) < 6:
+        session.data += session.socket.recv(6 - len(session.data))
+    session.message_length = struct.unpack('!i', session.data[2:6])[0]
+    session.data = b''
+
+    while len(session.data) < session.message_length:
+        session.data += session.socket.recv(
+            session.message_length - len(session.data))
+
+    payload = session.data[10:]
+    session.data = b''
+    session.message_length = 0
+    return payload
+
+def buffer_read(session):
+    """
+    Reads one message with the library's buffered reader, returning its 
+    payload.  Reads only touch the socket once buffered data runs out.
+    """
+    while True:
+        if session.message_length != 0 \
+                or _read_msg_header(session) != INCOMPLETE:
+            data = _read_msg(session)
+            if data is not None:
+                break
+        _recv(session)
+
+    _, _, payload = _parse_publish_message(data)
+    return bytes(payload)
+
+def run_strategy(strategy, payload_size, messages, segment_size):
+    """
+    Reassembles the messages with one strategy and returns a tuple of the 
+    CPU seconds used, the growth in peak memory (in KB) and the number of 
+    reads performed on the socket.
+    """
+    sock = SegmentedSocket(build_frame(payload_size), segment_size)
+    if strategy == 'concat':
+        session, read = ConcatSession(sock), concat_read
+    else:
+        session = PushSession(None, 0, None)
+        session.socket = sock
+        read = buffer_read
+
+    reset_peak_memory()
+    start_rss = peak_memory()
+    start = os.times()
+    for _ in range(messages):
+        payload = read(session)
+        assert len(payload) == payload_size
+        del payload
+    end = os.times()
+    end_rss = peak_memory()
+
+    return (end[0] + end[1]) - (start[0] + start[1]), end_rss - start_rss, \
+        sock.calls
+
+def get_parser():
+    """ Parser for this script """
+    parser = argparse.ArgumentParser(description="Frame Reassembly Benchmark",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('--size', '-s', dest='size', type=int, 
+        default=10 * 1024 * 1024, help='Payload size in bytes.')
+
+    parser.add_argument('--messages', '-m', dest='messages', type=int, 
+        default=3, help='Number of messages to reassemble.')
+
+    parser.add_argument('--segment', dest='segment', type=int, default=16384,
+        help='Largest number of bytes a single recv returns.')
+
+    parser.add_argument('--strategy', dest='strategy', 
+        choices=['concat', 'buffer'], 
+        help='Run a single strategy in this process and print its results.')
+
+    return parser
+
+def main():
+    """ Main function call """
+    args = get_parser().parse_args()
+
+    if args.strategy is not None:
+        cpu, rss, calls = run_strategy(args.strategy, args.size, 
+            args.messages, args.segment)
+        print('%f %d %d' % (cpu, rss, calls))
+        return
+
+    print('%d message(s) of %d bytes in %d byte segments' 
+        % (args.messages, args.size, args.segment))
+    print('%-8s %12s %16s %12s' % ('strategy', 'cpu (s)', 'peak mem (KB)', 
+        'reads'))
+    for strategy in ('concat', 'buffer'):
+        output = subprocess.check_output([sys.executable, 
+            os.path.abspath(__file__), '--strategy', strategy, 
+            '--size', str(args.size), '--messages', str(args.messages), 
+            '--segment', str(args.segment)])
+        cpu, rss, calls = output.split()
+        print('%-8s %12.3f %16d %12d' % (strategy, float(cpu), int(rss), 
+            int(calls)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+#!/usr/bin/env python
+# ***************************************************************************
+# Copyright (c) 2012 Digi International Inc.,
+# All rights not expressly granted are reserved.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Digi International Inc. 11001 Bren Road East, Minnetonka, MN 55343
+#
+# ***************************************************************************
+"""
+Hot Path Benchmarks
+
+Measures the library's hot paths on their own, each with a workload of
+small messages and one of large FileData payloads where it applies:
+
+* framing: parsing PublishMessages out of received data with
+  _read_msg_header and _read_msg.
+* inflate: uncompressing typical payloads with zlib.
+* callback_pool: latency from queue_callback to the callback being invoked,
+  and throughput, at several worker counts.
+* ack: a PushClient acknowledging PublishMessages pushed by a LocalServer
+  as fast as it reads them, with callbacks returning one at a time and in
+  batches, so that acknowledgements are written one at a time and in
+  bursts.
+
+Results can be written as JSON with '--output', and compared against such a
+file with '--baseline', in which case the exit status is 1 if any metric
+regressed by more than '--tolerance' plus its noise, the spread of the
+metric over the repeated runs of either.  Comparing needs at least
+MIN_REPEAT runs of each benchmark.  Call with '-h' for usage.
+"""
+from __future__ import print_function
+
+import argparse
+import base64
+import json
+import os
+import platform
+import struct
+import sys
+import threading
+import time
+import zlib
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(HERE, '..'))
+sys.path.insert(0, HERE)
+
+from frame_reassembly import SegmentedSocket, buffer_read, build_frame
+from idigi_monitor_api.local_server import LocalServer
+from idigi_monitor_api.metrics import Metrics
+from idigi_monitor_api.push_client import (CallbackWorkerPool, PushClient,
+    PushSession)
+
+# Most precise clock available.
+timer = getattr(time, 'perf_counter', time.time)
+
+# Metrics where a higher value is better, all others are better lower.
+HIGHER_IS_BETTER = ('ops_per_sec', 'mb_per_sec')
+
+# Fewest runs of each benchmark their noise is estimated from when
+# comparing against a baseline.
+MIN_REPEAT = 3
+
+# Workloads: a burst of small DeviceCore sized messages, and large FileData
+# payloads.
+SMALL_SIZE = 200
+FILEDATA_SIZE = 1024 * 1024
+
+def percentile(values, fraction):
+    """
+    Returns the value below which fraction of the sorted values fall.
+    """
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def build_batch(count, size):
+    """
+    Returns a json Document of count Msgs of roughly size bytes each, with
+    content about as compressible as DeviceCore events.
+    """
+    messages = []
+    for index in range(count):
+        message = {'timestamp': '2012-01-01T00:00:00.000Z',
+            'topic': '1/DeviceCore/%d/0' % index, 'operation': 'INSERTION',
+            'group': '*', 'DeviceCore': {'dpMac': '00:40:9D:00:00:%02X'
+                % (index % 256), 'dpDescription': ''}}
+        padding = size - len(json.dumps(message))
+        message['DeviceCore']['dpDescription'] = \
+            base64.b16encode(os.urandom(max(0, padding) // 2)).decode('ascii')
+        messages.append(message)
+    return json.dumps({'Document': {'Msg': messages}}).encode('utf-8')
+
+def build_filedata(size):
+    """
+    Returns a json Document holding one FileData Msg with size bytes of
+    base64 encoded file content.
+    """
+    content = base64.b64encode(os.urandom(size * 3 // 4)).decode('ascii')
+    return json.dumps({'Document': {'Msg': {
+        'timestamp': '2012-01-01T00:00:00.000Z',
+        'topic': '1/FileDataCore/00000000-00000000-00409DFF-FF000000/data',
+        'operation': 'INSERTION', 'group': '*',
+        'FileData': {'fdContentType': 'application/octet-stream',
+            'fdData': content}}}}).encode('utf-8')
+
+def bench_framing(payload_size, messages, segment_size):
+    """
+    Parses messages PublishMessages of payload_size bytes arriving in
+    segment_size byte reads.
+    """
+    session = PushSession(None, 0, None)
+    session.socket = SegmentedSocket(build_frame(payload_size), segment_size)
+    start = timer()
+    for _ in range(messages):
+        buffer_read(session)
+    elapsed = timer() - start
+    return {'ops_per_sec': messages / elapsed,
+        'mb_per_sec': messages * payload_size / elapsed / 1e6}
+
+def bench_inflate(payload, iterations):
+    """
+    Uncompresses a zlib compressed payload iterations times.
+    """
+    compressed = zlib.compress(payload)
+    start = timer()
+    for _ in range(iterations):
+        zlib.decompress(compressed)
+    elapsed = timer() - start
+    return {'ops_per_sec': iterations / elapsed,
+        'mb_per_sec': iterations * len(payload) / elapsed / 1e6,
+        'ratio': float(len(payload)) / len(compressed)}
+
+def bench_callback_pool(workers, messages, payload_size):
+    """
+    Queues messages payloads for 64 sessions to a CallbackWorkerPool and
+    measures how long each waits until its callback is invoked.
+    """
+    queued   = [0.0] * messages
+    latency  = [0.0] * messages
+    finished = threading.Event()
+    state    = {'count': 0}
+    lock     = threading.Lock()
+    padding  = b'x' * max(0, payload_size - 4)
+
+    def callback(data):
+        invoked = timer()
+        index = struct.unpack_from('!L', data)[0]
+        latency[index] = invoked - queued[index]
+        with lock:
+            state['count'] += 1
+            if state['count'] == messages:
+                finished.set()
+        return True
+
+    pool = CallbackWorkerPool(None, size=workers, metrics=Metrics())
+    sessions = [PushSession(callback, monitor_id, None)
+        for monitor_id in range(64)]
+    start = timer()
+    for index in range(messages):
+        queued[index] = timer()
+        pool.queue_callback(sessions[index % len(sessions)], index % 65536,
+            struct.pack('!L', index) + padding)
+    finished.wait(60)
+    elapsed = timer() - start
+    pool.stop()
+
+    latency.sort()
+    return {'ops_per_sec': messages / elapsed,
+        'p50_us': percentile(latency, 0.5) * 1e6,
+        'p99_us': percentile(latency, 0.99) * 1e6}
+
+def bench_ack(acks, burst):
+    """
+    Has a PushClient acknowledge acks PublishMessages of a LocalServer,
+    invoking its callback with batches of burst payloads if burst is over
+    1, and measures the rate acknowledgements reach the server from the
+    time the session connected.
+    """
+    acks = max(burst, acks - acks % burst)
+    server = LocalServer(http_port=None, push_port=0, messages=acks,
+        payload_size=SMALL_SIZE, batch_size=1).start()
+    monitor_id = server.add_monitor('DeviceCore', monCompression='none')
+    client = PushClient('user', 'password', hostname='127.0.0.1',
+        secure=False, push_port=server.push_port)
+
+    def acknowledged():
+        return server.metrics.snapshot()['idigi_server_acknowledged_total']
+
+    try:
+        session = client.create_session(lambda data: True, monitor_id,
+            batch_count=burst if burst > 1 else None)
+        session.wait(60)
+        start = timer()
+        first = acknowledged()
+        deadline = start + 60
+        while acknowledged() < acks:
+            if timer() > deadline:
+                raise RuntimeError('Only %d of %d messages were '
+                    'acknowledged.' % (acknowledged(), acks))
+            time.sleep(0.001)
+        elapsed = timer() - start
+    finally:
+        client.stop_all()
+        server.stop()
+    return {'ops_per_sec': (acks - first) / elapsed}
+
+def benchmarks(scale):
+    """
+    Returns a list of (name, function) tuples of every benchmark, with
+    workloads multiplied by scale.
+    """
+    def count(value):
+        return max(1, int(value * scale))
+
+    small_batch = build_batch(100, SMALL_SIZE)
+    filedata = build_filedata(FILEDATA_SIZE)
+    suite = [
+        ('framing.small', lambda: bench_framing(SMALL_SIZE, count(100000),
+            65536)),
+        ('framing.filedata', lambda: bench_framing(FILEDATA_SIZE, count(200),
+            16384)),
+        ('inflate.small_batch', lambda: bench_inflate(small_batch,
+            count(5000))),
+        ('inflate.filedata', lambda: bench_inflate(filedata, count(200))),
+    ]
+    for workers in (1, 4, 8):
+        suite.append(('callback_pool.small.workers_%d' % workers,
+            lambda workers=workers: bench_callback_pool(workers,
+                count(20000), SMALL_SIZE)))
+    suite.append(('callback_pool.filedata.workers_4',
+        lambda: bench_callback_pool(4, count(2000), FILEDATA_SIZE)))
+    for burst in (1, 64):
+        suite.append(('ack.burst_%d' % burst,
+            lambda burst=burst: bench_ack(count(100000), burst)))
+    return suite
+
+def best(runs):
+    """
+    Returns the best value of each metric over several runs.
+    """
+    result = {}
+    for metric in runs[0]:
+        values = [run[metric] for run in runs]
+        result[metric] = max(values) if metric in HIGHER_IS_BETTER \
+            else min(values)
+    return result
+
+def spread(runs):
+    """
+    Returns the noise of each metric over several runs, the difference
+    between its best and worst value as a fraction of the best.
+    """
+    result = {}
+    for metric in runs[0]:
+        values = [run[metric] for run in runs]
+        best_value = max(values) if metric in HIGHER_IS_BETTER \
+            else min(values)
+        result[metric] = (max(values) - min(values)) / best_value \
+            if best_value else 0.0
+    return result
+
+def compare(results, noise, baseline, baseline_noise, tolerance):
+    """
+    Prints how each metric changed against a baseline and returns the list
+    of (benchmark, metric) tuples that regressed by more than tolerance
+    plus the larger of the metric's noise in either.
+    """
+    regressions = []
+    print('\n%-36s %-12s %14s %14s %8s %8s' % ('benchmark', 'metric',
+        'baseline', 'current', 'change', 'noise'))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        for metric, value in sorted(results[name].items()):
+            previous = baseline[name].get(metric)
+            if not previous or metric == 'ratio':
+                continue
+            change = (value - previous) / previous
+            if metric not in HIGHER_IS_BETTER:
+                change = -change
+            threshold = max(noise[name][metric],
+                baseline_noise.get(name, {}).get(metric, 0.0))
+            flag = ''
+            if change < -(tolerance + threshold):
+                regressions.append((name, metric))
+                flag = '  REGRESSION'
+            print('%-36s %-12s %14.1f %14.1f %+7.1f%% %7.1f%%%s' % (name,
+                metric, previous, value, change * 100, threshold * 100,
+                flag))
+    return regressions
+
+def get_parser():
+    """ Parser for this script """
+    parser = argparse.ArgumentParser(description="Hot Path Benchmarks",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('--only', dest='only',
+        help='Comma separated prefixes of the benchmarks to run, i.e. '
+            '"framing,ack".')
+
+    parser.add_argument('--repeat', '-r', dest='repeat', type=int,
+        default=MIN_REPEAT, help='Runs of each benchmark, the best of which '
+            'is reported, at least %d with --baseline.' % MIN_REPEAT)
+
+    parser.add_argument('--scale', dest='scale', type=float, default=1.0,
+        help='Multiplier of the workload sizes, i.e. 0.1 for a quick run.')
+
+    parser.add_argument('--output', '-o', dest='output',
+        help='File to write the results to as JSON.')
+
+    parser.add_argument('--baseline', '-b', dest='baseline',
+        help='JSON results to compare against.')
+
+    parser.add_argument('--tolerance', '-t', dest='tolerance', type=float,
+        default=0.15, help='Fraction a metric may worsen by against the '
+            'baseline, beyond its noise, before it counts as a regression.')
+
+    return parser
+
+def main():
+    """ Main function call """
+    parser = get_parser()
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error('--repeat must be at least 1.')
+    if args.baseline and args.repeat < MIN_REPEAT:
+        parser.error('--baseline needs a --repeat of at least %d to tell '
+            'regressions from noise.' % MIN_REPEAT)
+    prefixes = args.only.split(',') if args.only else None
+
+    results = {}
+    noise = {}
+    for name, function in benchmarks(args.scale):
+        if prefixes and not any(name.startswith(prefix)
+                for prefix in prefixes):
+            continue
+        runs = [function() for _ in range(args.repeat)]
+        results[name] = best(runs)
+        noise[name] = spread(runs)
+        print('%-36s %s' % (name, '  '.join('%s=%.1f' % item
+            for item in sorted(results[name].items()))))
+        sys.stdout.flush()
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump({'python': platform.python_version(),
+                'platform': platform.platform(), 'time': time.time(),
+                'scale': args.scale, 'repeat': args.repeat,
+                'results': results, 'noise': noise}, output, indent=2,
+                sort_keys=True)
+
+    if args.baseline:
+        with open(args.baseline) as baseline:
+            baseline = json.load(baseline)
+        if baseline.get('scale', 1.0) != args.scale:
+            print('Warning: baseline was run with --scale %s.'
+                % baseline.get('scale'))
+        if baseline.get('repeat', 1) < MIN_REPEAT:
+            print('Warning: baseline was run with --repeat %s, its noise is '
+                'not known.' % baseline.get('repeat', 1))
+        regressions = compare(results, noise, baseline['results'],
+            baseline.get('noise', {}), args.tolerance)
+        if regressions:
+            print('\n%d metric(s) regressed by more than %d%%.'
+                % (len(regressions), args.tolerance * 100))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -68,6 +68,9 @@ if __name__ == "__main__":
     try:
         callback = trace_callback
         session = client.create_session(callback, monitor)
+        # Connecting happens in the background, wait for it so that a 
+        # failure to connect is raised here.
+        session.wait(60)
         while True:
             time.sleep(3.14)
     except KeyboardInterrupt:
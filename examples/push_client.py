@@ -127,7 +127,9 @@ def main():
 
     try:
         callback = json_cb if args.format == "json" else xml_cb
-        client.create_session(callback, monitor_id)
+        # Connecting happens in the background, wait for it so that a 
+        # failure to connect is raised here.
+        client.create_session(callback, monitor_id).wait(60)
         while True:
             time.sleep(.31416)
     except KeyboardInterrupt:
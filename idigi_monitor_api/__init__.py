@@ -23,4 +23,9 @@ __author__    = 'Digi International'
 __license__   = 'MPL 2.0'
 __copyright__ = 'Copyright 2012 Digi International'
 
-from .push_client import push_client
\ No newline at end of file
+from .push_client import push_client
+try:
+    from .async_push_client import async_push_client
+except SyntaxError:
+    # asyncio support requires Python 3.5 or later.
+    pass
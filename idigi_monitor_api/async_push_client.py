@@ -0,0 +1,415 @@
+# ***************************************************************************
+# Copyright (c) 2012 Digi International Inc.,
+# All rights not expressly granted are reserved.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Digi International Inc. 11001 Bren Road East, Minnetonka, MN 55343
+#
+# ***************************************************************************
+"""
+iDigi Monitor API Library for Python, asyncio edition
+
+An :mod:`asyncio` counterpart to :class:`PushClient`.  Sessions are driven
+by a single event loop using asyncio streams, so no IO, writer or callback
+threads are created.  Requires Python 3.5 or later.
+"""
+import asyncio
+import base64
+import inspect
+import json
+import logging
+import ssl
+import struct
+import zlib
+
+from .push_client import (PUBLISH_MESSAGE, PUSH_OPEN_PORT, PUSH_SECURE_PORT,
+    IDIGI_CRT, _to_bytes, _connection_request,
+    _parse_connection_response, _parse_publish_message,
+    _publish_message_received, _monitor_request, _monitor_query)
+
+# Seconds to wait for a ConnectionResponse.
+CONNECTION_RESPONSE_TIMEOUT = 60
+
+def async_push_client(username, password, **kwargs):
+    """
+    Constructs and returns an :class:`AsyncPushClient` instance.  Accepts the
+    same parameters as :func:`push_client`.
+
+    :param username: Username to authenticate with.
+    :param password: Password to authenticate with.
+    """
+    return AsyncPushClient(username, password, **kwargs)
+
+class AsyncPushSession(object):
+    """
+    An AsyncPushSession is responsible for establishing a stream connection
+    with iDigi to receive events generated by Devices connected to iDigi.
+    Messages of a session are handed to its callback one at a time, in the
+    order they were received.
+    """
+
+    def __init__(self, callback, monitor_id, client):
+        """
+        Creates an AsyncPushSession for use with interacting with iDigi's
+        Push Functionality.
+
+        :param callback: The callback to invoke when data is received.  May
+            be a plain function or an ``async def`` coroutine function, and
+            must have 1 required parameter that will contain the payload.
+        :param monitor_id: The id of the Monitor to observe.
+        :param client: The client object this session is derived from.
+        """
+        self.callback   = callback
+        self.monitor_id = monitor_id
+        self.client     = client
+        self.reader     = None
+        self.writer     = None
+        self.closed     = False
+        self.log        = logging.getLogger("push_session[%s]" % monitor_id)
+
+        # Task consuming PublishMessages.
+        self.__task     = None
+
+    async def send_connection_request(self):
+        """
+        Sends a ConnectionRequest to the iDigi server and waits for the
+        ConnectionResponse.
+        """
+        self.log.info("Sending ConnectionRequest for Monitor %s."
+            % self.monitor_id)
+        self.writer.write(_connection_request(self.client.username,
+            self.client.password, self.monitor_id))
+
+        # If the response does not arrive within the timeout,
+        # asyncio.TimeoutError is raised.
+        response = await asyncio.wait_for(self.reader.readexactly(10),
+            CONNECTION_RESPONSE_TIMEOUT)
+
+        status_code = _parse_connection_response(response)
+        self.log.info("Got ConnectionResponse for Monitor %s. Status %s."
+            % (self.monitor_id, status_code))
+
+    async def start(self):
+        """
+        Opens a connection to the iDigi Server, sends a ConnectionRequest
+        message and starts consuming PublishMessages.
+        """
+        await self.__connect()
+        self.__task = asyncio.ensure_future(self.__consume())
+
+    async def __connect(self):
+        """
+        Opens the stream connection and performs the ConnectionRequest
+        handshake.
+        """
+        if self.writer is not None:
+            raise Exception("Stream already established for %s." % self)
+
+        if self.client.secure:
+            self.log.info("Starting SSL Session for Monitor %s."
+                % self.monitor_id)
+            self.reader, self.writer = await asyncio.open_connection(
+                self.client.push_host,
+                self.client.push_port or PUSH_SECURE_PORT,
+                ssl=self.client.ssl_context,
+                server_hostname=self.client.push_host)
+        else:
+            self.log.info("Starting Insecure Session for Monitor %s."
+                % self.monitor_id)
+            self.reader, self.writer = await asyncio.open_connection(
+                self.client.push_host,
+                self.client.push_port or PUSH_OPEN_PORT)
+
+        try:
+            await self.send_connection_request()
+        except BaseException:
+            self.__close()
+            raise
+
+    async def __consume(self):
+        """
+        Reads PublishMessages until the session is stopped, restarting the
+        connection if the server closes it.
+        """
+        while not self.closed:
+            try:
+                await self.__read_messages()
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                if self.closed:
+                    break
+                self.log.error("Socket closed for Monitor %s: %r."
+                    % (self.monitor_id, err))
+
+            self.__close()
+            while not self.closed:
+                self.log.info("Attempting restart session for Monitor Id %s."
+                    % self.monitor_id)
+                try:
+                    await self.__connect()
+                    break
+                except asyncio.CancelledError:
+                    raise
+                except Exception as err:
+                    self.log.exception(err)
+                    await asyncio.sleep(self.client.reconnect_delay)
+
+    async def __read_messages(self):
+        """
+        Reads PublishMessages off the stream and invokes the callback for
+        each one, acknowledging those the callback accepts.
+        """
+        while True:
+            header = await self.reader.readexactly(6)
+            response_type, message_length = struct.unpack('!HL', header)
+            data = await self.reader.readexactly(message_length)
+
+            if response_type != PUBLISH_MESSAGE:
+                self.log.warning("Response Type (%x) does not match "
+                    "PublishMessage (%x)" % (response_type, PUBLISH_MESSAGE))
+                continue
+
+            block_id, compression, payload = _parse_publish_message(data)
+            if compression == 0x01:
+                # Data is compressed, uncompress it.
+                payload = zlib.decompress(payload)
+            else:
+                payload = bytes(payload)
+
+            try:
+                result = self.callback(payload)
+                if inspect.isawaitable(result):
+                    result = await result
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                self.log.exception(err)
+                continue
+
+            if result:
+                # Send a Successful PublishMessageReceived with the
+                # block id sent in request.
+                self.writer.write(_publish_message_received(block_id))
+                await self.writer.drain()
+
+    def __close(self):
+        """
+        Closes the stream, if open.
+        """
+        if self.writer is not None:
+            self.writer.close()
+            self.reader = None
+            self.writer = None
+
+    async def stop(self):
+        """
+        Closes the connection associated with this session and waits for its
+        consuming task to finish.
+        """
+        self.closed = True
+        task, self.__task = self.__task, None
+        if task is not None:
+            task.cancel()
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self.__close()
+
+class AsyncPushClient(object):
+    """
+    An asyncio Client for the 'Push' feature in iDigi.
+    """
+
+    def __init__(self, username, password, hostname='developer.idigi.com',
+                secure=True, ca_certs=None, reconnect_delay=1.0,
+                push_port=None, check_hostname=True):
+        """
+        Creates an Async Push Client for use in creating monitors and creating
+        sessions for them.
+
+        :param username: Username to authenticate with.
+        :param password: Password to authenticate with.
+        :param hostname: Hostname of iDigi server to connect to, optionally
+            with the port of its web services (i.e. 'localhost:8080').
+        :param secure: Whether or not to create a secure SSL wrapped session.
+        :param ca_certs: Path to a file containing Certificates.
+            If not provided, the idigi.crt file provided with the module will
+            be used.  In most cases, the idigi.crt file should be acceptable.
+            Web services are validated against ca_certs if provided, with
+            host names checked, or the platform's trusted certificates.
+        :param reconnect_delay: Seconds to wait between failed attempts to
+            restart a session.
+        :param push_port: Port sessions connect to, PUSH_SECURE_PORT or
+            PUSH_OPEN_PORT by default.
+        :param check_hostname: Whether secure push sessions check that the
+            server's certificate names hostname.  Only turn this off for
+            servers whose certificate does not.
+        """
+        self.hostname        = hostname
+        # Sessions connect to the host without any web services port.
+        self.push_host       = hostname.partition(':')[0]
+        self.push_port       = push_port
+        self.username        = username
+        self.password        = password
+        self.secure          = secure
+        self.ca_certs        = ca_certs if ca_certs is not None else IDIGI_CRT
+        self.reconnect_delay = reconnect_delay
+
+        # Sessions created by this client.
+        self.sessions        = []
+        self.log             = logging.getLogger('push_client')
+
+        self.headers         = {
+            'Authorization': 'Basic ' \
+            + base64.b64encode(_to_bytes('%s:%s' %
+                (self.username, self.password))).decode('ascii')
+        }
+
+        # Push sessions validate the server against ca_certs, in the same
+        # manner as SecurePushSession.
+        self.ssl_context = ssl.create_default_context(cafile=self.ca_certs)
+        self.ssl_context.check_hostname = check_hostname
+        # Web services are validated against the platform's trusted
+        # certificates, or ca_certs if given, with host names checked.
+        self.http_ssl_context = ssl.create_default_context(cafile=ca_certs)
+
+    async def request(self, method, url, body=None):
+        """
+        Performs a request against the iDigi web services and returns a
+        tuple of status, headers (with lower-cased names) and body.
+
+        :param method: HTTP method (i.e. 'GET').
+        :param url: Path and query to request (i.e. '/ws/Monitor').
+        :param body: Optional request body.
+        """
+        host, _, port = self.hostname.partition(':')
+        if self.secure:
+            reader, writer = await asyncio.open_connection(host,
+                int(port or 443), ssl=self.http_ssl_context,
+                server_hostname=host)
+        else:
+            reader, writer = await asyncio.open_connection(host,
+                int(port or 80))
+
+        try:
+            body = _to_bytes(body) if body is not None else b''
+            lines = ['%s %s HTTP/1.1' % (method, url),
+                     'Host: %s' % self.hostname,
+                     'Connection: close',
+                     'Content-Length: %d' % len(body)]
+            lines.extend('%s: %s' % item for item in self.headers.items())
+            writer.write(_to_bytes('\r\n'.join(lines) + '\r\n\r\n') + body)
+
+            status_line = await reader.readline()
+            status = int(status_line.split()[1])
+
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+
+            if headers.get('transfer-encoding', '').lower() == 'chunked':
+                content = b''
+                while True:
+                    size = int((await reader.readline()).split(b';')[0], 16)
+                    if size == 0:
+                        break
+                    content += await reader.readexactly(size)
+                    await reader.readline()
+            elif 'content-length' in headers:
+                content = await reader.readexactly(
+                    int(headers['content-length']))
+            else:
+                content = await reader.read()
+
+            return status, headers, content
+        finally:
+            writer.close()
+
+    async def create_monitor(self, topics, batch_size=1, batch_duration=0,
+        compression='gzip', format_type='json'):
+        """
+        Creates a Monitor instance in iDigi for a given list of topics.  See
+        :meth:`PushClient.create_monitor` for parameters.
+
+        Returns a string of the created Monitor Id (i.e. 9001)
+        """
+        request = _monitor_request(topics, batch_size, batch_duration,
+            compression, format_type)
+
+        status, headers, content = await self.request('POST', '/ws/Monitor',
+            request)
+        if status == 201:
+            return headers['location'].split('/')[-1]
+        raise Exception("Monitor Could not be Created (%d): %s" \
+            % (status, content))
+
+    async def delete_monitor(self, monitor_id):
+        """
+        Attempts to Delete a Monitor from iDigi.  Throws exception if
+        Monitor does not exist.
+
+        :param monitor_id: id of the Monitor (i.e. 1000).
+        """
+        status, _, content = await self.request('DELETE',
+            '/ws/Monitor/%s' % monitor_id)
+        if status != 200:
+            raise Exception("Monitor Could not be Deleted (%s): %s" \
+                % (status, content))
+
+    async def get_monitor(self, topics):
+        """
+        Attempts to find a Monitor in iDigi that matches the input list of
+        topics.
+
+        :param topics: a string list of topics
+            (i.e. ['DeviceCore[U]', 'FileDataCore']).
+
+        Returns a monitor ID if found, otherwise None.
+        """
+        status, _, content = await self.request('GET', _monitor_query(topics))
+        if status != 200:
+            raise Exception("Monitor Could not be Retrieved (%s): %s" \
+                % (status, content))
+
+        monitor_data = json.loads(content.decode('utf-8'))
+
+        # If no matching Monitor found, return None.
+        if monitor_data['resultSize'] == '0':
+            return None
+        # Otherwise grab the first found monitor's id.
+        return monitor_data['items'][0]['monId']
+
+    async def create_session(self, callback, monitor_id):
+        """
+        Creates and Returns an AsyncPushSession once its ConnectionRequest
+        has been accepted.  When data is received, callback will be invoked.
+
+        :param callback: Callback function or coroutine function to call when
+            PublishMessage messages are received.  Expects 1 argument which
+            will contain the payload of the pushed message.  Additionally,
+            expects it to return (or resolve to) True if it was able to
+            process the message, False or None otherwise.
+        :param monitor_id: The id of the Monitor.
+        """
+        self.log.info("Creating Session for Monitor %s." % monitor_id)
+        session = AsyncPushSession(callback, monitor_id, self)
+        await session.start()
+        self.sessions.append(session)
+        return session
+
+    async def stop_all(self):
+        """
+        Stops all session activity.
+        """
+        sessions, self.sessions = self.sessions, []
+        await asyncio.gather(*[session.stop() for session in sessions])
+        self.log.info("All sessions stopped.")
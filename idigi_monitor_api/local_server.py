@@ -0,0 +1,787 @@
+# ***************************************************************************
+# Copyright (c) 2012 Digi International Inc.,
+# All rights not expressly granted are reserved.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Digi International Inc. 11001 Bren Road East, Minnetonka, MN 55343
+#
+# ***************************************************************************
+"""
+A local stand-in for the iDigi server, used to measure the throughput,
+latency and reconnect behavior of push clients repeatably on one machine.
+
+:class:`LocalServer` implements the /ws/Monitor web services used by
+:meth:`PushClient.create_monitor`, :meth:`PushClient.get_monitor`,
+:meth:`PushClient.list_monitors` and :meth:`PushClient.delete_monitor`,
+and the push protocol on plain and (given a certificate) SSL ports.  Each
+push connection is sent PublishMessages at a configurable rate, shaped by
+its Monitor's batch size, format and compression, and the
+PublishMessageReceived acknowledgements coming back are tracked.
+
+Run as a module for a standalone server, call with '-h' for usage::
+
+    python -m idigi_monitor_api.local_server --rate 1000
+"""
+import argparse
+import base64
+import errno
+import json
+import logging
+import re
+import select
+import socket
+import ssl
+import struct
+import threading
+import time
+import zlib
+
+from .metrics import Metrics
+from .push_client import (CONNECTION_REQUEST, CONNECTION_RESPONSE,
+    FORMAT_JSON, FORMAT_XML, PUBLISH_MESSAGE, PUBLISH_MESSAGE_RECEIVED,
+    PUSH_OPEN_PORT, PUSH_SECURE_PORT, STATUS_BAD_REQUEST, STATUS_OK,
+    STATUS_UNAUTHORIZED)
+from .splitter import ElementTree
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import (BaseRequestHandler, ThreadingMixIn,
+        ThreadingTCPServer)
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    # Python 3
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import (BaseRequestHandler, ThreadingMixIn,
+        ThreadingTCPServer)
+    from urllib.parse import parse_qs, urlparse
+
+LOG = logging.getLogger('local_server')
+
+# Ports the web services are served on by default, over plain HTTP and
+# (given a certificate) HTTPS.
+DEFAULT_HTTP_PORT = 8080
+DEFAULT_HTTPS_PORT = 8443
+
+# Customer id the topics of published Msgs start with.
+CUSTOMER_ID = 1
+
+# Most bytes of PublishMessages written at once when publishing without a
+# rate limit.
+WRITE_CHUNK_SIZE = 65536
+
+def _recv_exactly(sock, size):
+    """
+    Reads exactly size bytes off a blocking socket, or returns None if the
+    connection closed first.
+    """
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            return None
+        data += chunk
+    return data
+
+def _parse_connection_request(body):
+    """
+    Returns the username, password and monitor id of a ConnectionRequest
+    body.
+
+    :param body: The ConnectionRequest, following its 6 byte header.
+    """
+    offset = 2
+    username_length = struct.unpack_from('!H', body, offset)[0]
+    offset += 2
+    username = body[offset:offset + username_length].decode('utf-8')
+    offset += username_length
+    password_length = struct.unpack_from('!H', body, offset)[0]
+    offset += 2
+    password = body[offset:offset + password_length].decode('utf-8')
+    offset += password_length
+    monitor_id = struct.unpack_from('!L', body, offset)[0]
+    return username, password, monitor_id
+
+def _monitor_topic(monitor):
+    """
+    Returns the topic published Msgs of a Monitor have, the first of its
+    topics without any options (i.e. 'DeviceCore' for 'DeviceCore[U]').
+    """
+    topic = monitor['monTopic'].split(',')[0].strip()
+    return re.sub(r'\[.*?\]', '', topic).strip('/') or 'DeviceCore'
+
+def _document(monitor, count, payload_size):
+    """
+    Returns the payload of a PublishMessage holding count Msgs, each padded
+    to roughly payload_size bytes, in the Monitor's format.
+
+    :param monitor: The Monitor being published, as a dict of its fields.
+    :param count: Number of Msgs in the Document.
+    :param payload_size: Approximate size of each Msg.
+    """
+    topic = _monitor_topic(monitor)
+    timestamp = time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime())
+    messages = []
+    for index in range(count):
+        messages.append({
+            'timestamp': timestamp,
+            'topic': '%d/%s/%d/0' % (CUSTOMER_ID, topic, index),
+            'operation': 'INSERTION',
+            'group': '*',
+            'replay': 'false',
+            'pad': ''
+        })
+
+    if monitor.get('monFormatType') == 'xml':
+        document = ElementTree.Element('Document')
+        for message in messages:
+            element = ElementTree.SubElement(document, 'Msg')
+            for name, value in message.items():
+                ElementTree.SubElement(element, name).text = value
+        size = len(ElementTree.tostring(document)) // count
+        for element in document.findall('Msg'):
+            element.find('pad').text = 'x' * max(0, payload_size - size)
+        return ElementTree.tostring(document)
+
+    size = len(json.dumps(messages[0]))
+    for message in messages:
+        message['pad'] = 'x' * max(0, payload_size - size)
+    body = messages[0] if count == 1 else messages
+    return json.dumps({'Document': {'Msg': body}}).encode('utf-8')
+
+class _RestHandler(BaseHTTPRequestHandler):
+    """
+    Serves the /ws/Monitor web services out of the LocalServer's Monitors.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        LOG.debug(format % args)
+
+    def __reply(self, status, body=b'', headers=()):
+        """
+        Sends a response with a body.
+        """
+        if not isinstance(body, bytes):
+            body = body.encode('utf-8')
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def __authorized(self):
+        """
+        Checks the request's basic authentication against the server's
+        credentials, replying 401 if they do not match.
+        """
+        if self.server.local.username is None:
+            return True
+        expected = 'Basic ' + base64.b64encode(('%s:%s' % (
+            self.server.local.username, self.server.local.password))
+            .encode('utf-8')).decode('ascii')
+        if self.headers.get('Authorization') == expected:
+            return True
+        self.__reply(401, 'Unauthorized',
+            [('WWW-Authenticate', 'Basic realm="iDigi"')])
+        return False
+
+    def __body(self):
+        """
+        Reads the request body.
+        """
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def __monitor_id(self, path):
+        """
+        Returns the Monitor id a /ws/Monitor/<id> path refers to, or None.
+        """
+        match = re.match(r'^/ws/Monitor/(\d+)', path)
+        return int(match.group(1)) if match else None
+
+    def do_POST(self):
+        body = self.__body()
+        if not self.__authorized():
+            return
+        if urlparse(self.path).path.rstrip('/') != '/ws/Monitor':
+            self.__reply(404, 'Not Found')
+            return
+
+        try:
+            root = ElementTree.fromstring(body)
+        except Exception as exception:
+            self.__reply(400, 'Invalid Monitor: %s' % exception)
+            return
+        fields = dict((element.tag, element.text or '')
+            for element in root)
+        if not fields.get('monTopic'):
+            self.__reply(400, 'monTopic is required.')
+            return
+
+        monitor_id = self.server.local.add_monitor(**fields)
+        self.__reply(201, headers=[('Location', 'Monitor/%d' % monitor_id)])
+
+    def do_DELETE(self):
+        self.__body()
+        if not self.__authorized():
+            return
+        monitor_id = self.__monitor_id(self.path)
+        if monitor_id is None \
+            or not self.server.local.remove_monitor(monitor_id):
+            self.__reply(404, 'Monitor not found.')
+            return
+        self.__reply(200)
+
+    def do_GET(self):
+        if not self.__authorized():
+            return
+        url = urlparse(self.path)
+        if not url.path.startswith('/ws/Monitor'):
+            self.__reply(404, 'Not Found')
+            return
+
+        query = parse_qs(url.query)
+        monitors = self.server.local.list_monitors()
+        monitor_id = self.__monitor_id(url.path)
+        if monitor_id is not None:
+            monitors = [monitor for monitor in monitors
+                if monitor['monId'] == str(monitor_id)]
+        if 'condition' in query:
+            match = re.match(r"^\s*(\w+)\s*=\s*'(.*)'\s*$",
+                query['condition'][0])
+            if match is None:
+                self.__reply(400, 'Unsupported condition.')
+                return
+            monitors = [monitor for monitor in monitors
+                if monitor.get(match.group(1)) == match.group(2)]
+
+        start = int(query.get('start', ['0'])[0])
+        size = int(query.get('size', ['1000'])[0])
+        page = monitors[start:start + size]
+        self.__reply(200, json.dumps({
+            'resultTotalRows': str(len(monitors)),
+            'requestedStartRow': str(start),
+            'resultSize': str(len(page)),
+            'requestedSize': str(size),
+            'remainingSize': str(max(0, len(monitors) - start - len(page))),
+            'items': page
+        }), [('Content-Type', 'application/json')])
+
+class _RestServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, local, context=None):
+        self.local = local
+        self.context = context
+        HTTPServer.__init__(self, address, _RestHandler)
+
+    def get_request(self):
+        sock, address = self.socket.accept()
+        if self.context is not None:
+            # The TLS handshake is done by the request's thread.
+            sock = self.context.wrap_socket(sock, server_side=True,
+                do_handshake_on_connect=False)
+        return sock, address
+
+    def handle_error(self, request, client_address):
+        # Clients dropping connections are routine, keep them out of stderr.
+        LOG.debug("Error serving %s:%s." % client_address, exc_info=True)
+
+class _PushHandler(BaseRequestHandler):
+    """
+    Serves one push connection: the ConnectionRequest handshake, then
+    PublishMessages until the connection closes, reading acknowledgements
+    as they arrive.
+    """
+
+    def setup(self):
+        self.local = self.server.local
+        self.sock = self.request
+        # Send times of the blocks not yet acknowledged, by block id.
+        self.outstanding = {}
+        self.buffer = b''
+
+    def handle(self):
+        local = self.local
+        if isinstance(self.sock, ssl.SSLSocket):
+            try:
+                self.sock.do_handshake()
+            except (ssl.SSLError, socket.error) as err:
+                LOG.debug("TLS handshake failed: %s" % err)
+                return
+
+        if local.reject:
+            return
+        monitor = self.__handshake()
+        if monitor is None:
+            return
+
+        local.connection_opened(self)
+        try:
+            self.__publish(monitor)
+        except (socket.error, ssl.SSLError) as err:
+            if err.args[0] not in (errno.EPIPE, errno.ECONNRESET):
+                LOG.debug("Push connection failed: %s" % err)
+        finally:
+            local.connection_closed(self)
+
+    def __handshake(self):
+        """
+        Reads the ConnectionRequest and answers it.  Returns the Monitor
+        the connection is for, or None if it was refused.
+        """
+        header = _recv_exactly(self.sock, 6)
+        if header is None:
+            return None
+        message_type, length = struct.unpack('!HL', header)
+        body = _recv_exactly(self.sock, length)
+        if message_type != CONNECTION_REQUEST or body is None:
+            return None
+
+        username, password, monitor_id = _parse_connection_request(body)
+        monitor = self.local.monitors.get(monitor_id)
+        if self.local.username is not None and (username, password) \
+            != (self.local.username, self.local.password):
+            status = STATUS_UNAUTHORIZED
+        elif monitor is None:
+            status = STATUS_BAD_REQUEST
+        else:
+            status = STATUS_OK
+
+        self.sock.sendall(struct.pack('!HLHH', CONNECTION_RESPONSE, 4,
+            status, 1))
+        return monitor if status == STATUS_OK else None
+
+    def __publish(self, monitor):
+        """
+        Sends PublishMessages at the server's rate until its message limit
+        or an injected disconnect, then waits for the client to close.
+        """
+        local = self.local
+        batch_size = local.batch_size \
+            or max(1, int(monitor.get('monBatchSize') or 1))
+        compressed = monitor.get('monCompression') in ('gzip', 'zlib')
+        format_type = FORMAT_XML if monitor.get('monFormatType') == 'xml' \
+            else FORMAT_JSON
+        payload = _document(monitor, batch_size, local.payload_size)
+        if compressed:
+            payload = zlib.compress(payload)
+        body_header = struct.pack('!HL', PUBLISH_MESSAGE, 10 + len(payload))
+
+        sent = 0
+        started = time.time()
+        while not local.stopped:
+            limit = local.messages
+            if local.disconnect_after is not None \
+                and (limit is None or local.disconnect_after < limit):
+                limit = local.disconnect_after
+            if limit is not None and sent >= limit:
+                if limit == local.disconnect_after:
+                    local.disconnect_injected()
+                    self.disconnect()
+                    return
+                if self.__wait_for_acks(None):
+                    return
+                continue
+
+            # Number of messages due by now.
+            rate = local.rate
+            if rate:
+                due = int((time.time() - started) * rate) + 1 - sent
+            else:
+                due = max(1, WRITE_CHUNK_SIZE // (len(payload) + 16))
+            if limit is not None:
+                due = min(due, limit - sent)
+
+            if due > 0:
+                frames = []
+                now = time.time()
+                for _ in range(due):
+                    block_id = sent % 65536
+                    self.outstanding[block_id] = now
+                    frames.append(body_header + struct.pack('!HHBBL',
+                        block_id, batch_size, 0x01 if compressed else 0x00,
+                        format_type, len(payload)) + payload)
+                    sent += 1
+                data = b''.join(frames)
+                self.sock.sendall(data)
+                local.published(due, len(data))
+
+            timeout = 0
+            if rate:
+                timeout = max(0, started + float(sent) / rate - time.time())
+            if self.__wait_for_acks(timeout):
+                return
+
+    def __wait_for_acks(self, timeout):
+        """
+        Waits up to timeout seconds (until the server stops if None) for
+        acknowledgements and records those that arrived.  Returns True if
+        the connection closed.
+        """
+        if timeout is None:
+            timeout = 0.5
+        pending = isinstance(self.sock, ssl.SSLSocket) \
+            and self.sock.pending() > 0
+        if not pending:
+            readable = select.select([self.sock], [], [], timeout)[0]
+            if not readable:
+                return False
+
+        self.sock.setblocking(False)
+        try:
+            data = self.sock.recv(65536)
+        except ssl.SSLError as err:
+            if err.args[0] in (ssl.SSL_ERROR_WANT_READ,
+                               ssl.SSL_ERROR_WANT_WRITE):
+                return False
+            raise
+        except socket.error as err:
+            if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return False
+            raise
+        finally:
+            self.sock.setblocking(True)
+        if not data:
+            return True
+
+        self.buffer += data
+        now = time.time()
+        count = len(self.buffer) // 6
+        for index in range(count):
+            message_type, block_id, status = struct.unpack_from('!HHH',
+                self.buffer, index * 6)
+            if message_type != PUBLISH_MESSAGE_RECEIVED:
+                continue
+            sent_at = self.outstanding.pop(block_id, None)
+            if sent_at is not None:
+                self.local.acknowledged(now - sent_at, status == STATUS_OK)
+        self.buffer = self.buffer[count * 6:]
+        return False
+
+    def disconnect(self):
+        """
+        Closes the connection abruptly, as a lost connection would.
+        """
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass
+
+class _PushServer(ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, address, local, context=None):
+        self.local = local
+        self.context = context
+        ThreadingTCPServer.__init__(self, address, _PushHandler)
+
+    def get_request(self):
+        sock, address = self.socket.accept()
+        if self.context is not None:
+            # The TLS handshake is done by the connection's thread.
+            sock = self.context.wrap_socket(sock, server_side=True,
+                do_handshake_on_connect=False)
+        return sock, address
+
+    def handle_error(self, request, client_address):
+        # Clients dropping connections are routine, keep them out of stderr.
+        LOG.debug("Error serving %s:%s." % client_address, exc_info=True)
+
+class LocalServer(object):
+    """
+    A local stand-in for the iDigi server's Monitor web services and push
+    protocol.
+
+    Publishing is configured by attributes that may be changed while the
+    server runs: rate, messages, payload_size, batch_size,
+    disconnect_after and reject.  Every connection publishes the same
+    payload, built from its Monitor when it connects, under increasing
+    block ids.
+    """
+
+    def __init__(self, host='127.0.0.1', http_port=DEFAULT_HTTP_PORT,
+        push_port=PUSH_OPEN_PORT, secure_port=PUSH_SECURE_PORT,
+        certfile=None, keyfile=None, username=None, password=None,
+        rate=None, messages=None, payload_size=256, batch_size=None,
+        disconnect_after=None, https_port=DEFAULT_HTTPS_PORT):
+        """
+        Creates a LocalServer, see :meth:`start`.  Ports of 0 are picked by
+        the system and set once started.
+
+        :param host: Address to listen on.
+        :param http_port: Port of the web services over HTTP, None to not
+            serve them.
+        :param push_port: Port of the plain push protocol, None to not
+            serve it.
+        :param secure_port: Port of the SSL push protocol, only served if
+            certfile is provided.
+        :param certfile: Path to the certificate (in PEM format) of the SSL
+            push port.  Clients need it as their ca_certs.
+        :param keyfile: Path to the certificate's private key, if it is not
+            in certfile.
+        :param username: Username clients must authenticate with, any
+            credentials are accepted if None.
+        :param password: Password clients must authenticate with.
+        :param rate: PublishMessages sent per second on each connection,
+            as fast as the connection allows if None.
+        :param messages: PublishMessages sent on each connection, unlimited
+            if None.
+        :param payload_size: Approximate size in bytes of each Msg, before
+            compression.
+        :param batch_size: Msgs per PublishMessage, the Monitor's
+            monBatchSize if None.
+        :param disconnect_after: If set, connections are closed abruptly
+            after sending this many PublishMessages.
+        :param https_port: Port of the web services over HTTPS, as used by
+            secure clients, only served if certfile is provided.
+        """
+        self.host             = host
+        self.http_port        = http_port
+        self.https_port       = https_port if certfile is not None else None
+        self.push_port        = push_port
+        self.secure_port      = secure_port if certfile is not None else None
+        self.certfile         = certfile
+        self.keyfile          = keyfile
+        self.username         = username
+        self.password         = password
+        self.rate             = rate
+        self.messages         = messages
+        self.payload_size     = payload_size
+        self.batch_size       = batch_size
+        self.disconnect_after = disconnect_after
+        # Whether push connections are closed without a ConnectionResponse.
+        self.reject           = False
+        self.stopped          = False
+
+        # Monitors by id, as dicts of their fields.
+        self.monitors         = {}
+        self.__next_id        = 0
+        self.__lock           = threading.Lock()
+        # Push connections being served.
+        self.__connections    = set()
+        self.__servers        = []
+        self.log              = LOG
+
+        self.metrics          = Metrics()
+        self.__connected      = self.metrics.counter(
+            'idigi_server_connections_total', 'Push connections accepted.')
+        self.__published      = self.metrics.counter(
+            'idigi_server_published_total', 'PublishMessages sent.')
+        self.__bytes_sent     = self.metrics.counter(
+            'idigi_server_sent_bytes_total', 'Bytes of PublishMessages sent.')
+        self.__acknowledged   = self.metrics.counter(
+            'idigi_server_acknowledged_total',
+            'PublishMessages acknowledged with STATUS_OK.')
+        self.__rejected       = self.metrics.counter(
+            'idigi_server_rejected_total',
+            'PublishMessages acknowledged with an error status.')
+        self.__disconnects    = self.metrics.counter(
+            'idigi_server_injected_disconnects_total',
+            'Connections closed by disconnect_after or disconnect_all.')
+        self.__ack_seconds    = self.metrics.histogram(
+            'idigi_server_ack_latency_seconds',
+            'Seconds from sending a PublishMessage to its acknowledgement.')
+        self.metrics.gauge('idigi_server_connections',
+            'Push connections open.', lambda: len(self.__connections))
+
+    def start(self):
+        """
+        Starts serving in background threads and returns the server.
+        """
+        context = None
+        if self.certfile is not None:
+            context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER',
+                ssl.PROTOCOL_SSLv23))
+            context.load_cert_chain(self.certfile, self.keyfile)
+
+        if self.http_port is not None:
+            self.http_port = self.__serve(
+                _RestServer((self.host, self.http_port), self))
+        if self.https_port is not None:
+            self.https_port = self.__serve(
+                _RestServer((self.host, self.https_port), self, context))
+        if self.push_port is not None:
+            self.push_port = self.__serve(
+                _PushServer((self.host, self.push_port), self))
+        if self.secure_port is not None:
+            self.secure_port = self.__serve(
+                _PushServer((self.host, self.secure_port), self, context))
+        self.log.info("Serving on %s, web services on ports %s and %s, push "
+            "on ports %s and %s." % (self.host, self.http_port,
+                self.https_port, self.push_port, self.secure_port))
+        return self
+
+    def __serve(self, server):
+        """
+        Runs a server in a thread of its own and returns its port.
+        """
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        self.__servers.append(server)
+        return server.server_address[1]
+
+    def stop(self):
+        """
+        Stops serving and closes every connection.
+        """
+        self.stopped = True
+        for server in self.__servers:
+            server.shutdown()
+            server.server_close()
+        self.__servers = []
+        for connection in self.connections():
+            connection.disconnect()
+
+    def add_monitor(self, monTopic, monBatchSize='1', monBatchDuration='0',
+        monFormatType='json', monCompression='gzip', **fields):
+        """
+        Creates a Monitor and returns its id.  Takes the fields of a
+        Monitor, as POSTed to /ws/Monitor.
+        """
+        with self.__lock:
+            self.__next_id += 1
+            monitor_id = self.__next_id
+            monitor = dict(fields)
+            monitor.update({
+                'monId': str(monitor_id),
+                'monTopic': monTopic,
+                'monBatchSize': str(monBatchSize),
+                'monBatchDuration': str(monBatchDuration),
+                'monFormatType': monFormatType,
+                'monCompression': monCompression,
+                'monStatus': 'ACTIVE'
+            })
+            self.monitors[monitor_id] = monitor
+        return monitor_id
+
+    def remove_monitor(self, monitor_id):
+        """
+        Deletes a Monitor.  Returns False if there was no such Monitor.
+        """
+        with self.__lock:
+            return self.monitors.pop(int(monitor_id), None) is not None
+
+    def list_monitors(self):
+        """
+        Returns every Monitor, ordered by id.
+        """
+        with self.__lock:
+            return [self.monitors[monitor_id]
+                for monitor_id in sorted(self.monitors)]
+
+    def connections(self):
+        """
+        Returns the push connections being served.
+        """
+        with self.__lock:
+            return list(self.__connections)
+
+    def disconnect_all(self):
+        """
+        Closes every push connection abruptly, as a network failure would.
+        """
+        for connection in self.connections():
+            self.disconnect_injected()
+            connection.disconnect()
+
+    def connection_opened(self, connection):
+        """
+        Called by a push connection once its handshake succeeded.
+        """
+        with self.__lock:
+            self.__connections.add(connection)
+        self.__connected.inc()
+
+    def connection_closed(self, connection):
+        """
+        Called by a push connection once it is done.
+        """
+        with self.__lock:
+            self.__connections.discard(connection)
+
+    def published(self, count, size):
+        """
+        Records PublishMessages sent, count of them in size bytes.
+        """
+        self.__published.inc(count)
+        self.__bytes_sent.inc(size)
+
+    def acknowledged(self, latency, ok):
+        """
+        Records a PublishMessageReceived, latency seconds after its
+        PublishMessage was sent, and whether its status was STATUS_OK.
+        """
+        self.__ack_seconds.observe(latency)
+        if ok:
+            self.__acknowledged.inc()
+        else:
+            self.__rejected.inc()
+
+    def disconnect_injected(self):
+        """
+        Records a connection closed on purpose.
+        """
+        self.__disconnects.inc()
+
+def main():
+    """
+    Runs a LocalServer until interrupted, then prints its metrics.
+    """
+    parser = argparse.ArgumentParser(
+        description="Local stand-in iDigi server for push clients.")
+    parser.add_argument('--host', default='127.0.0.1',
+        help='address to listen on')
+    parser.add_argument('--http-port', type=int, default=DEFAULT_HTTP_PORT,
+        help='port of the /ws/Monitor web services')
+    parser.add_argument('--https-port', type=int, default=DEFAULT_HTTPS_PORT,
+        help='port of the web services over HTTPS, served with --certfile')
+    parser.add_argument('--push-port', type=int, default=PUSH_OPEN_PORT,
+        help='port of the plain push protocol')
+    parser.add_argument('--secure-port', type=int, default=PUSH_SECURE_PORT,
+        help='port of the SSL push protocol, served with --certfile')
+    parser.add_argument('--certfile', help='PEM certificate for SSL')
+    parser.add_argument('--keyfile', help='private key of the certificate')
+    parser.add_argument('--username', help='required username')
+    parser.add_argument('--password', help='required password')
+    parser.add_argument('--rate', type=float,
+        help='PublishMessages per second per connection (default: no limit)')
+    parser.add_argument('--messages', type=int,
+        help='PublishMessages per connection (default: no limit)')
+    parser.add_argument('--payload-size', type=int, default=256,
+        help='approximate bytes per Msg')
+    parser.add_argument('--batch-size', type=int,
+        help='Msgs per PublishMessage (default: the Monitor\'s)')
+    parser.add_argument('--disconnect-after', type=int,
+        help='close connections after this many PublishMessages')
+    parser.add_argument('--monitors', type=int, default=0,
+        help='number of DeviceCore Monitors to create up front')
+    parser.add_argument('--debug', action='store_true')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.DEBUG if args.debug else logging.INFO)
+    server = LocalServer(args.host, args.http_port, args.push_port,
+        args.secure_port, args.certfile, args.keyfile, args.username,
+        args.password, args.rate, args.messages, args.payload_size,
+        args.batch_size, args.disconnect_after, args.https_port)
+    for _ in range(args.monitors):
+        server.add_monitor('DeviceCore')
+    server.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        print(server.metrics.prometheus())
+
+if __name__ == '__main__':
+    main()
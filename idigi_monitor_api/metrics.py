@@ -0,0 +1,257 @@
+# ***************************************************************************
+# Copyright (c) 2012 Digi International Inc.,
+# All rights not expressly granted are reserved.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Digi International Inc. 11001 Bren Road East, Minnetonka, MN 55343
+#
+# ***************************************************************************
+"""
+Instrumentation of the push pipeline.
+
+A :class:`Metrics` registry holds counters and latency histograms updated
+as data flows through a :class:`PushClient`, plus collectors that report
+values computed when read (i.e. queue depths and per session counters).
+It can be read as a dict with :meth:`Metrics.snapshot` or rendered in the
+Prometheus text exposition format with :meth:`Metrics.prometheus`.
+"""
+from bisect import bisect_left
+from threading import Lock
+
+# Upper bounds, in seconds, of the buckets latency histograms count into.
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+def _format_value(value):
+    """
+    Formats a sample value for the Prometheus text format.
+    """
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else repr(value)
+    return str(value)
+
+def _format_labels(labels):
+    """
+    Formats a dict of labels for the Prometheus text format.
+    """
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (name, str(value)
+        .replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in sorted(labels.items()))
+
+class Counter(object):
+    """
+    A thread safe, monotonically increasing count.
+    """
+
+    def __init__(self, name, help):
+        """
+        :param name: Name of the metric.
+        :param help: Description of the metric.
+        """
+        self.name   = name
+        self.help   = help
+        self.type   = 'counter'
+        self.value  = 0
+        self.__lock = Lock()
+
+    def inc(self, amount=1):
+        """
+        Increases the count.
+
+        :param amount: Amount to increase the count by.
+        """
+        with self.__lock:
+            self.value += amount
+
+    def samples(self):
+        """
+        Returns a list of (suffix, labels, value) samples of the metric.
+        """
+        return [('', {}, self.value)]
+
+class Histogram(object):
+    """
+    A thread safe distribution of observed values, counted into buckets.
+    """
+
+    def __init__(self, name, help, buckets=DEFAULT_BUCKETS):
+        """
+        :param name: Name of the metric.
+        :param help: Description of the metric.
+        :param buckets: Ascending upper bounds of the buckets.
+        """
+        self.name    = name
+        self.help    = help
+        self.type    = 'histogram'
+        self.buckets = tuple(buckets)
+        # One count per bucket, plus one for values above all of them.
+        self.counts  = [0] * (len(self.buckets) + 1)
+        self.sum     = 0.0
+        self.count   = 0
+        # Largest value observed, not exported.
+        self.maximum = 0.0
+        self.__lock  = Lock()
+
+    def observe(self, value):
+        """
+        Records one observed value.
+
+        :param value: The observed value, i.e. a latency in seconds.
+        """
+        index = bisect_left(self.buckets, value)
+        with self.__lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+            if value > self.maximum:
+                self.maximum = value
+
+    def samples(self):
+        """
+        Returns a list of (suffix, labels, value) samples of the metric,
+        with cumulative bucket counts.
+        """
+        with self.__lock:
+            counts, total, count = list(self.counts), self.sum, self.count
+
+        samples    = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),),
+            counts):
+            cumulative += bucket_count
+            samples.append(('_bucket', {'le': _format_value(bound)},
+                cumulative))
+        samples.append(('_sum', {}, total))
+        samples.append(('_count', {}, count))
+        return samples
+
+class Collected(object):
+    """
+    A metric whose samples are computed by a function when it is read.
+    """
+
+    def __init__(self, name, help, type, function):
+        """
+        :param name: Name of the metric.
+        :param help: Description of the metric.
+        :param type: Prometheus type of the metric, 'counter' or 'gauge'.
+        :param function: Returns the current value, or a list of (labels,
+            value) tuples for a labelled metric.
+        """
+        self.name     = name
+        self.help     = help
+        self.type     = type
+        self.function = function
+
+    def samples(self):
+        """
+        Returns a list of (suffix, labels, value) samples of the metric.
+        """
+        value = self.function()
+        if isinstance(value, list):
+            return [('', labels, sample) for labels, sample in value]
+        return [('', {}, value)]
+
+class Metrics(object):
+    """
+    A registry of metrics, read as a whole.
+    """
+
+    def __init__(self):
+        self.__metrics = []
+        self.__names   = {}
+        self.__lock    = Lock()
+
+    def register(self, metric):
+        """
+        Adds a metric to the registry, or returns the metric of the same
+        name already registered.
+
+        :param metric: The metric to add.
+        """
+        with self.__lock:
+            existing = self.__names.get(metric.name)
+            if existing is not None:
+                return existing
+            self.__names[metric.name] = metric
+            self.__metrics.append(metric)
+            return metric
+
+    def counter(self, name, help):
+        """
+        Returns the :class:`Counter` registered as name, creating it.
+        """
+        return self.register(Counter(name, help))
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS):
+        """
+        Returns the :class:`Histogram` registered as name, creating it.
+        """
+        return self.register(Histogram(name, help, buckets))
+
+    def gauge(self, name, help, function):
+        """
+        Registers a gauge computed by function when read.
+        """
+        return self.register(Collected(name, help, 'gauge', function))
+
+    def collected_counter(self, name, help, function):
+        """
+        Registers a counter computed by function when read, i.e. to sum up
+        counts kept elsewhere.
+        """
+        return self.register(Collected(name, help, 'counter', function))
+
+    def snapshot(self):
+        """
+        Returns a dict of the current value of every metric, by name.
+        Unlabelled counters and gauges map to their value, and labelled
+        ones to a dict of values keyed by the label's value (or a tuple of
+        values for several labels).  Histograms map to a dict of their
+        count, sum and cumulative bucket counts by upper bound.
+        """
+        with self.__lock:
+            metrics = list(self.__metrics)
+
+        snapshot = {}
+        for metric in metrics:
+            samples = metric.samples()
+            if metric.type == 'histogram':
+                snapshot[metric.name] = {
+                    'count': samples[-1][2],
+                    'sum': samples[-2][2],
+                    'buckets': dict((float(labels['le']), value)
+                        for _, labels, value in samples[:-2])
+                }
+            elif len(samples) == 1 and not samples[0][1]:
+                snapshot[metric.name] = samples[0][2]
+            else:
+                values = {}
+                for _, labels, value in samples:
+                    key = tuple(labels[name] for name in sorted(labels))
+                    values[key[0] if len(key) == 1 else key] = value
+                snapshot[metric.name] = values
+        return snapshot
+
+    def prometheus(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        with self.__lock:
+            metrics = list(self.__metrics)
+
+        lines = []
+        for metric in metrics:
+            lines.append('# HELP %s %s' % (metric.name, metric.help))
+            lines.append('# TYPE %s %s' % (metric.name, metric.type))
+            for suffix, labels, value in metric.samples():
+                lines.append('%s%s%s %s' % (metric.name, suffix,
+                    _format_labels(labels), _format_value(value)))
+        return '\n'.join(lines) + '\n'
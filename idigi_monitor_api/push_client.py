@@ -17,24 +17,59 @@ iDigi.
 """
 import base64
 import errno
-import httplib
+import fcntl
+import heapq
+import importlib
 import json
 import logging
+import multiprocessing
 import os
+import random
 import socket
 import select
 import ssl
 import struct
 import time
-import urllib
 import zlib
 
 from xml.dom.minidom import getDOMImplementation
-from Queue import Queue, Empty
-from threading import Thread
+from collections import deque, namedtuple
+from threading import BoundedSemaphore, Event, Lock, Thread, current_thread
+
+from .metrics import Histogram, Metrics
+from .spool import SpoolClosed, SpoolRecord
+from .splitter import ElementTree, split_messages
+
+try:
+    import httplib
+    from Queue import Queue, Empty
+    from urllib import urlencode
+except ImportError:
+    # Python 3
+    import http.client as httplib
+    from queue import Queue, Empty
+    from urllib.parse import urlencode
+
+try:
+    # Python 2's zlib only accepts old style buffers.
+    _buffer = buffer
+except NameError:
+    def _buffer(data, offset, size):
+        """
+        Returns a view of size bytes of data starting at offset.
+        """
+        return memoryview(data)[offset:offset + size]
+
+try:
+    _string_types = basestring
+except NameError:
+    _string_types = str
 
 LOG = logging.getLogger("idigi_monitor_api")
 
+# Whether TLS sessions can be resumed (Python 3.6+).
+_TLS_SESSIONS = hasattr(ssl, 'SSLSession')
+
 # Resolve modules local directory and get reference to default iDigi Cert.
 IDIGI_CRT = os.path.join(os.path.dirname(__file__), "idigi.crt")
 
@@ -47,6 +82,10 @@ CONNECTION_RESPONSE = 0x02
 PUBLISH_MESSAGE = 0x03
 PUBLISH_MESSAGE_RECEIVED = 0x04
 
+# PublishMessage payload formats.
+FORMAT_XML = 0x00
+FORMAT_JSON = 0x01
+
 # Data has not been completely read.
 INCOMPLETE = -1
 # No Data Received on Socket.
@@ -61,6 +100,74 @@ STATUS_BAD_REQUEST = 400
 PUSH_OPEN_PORT = 3200
 PUSH_SECURE_PORT = 3201
 
+# Bytes requested from a session's socket per read.
+READ_BUFFER_SIZE = 65536
+
+# Seconds a payload waits for its batch to fill in batched callback mode.
+DEFAULT_BATCH_TIMEOUT = 0.1
+
+# Default limits on payloads received but not yet handled by a callback.
+DEFAULT_SESSION_MESSAGES = 1000
+DEFAULT_SESSION_BYTES = 8 * 1024 * 1024
+DEFAULT_TOTAL_BYTES = 64 * 1024 * 1024
+
+# Persistent connections kept to the iDigi web services, and the seconds an
+# idle one is kept before it is presumed closed by the server.
+DEFAULT_HTTP_POOL_SIZE = 4
+DEFAULT_HTTP_IDLE_TIMEOUT = 30
+
+# HTTP methods that are safe to send twice, retried on a new connection 
+# whenever a reused one fails.  Others are only retried if the request 
+# never reached the server.
+IDEMPOTENT_METHODS = ('GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS')
+
+# Seconds the Monitors listed by a MonitorRegistry are trusted, and the 
+# number of Monitors requested per page when listing them.
+DEFAULT_MONITOR_TTL = 300
+DEFAULT_MONITOR_PAGE_SIZE = 1000
+
+# Items handled at once by the bulk session API.
+DEFAULT_BULK_CONCURRENCY = 16
+
+# Reconnect backoff defaults, see ReconnectPolicy.
+DEFAULT_RECONNECT_DELAY = 1.0
+DEFAULT_RECONNECT_MAX_DELAY = 60.0
+DEFAULT_RECONNECT_CONCURRENCY = 8
+
+# States of a PushSession.
+STATE_CONNECTING = 'connecting'
+STATE_CONNECTED = 'connected'
+STATE_RECONNECTING = 'reconnecting'
+STATE_CLOSED = 'closed'
+
+# Phases of a session's connection handshake.
+PHASE_CONNECT = 'connect'
+PHASE_TLS = 'tls'
+PHASE_REQUEST = 'request'
+PHASE_RESPONSE = 'response'
+
+# Seconds a connection handshake may take, including the ConnectionResponse.
+HANDSHAKE_TIMEOUT = 60
+
+# Seconds stop_all waits for each worker pool's callbacks to return.
+WORKER_STOP_TIMEOUT = 5
+
+# Stages of the push pipeline a sampled message is traced through, see 
+# StageHook.  A message is framed off its socket (read), parsed and queued 
+# (dispatch), waits for a callback worker (queue), is uncompressed 
+# (decompress), handed to its callback (callback) and acknowledged, from 
+# queueing the acknowledgement to writing it to the socket (write).
+STAGE_READ = 'read'
+STAGE_DISPATCH = 'dispatch'
+STAGE_QUEUE = 'queue'
+STAGE_DECOMPRESS = 'decompress'
+STAGE_CALLBACK = 'callback'
+STAGE_WRITE = 'write'
+
+# Readiness events reported by SocketPoller.
+EVENT_READ = 0x01
+EVENT_WRITE = 0x02
+
 def push_client(username, password, **kwargs):
     """
     Constructs and returns a :class:`PushClient` instance.  Which can be 
@@ -77,62 +184,499 @@ def push_client(username, password, **kwargs):
     """
     return PushClient(username, password, **kwargs)
 
-def _read_msg_header(session):
+def _to_bytes(value):
+    """
+    Returns value encoded as UTF-8 if it is a text string, otherwise value.
+
+    :param value: A text or byte string.
+    """
+    if isinstance(value, bytes):
+        return value
+    return value.encode('utf-8')
+
+def _connection_request(username, password, monitor_id):
+    """
+    Returns a ConnectionRequest message authenticating with the given 
+    credentials for a Monitor.
+
+    :param username: Username to authenticate with.
+    :param password: Password to authenticate with.
+    :param monitor_id: The id of the Monitor to observe.
+    """
+    username = _to_bytes(username)
+    password = _to_bytes(password)
+
+    # Protocol Version = 1.
+    payload  = struct.pack('!H', 0x01)
+    # Username Length.
+    payload += struct.pack('!H', len(username))
+    # Username.
+    payload += username
+    # Password Length.
+    payload += struct.pack('!H', len(password))
+    # Password.
+    payload += password
+    # Monitor ID.
+    payload += struct.pack('!L', int(monitor_id))
+
+    # Header 6 Bytes : Type [2 bytes] & Length [4 Bytes]
+    # ConnectionRequest is Type 0x01.
+    data = struct.pack("!HL", CONNECTION_REQUEST, len(payload))
+
+    # The full payload.
+    return data + payload
+
+def _parse_connection_response(response):
+    """
+    Validates a 10 byte ConnectionResponse message and returns its status 
+    code.  Raises a :class:`PushException` if the response is malformed or 
+    the status is not STATUS_OK.
+
+    :param response: The ConnectionResponse message received.
+    """
+    if len(response) != 10:
+        raise PushException("Length of Connection Request Response \
+(%d) is not 10." % len(response))
+
+    # Type
+    response_type = int(struct.unpack("!H", response[0:2])[0])
+    if response_type != CONNECTION_RESPONSE:
+        raise PushException("Connection Response Type (%d) is not \
+ConnectionResponse Type (%d)." % (response_type, CONNECTION_RESPONSE))
+
+    status_code = struct.unpack("!H", response[6:8])[0]
+    if status_code != STATUS_OK:
+        raise PushException("Connection Response Status Code (%d) is \
+not STATUS_OK (%d)." % (status_code, STATUS_OK))
+    return status_code
+
+def _parse_publish_message(data, length=None):
+    """
+    Splits the body of a PublishMessage into its block id, compression flag
+    and payload.  The payload is returned as a view over data rather than a 
+    copy of it.
+
+    :param data: The PublishMessage body, following the 6 byte header.
+    :param length: Length of the body, if data is a larger buffer.
+    """
+    if length is None:
+        length = len(data)
+    block_id, _, compression = struct.unpack_from('!HHB', data)
+    return block_id, compression, _buffer(data, 10, length - 10)
+
+def _publish_message_received(block_id, status=STATUS_OK):
     """
-    Perform a read on input socket to consume headers and then return 
-    a tuple of message type, message length.
+    Returns a PublishMessageReceived message acknowledging a block.
+
+    :param block_id: The block id of the PublishMessage being acknowledged.
+    :param status: The status to report (STATUS_OK if processed).
+    """
+    return struct.pack('!HHH', PUBLISH_MESSAGE_RECEIVED, block_id, status)
+
+def _monitor_request(topics, batch_size, batch_duration, compression, 
+    format_type):
+    """
+    Returns the XML document used to POST a Monitor to /ws/Monitor.  See 
+    :meth:`PushClient.create_monitor` for parameters.
+    """
+    # Create Monitor Request XML.
+    monitor_req = DOM.createDocument(None, "Monitor", None)
+    root = monitor_req.documentElement
+
+    attrs = { 'monTopic' : ','.join(topics), 
+                'monBatchSize' : str(batch_size),
+                'monBatchDuration' : str(batch_duration),
+                'monFormatType' : format_type,
+                'monTransportType' : 'tcp',
+                'monCompression' : compression }
+
+    for tag, value in attrs.items():
+        element = monitor_req.createElement(tag)
+        element.appendChild(monitor_req.createTextNode(value))
+        root.appendChild(element)
+
+    return root.toxml()
+
+def _monitor_query(topics):
+    """
+    Returns the /ws/Monitor url used to find a Monitor by its topics.
+
+    :param topics: a string list of topics.
+    """
+    # Query for Monitor conditionally by monTopic.
+    params = {'condition' : "monTopic='%s'" % ','.join(topics)}
+    return '/ws/Monitor/.json?' + urlencode([(key, params[key]) \
+        for key in params])
+
+def _monitor_listing(start, size):
+    """
+    Returns the /ws/Monitor url used to list a page of Monitors.
+
+    :param start: Index of the first Monitor of the page.
+    :param size: Most Monitors to return.
+    """
+    return '/ws/Monitor/.json?' + urlencode([('start', start), 
+        ('size', size)])
+
+def _topic_key(topics):
+    """
+    Returns the normalized set of topics a Monitor is indexed by.
+
+    :param topics: a string list of topics, or a comma separated string of 
+        them as in monTopic.
+    """
+    if isinstance(topics, _string_types):
+        topics = topics.split(',')
+    return frozenset(topic.strip() for topic in topics if topic.strip())
+
+def _ssl_context(ca_certs, check_hostname=True):
+    """
+    Returns an SSLContext for push sockets, requiring servers to present a 
+    certificate signed by one of ca_certs, or None if this Python has no 
+    SSLContext.
+
+    :param ca_certs: Path to a file containing Certificates.
+    :param check_hostname: Whether the certificate must also name the host 
+        connected to.
+    """
+    if not hasattr(ssl, 'create_default_context'):
+        return None
+    context = ssl.create_default_context(cafile=ca_certs)
+    context.check_hostname = check_hostname
+    return context
+
+def _recv(session):
+    """
+    Performs a single read on the session's socket into its buffer.  Data 
+    for a message too large for the buffer is received directly into a 
+    message buffer of its own.
 
     :param session: Push Session to read data for.
 
-    Returns response type (i.e. PUBLISH_MESSAGE) if header was completely 
-    read, otherwise None if header was not completely read.
+    Returns the number of bytes read, INCOMPLETE if no data was ready, or 
+    NO_DATA if the socket was closed.
     """
-    try:
-        data = session.socket.recv(6 - len(session.data))
-        if len(data) == 0: # No Data on Socket. Likely closed.
-            return NO_DATA
-        session.data += data
-        # Data still not completely read.
-        if len(session.data) < 6:
-            return INCOMPLETE
+    if session.message is not None:
+        # Receiving the remainder of a large message.
+        view = memoryview(session.message)[
+            session.received:session.message_length]
+    else:
+        # Move an incomplete message to the front to make room after it.
+        if session.head > 0:
+            pending = session.tail - session.head
+            session.buffer[0:pending] = \
+                session.buffer[session.head:session.tail]
+            session.head, session.tail = 0, pending
+        view = memoryview(session.buffer)[session.tail:]
 
+    try:
+        nbytes = session.socket.recv_into(view)
     except ssl.SSLError:
-        # This can happen when select gets triggered 
+        # This can happen when the poller gets triggered 
         # for an SSL socket and data has not yet been 
         # read.
         return INCOMPLETE
+    except socket.error as err:
+        if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+            return INCOMPLETE
+        raise
+
+    if nbytes == 0: # No Data on Socket. Likely closed.
+        return NO_DATA
+
+    if session.message is not None:
+        session.received += nbytes
+    else:
+        session.tail += nbytes
+    return nbytes
 
-    session.message_length = struct.unpack('!i', session.data[2:6])[0]
-    response_type = struct.unpack('!H', session.data[0:2])[0]
+def _read_msg_header(session):
+    """
+    Consume a message header from the session's buffered data, setting the
+    session's response_type and message_length.
 
-    # Clear out session data as header is consumed.
-    session.data = ""
-    return response_type
+    :param session: Push Session to read data for.
+
+    Returns response type (i.e. PUBLISH_MESSAGE) if a complete header was 
+    buffered, otherwise INCOMPLETE.
+    """
+    if session.tail - session.head < 6:
+        return INCOMPLETE
+
+    session.response_type, session.message_length = \
+        struct.unpack_from('!Hi', session.buffer, session.head)
+    session.head += 6
+
+    if session.message_length > len(session.buffer):
+        # Too large to buffer, move what has arrived so far into a 
+        # message buffer of its own.  That buffer is reused for later 
+        # messages and only reallocated when a larger message arrives.
+        if len(session.large_buffer) < session.message_length:
+            session.large_buffer = bytearray(session.message_length)
+        session.message = session.large_buffer
+        session.received = min(session.tail - session.head, 
+            session.message_length)
+        session.message[0:session.received] = \
+            session.buffer[session.head:session.head + session.received]
+        session.head = session.tail = 0
+
+    return session.response_type
 
 def _read_msg(session):
     """
-    Perform a read on input socket to consume message and then return the
-    payload and block_id in a tuple.
+    Consume the message whose header was last read from the session's 
+    buffered data.
 
     :param session: Push Session to read data for.
+
+    Returns the message once it is complete, as a view that is only valid 
+    until the next read on the session, otherwise None.
     """
-    if len(session.data) == session.message_length:
-        # Data Already completely read.  Return
-        return True
+    length = session.message_length
+    if session.message is not None:
+        if session.received < length:
+            return None
+        data = _buffer(session.message, 0, length)
+        session.message = None
+    else:
+        if session.tail - session.head < length:
+            return None
+        data = _buffer(session.buffer, session.head, length)
+        session.head += length
+
+    session.message_length = 0
+    return data
+
+# Callbacks resolved from their importable names, by name.
+_CALLBACKS = {}
+
+# Queued to each queue of a worker pool to stop its worker.
+_STOP_WORKER = object()
+
+def _join_workers(workers, timeout=None):
+    """
+    Waits for worker threads to exit, skipping the calling thread so that a 
+    pool can be stopped from one of its own callbacks.  Returns the number 
+    of workers still running.
+
+    :param workers: The worker threads.
+    :param timeout: Most seconds to wait for all of them, indefinitely if 
+        None.
+    """
+    deadline = time.time() + timeout if timeout is not None else None
+    current  = current_thread()
+    for worker in workers:
+        if worker is current:
+            continue
+        worker.join(None if deadline is None 
+            else max(0, deadline - time.time()))
+    return sum(1 for worker in workers 
+        if worker is not current and worker.is_alive())
+
+def _callback_name(callback):
+    """
+    Returns the importable name ('module:function') of a callback, so that 
+    it can be invoked in another process.  Raises a :class:`PushException` 
+    if the callback can not be found by that name.
+
+    :param callback: A module level function, or its importable name.
+    """
+    if callable(callback):
+        qualname = getattr(callback, '__qualname__', 
+            getattr(callback, '__name__', None))
+        if qualname is None:
+            # i.e. a callable instance, such as a TopicRouter.
+            raise PushException("Callback %r has no name, pass the "
+                "importable name of a module level function or instance." 
+                % (callback,))
+        name = '%s:%s' % (callback.__module__, qualname)
+    else:
+        name = callback
 
     try:
-        data = session.socket.recv(session.message_length - len(session.data))
-        if len(data) == 0:
-            raise PushException("No Data on Socket!")
-        session.data += data  
-    except ssl.SSLError:
-        # This can happen when select gets triggered 
-        # for an SSL socket and data has not yet been 
-        # read.  Wait for it to get triggered again.
-        return False
+        resolved = _resolve_callback(name)
+    except (ImportError, AttributeError, ValueError) as err:
+        raise PushException("Callback %r can not be imported by name: %s" 
+            % (callback, err))
+    if callable(callback) and resolved is not callback:
+        raise PushException("Callback %r can not be imported by name %s." 
+            % (callback, name))
+    return name
+
+def _resolve_callback(name):
+    """
+    Imports and returns the callback referenced by an importable name, 
+    either 'package.module:function' or 'package.module.function'.
+
+    :param name: The callback's importable name.
+    """
+    callback = _CALLBACKS.get(name)
+    if callback is None:
+        module_name, _, path = name.partition(':')
+        if not path:
+            module_name, _, path = name.rpartition('.')
+        callback = importlib.import_module(module_name)
+        for attr in path.split('.'):
+            callback = getattr(callback, attr)
+        _CALLBACKS[name] = callback
+    return callback
+
+def _run_callback(callback, data, compression):
+    """
+    Uncompresses a payload if needed and invokes a callback with it.  
+    Returns True if the callback accepted the payload.
+
+    :param callback: The callback to invoke.
+    :param data: The payload of the message received.
+    :param compression: The compression flag of the message received.
+    """
+    if compression == 0x01:
+        # Data is compressed, uncompress it.
+        data = zlib.decompress(data)
+    return bool(callback(data))
+
+def _run_batch_callback(callback, items, decompress_seconds=None):
+    """
+    Uncompresses a batch of payloads and invokes a callback with the list of
+    them.  Payloads that fail to uncompress are logged and left out.  
+
+    :param callback: The callback to invoke.
+    :param items: List of (data, compression) tuples.
+    :param decompress_seconds: Optional :class:`Histogram` observing the 
+        time each payload took to uncompress.
+
+    Returns a list with one boolean per item, True if it was accepted.
+    """
+    accepted = [False] * len(items)
+    indexes  = []
+    payloads = []
+    for index, (data, compression) in enumerate(items):
+        try:
+            if compression == 0x01:
+                # Data is compressed, uncompress it.
+                started = time.time()
+                data = zlib.decompress(data)
+                if decompress_seconds is not None:
+                    decompress_seconds.observe(time.time() - started)
+        except Exception as exception:
+            # Leave the message unacknowledged.
+            LOG.exception(exception)
+            continue
+        indexes.append(index)
+        payloads.append(data)
+
+    if payloads:
+        result = callback(payloads)
+        if isinstance(result, (list, tuple)):
+            for index, item_accepted in zip(indexes, result):
+                accepted[index] = bool(item_accepted)
+        elif result:
+            for index in indexes:
+                accepted[index] = True
+    return accepted
+
+def _run_named_callback(name, data, compression):
+    """
+    :func:`_run_callback` for a callback referenced by importable name, 
+    used to invoke callbacks in a process pool.
+    """
+    return _run_callback(_resolve_callback(name), data, compression)
+
+def _run_named_batch_callback(name, items):
+    """
+    :func:`_run_batch_callback` for a callback referenced by importable 
+    name, used to invoke callbacks in a process pool.
+    """
+    return _run_batch_callback(_resolve_callback(name), items)
+
+class PushMessage(object):
+    """
+    A PublishMessage as received from iDigi.  Header fields are parsed up 
+    front, while the payload is only uncompressed (:attr:`data`) and decoded
+    (:attr:`document`) when first accessed, and is then cached.  Callbacks 
+    that decide from the header or the session whether to process a message
+    therefore never pay to inflate or parse the ones they skip.
+    """
+    __slots__ = ('session', 'block_id', 'aggregate', 'compression', 'format',
+                 'payload_size', 'payload', 'received', '__data', 
+                 '__document')
+
+    def __init__(self, session, data, received=None):
+        """
+        :param session: The session the message was received on.
+        :param data: The PublishMessage body, following the 6 byte header.
+        :param received: Time the message was received, now if not provided.
+        """
+        self.session      = session
+        self.block_id, self.aggregate, self.compression, self.format, \
+            self.payload_size = struct.unpack_from('!HHBBL', data)
+        # Payload as received, still compressed if compression is set.
+        self.payload      = bytes(data[10:])
+        self.received     = received if received is not None else time.time()
+        self.__data       = None
+        self.__document   = None
+
+    def __getstate__(self):
+        # Sessions are bound to sockets and are not sent to other processes,
+        # neither is the uncompressed payload.
+        return (self.block_id, self.aggregate, self.compression, self.format,
+                self.payload_size, self.payload, self.received)
+
+    def __setstate__(self, state):
+        self.block_id, self.aggregate, self.compression, self.format, \
+            self.payload_size, self.payload, self.received = state
+        self.session    = None
+        self.__data     = None
+        self.__document = None
+
+    @property
+    def format_type(self):
+        """
+        The format of the payload, 'xml' or 'json'.
+        """
+        return 'json' if self.format == FORMAT_JSON else 'xml'
+
+    @property
+    def data(self):
+        """
+        The uncompressed payload.
+        """
+        if self.__data is None:
+            if self.compression == 0x01:
+                # Data is compressed, uncompress it.
+                self.__data = zlib.decompress(self.payload)
+            else:
+                self.__data = self.payload
+        return self.__data
+
+    @property
+    def document(self):
+        """
+        The decoded payload, a dict for json and an ElementTree Element for 
+        xml.
+        """
+        if self.__document is None:
+            if self.format == FORMAT_JSON:
+                self.__document = json.loads(self.data.decode('utf-8'))
+            else:
+                self.__document = ElementTree.fromstring(self.data)
+        return self.__document
+
+    def messages(self):
+        """
+        Yields each Msg of the payload as it is parsed, see 
+        :func:`split_messages`.
+        """
+        return split_messages(self.data, self.format_type)
+
+    def __repr__(self):
+        return "PushMessage(block_id=%s, aggregate=%s, compression=%s, " \
+            "format=%s, payload_size=%s)" % (self.block_id, self.aggregate, 
+                self.compression, self.format, self.payload_size)
 
-    # Whether or not all data was read.
-    return  len(session.data) == session.message_length
+# Outcome of one item of a bulk operation: the item, and either the result 
+# of the operation or the exception it raised.
+BulkResult = namedtuple('BulkResult', 'item result error')
 
 class PushException(Exception):
     """
@@ -140,6 +684,909 @@ class PushException(Exception):
     """
     pass
 
+class StageHook(object):
+    """
+    Base class of hooks registered with :meth:`PushClient.add_hook` to 
+    observe sampled messages through the stages of the push pipeline (the 
+    STAGE_ constants).  Subclasses override either method, i.e. to start 
+    and stop a tracer span or a cProfile.Profile around a stage.
+
+    Stages run on different threads: read, dispatch and write on the IO 
+    thread, the others on worker threads.  The queue and write stages begin
+    on one thread and end on another.  Hooks must be quick, as they run on 
+    the hot path, and exceptions they raise are logged and ignored.
+    """
+
+    def before(self, stage, trace):
+        """
+        Called when a sampled message enters a stage.
+
+        :param stage: The stage, one of the STAGE_ constants.
+        :param trace: The message's :class:`Trace`.
+        """
+        pass
+
+    def after(self, stage, trace):
+        """
+        Called when a sampled message leaves a stage, once its duration has 
+        been recorded in trace.stages.
+
+        :param stage: The stage, one of the STAGE_ constants.
+        :param trace: The message's :class:`Trace`.
+        """
+        pass
+
+class Trace(object):
+    """
+    A sampled message followed through the stages of the push pipeline, 
+    handed to the :class:`StageHook` instances that sampled it.  A trace 
+    ends after the write stage, or after the callback stage if the message 
+    was not acknowledged.  Spooled messages are acknowledged before their 
+    callback runs, and their trace ends with whichever stage ends last.
+    """
+    log = logging.getLogger('trace')
+
+    def __init__(self, hooks, monitor_id, sequence):
+        """
+        :param hooks: The hooks that sampled the message.
+        :param monitor_id: The id of the Monitor the message was pushed for.
+        :param sequence: Number of the message among those the client read.
+        """
+        self.hooks      = hooks
+        self.monitor_id = monitor_id
+        self.sequence   = sequence
+        # Set once the message is parsed, in the dispatch stage.
+        self.block_id   = None
+        # Seconds spent in each stage the message left, by stage.
+        self.stages     = {}
+        # Free for hooks to keep state in, i.e. a profiler per stage.
+        self.data       = {}
+        self.__started  = {}
+
+    def begin(self, stage):
+        """
+        Marks the message entering a stage.
+        """
+        self.__started[stage] = time.time()
+        for hook in self.hooks:
+            try:
+                hook.before(stage, self)
+            except Exception as exception:
+                self.log.exception(exception)
+
+    def end(self, stage):
+        """
+        Marks the message leaving a stage.
+        """
+        started = self.__started.pop(stage, None)
+        if started is not None:
+            self.stages[stage] = time.time() - started
+        for hook in reversed(self.hooks):
+            try:
+                hook.after(stage, self)
+            except Exception as exception:
+                self.log.exception(exception)
+
+class LatencyStats(object):
+    """
+    Running count, mean and maximum of a latency measured in seconds, read 
+    from the :class:`Histogram` the latency is recorded in.
+    """
+
+    def __init__(self, histogram=None):
+        """
+        :param histogram: The histogram measurements are recorded in, a new
+            one if None.
+        """
+        if histogram is None:
+            histogram = Histogram('latency_seconds', 'Latency in seconds.')
+        self.histogram = histogram
+
+    def record(self, latency):
+        """
+        Records one measurement.
+
+        :param latency: The measured latency in seconds.
+        """
+        self.histogram.observe(latency)
+
+    @property
+    def count(self):
+        """
+        The number of measurements.
+        """
+        return self.histogram.count
+
+    @property
+    def total(self):
+        """
+        The sum of all measurements in seconds.
+        """
+        return self.histogram.sum
+
+    @property
+    def maximum(self):
+        """
+        The largest measurement in seconds, 0 if there are none.
+        """
+        return self.histogram.maximum
+
+    @property
+    def mean(self):
+        """
+        The mean of all measurements in seconds, 0 if there are none.
+        """
+        return self.total / self.count if self.count else 0.0
+
+def _water_marks(limit):
+    """
+    Returns a (high, low) tuple of water marks for a limit given either as 
+    a high water mark, or as a (high, low) tuple.  The low water mark 
+    defaults to half of the high one.  A limit of None is unbounded.
+
+    :param limit: The limit to convert.
+    """
+    if limit is None:
+        return None
+    if isinstance(limit, (tuple, list)):
+        high, low = limit
+    else:
+        high, low = limit, limit // 2
+    if not 0 <= low < high:
+        raise ValueError("Invalid water marks %r." % (limit,))
+    return high, low
+
+class FlowControl(object):
+    """
+    Tracks payloads handed to the worker pools that a callback has not 
+    handled yet, per session and in total, and decides when reading a 
+    session's socket is paused and resumed.  While a session is paused, the 
+    server is held back by TCP flow control, and the memory used by 
+    pending payloads stays bounded.
+
+    Every limit is either a high water mark, or a (high, low) tuple of 
+    water marks.  A session pauses once it, or the total, reaches a high 
+    water mark, and resumes once both are back at or below their low water 
+    marks.  The low water mark defaults to half of the high one, and a 
+    limit of None is unbounded.  Limits are checked as each payload is 
+    counted, and a session that pauses stops dispatching even the complete
+    messages it has already buffered, so a session's pending messages stop
+    at its high water mark.
+
+    Payloads are counted at their size as received.  Those uncompressed by 
+    a :class:`DecompressionWorkerPool` are recounted at their uncompressed 
+    size, so byte limits bound the memory they use once uncompressed.  A 
+    payload uncompressed by a callback worker waits in its compressed form,
+    and is only held uncompressed while its callback runs.
+    """
+
+    def __init__(self, session_messages=DEFAULT_SESSION_MESSAGES, 
+        session_bytes=DEFAULT_SESSION_BYTES, total_messages=None, 
+        total_bytes=DEFAULT_TOTAL_BYTES):
+        """
+        :param session_messages: Limit on pending payloads of a session.
+        :param session_bytes: Limit on pending bytes of a session.
+        :param total_messages: Limit on pending payloads of all sessions.
+        :param total_bytes: Limit on pending bytes of all sessions.
+        """
+        self.session_messages = _water_marks(session_messages)
+        self.session_bytes    = _water_marks(session_bytes)
+        self.total_messages   = _water_marks(total_messages)
+        self.total_bytes      = _water_marks(total_bytes)
+        # Pending payloads and bytes, in total and per session.
+        self.messages         = 0
+        self.bytes            = 0
+        self.__usage          = {}
+        # Sessions whose socket is not being read.
+        self.paused           = set()
+        self.__lock           = Lock()
+
+    def __exceeds(self, messages, size, message_limit, byte_limit, high):
+        """
+        Returns True if a usage has reached the high water marks of its 
+        limits, or if high is False, is still above their low water marks.
+        """
+        if high:
+            return (message_limit is not None 
+                        and messages >= message_limit[0]) \
+                or (byte_limit is not None and size >= byte_limit[0])
+        return (message_limit is not None and messages > message_limit[1]) \
+            or (byte_limit is not None and size > byte_limit[1])
+
+    def __session_exceeds(self, session, high):
+        """
+        :meth:`__exceeds` for a session's usage and the per session limits.
+        """
+        usage = self.__usage.get(session, (0, 0))
+        return self.__exceeds(usage[0], usage[1], self.session_messages, 
+            self.session_bytes, high)
+
+    def __total_exceeds(self, high):
+        """
+        :meth:`__exceeds` for the total usage and limits.
+        """
+        return self.__exceeds(self.messages, self.bytes, 
+            self.total_messages, self.total_bytes, high)
+
+    def usage(self, session):
+        """
+        Returns a (messages, bytes) tuple of a session's pending payloads.
+
+        :param session: The session to look up.
+        """
+        with self.__lock:
+            return tuple(self.__usage.get(session, (0, 0)))
+
+    def acquire(self, session, size):
+        """
+        Counts a payload handed to the worker pools.  Returns True if 
+        reading the session's socket has to pause.
+
+        :param session: The session the payload was received on.
+        :param size: The size of the payload in bytes.
+        """
+        with self.__lock:
+            usage = self.__usage.get(session)
+            if usage is None:
+                usage = self.__usage[session] = [0, 0]
+            usage[0] += 1
+            usage[1] += size
+            self.messages += 1
+            self.bytes += size
+
+            if session not in self.paused and \
+                (self.__session_exceeds(session, True) 
+                    or self.__total_exceeds(True)):
+                self.paused.add(session)
+            return session in self.paused
+
+    def resize(self, session, size, new_size):
+        """
+        Recounts a pending payload whose size changed, i.e. once it was 
+        uncompressed.  Returns True if reading the session's socket has to 
+        pause.
+
+        :param session: The session the payload was received on.
+        :param size: The size the payload was counted with.
+        :param new_size: The size the payload is now counted with.
+        """
+        with self.__lock:
+            usage = self.__usage.get(session)
+            if usage is None:
+                return False
+            usage[1] += new_size - size
+            self.bytes += new_size - size
+
+            if session not in self.paused and \
+                (self.__session_exceeds(session, True) 
+                    or self.__total_exceeds(True)):
+                self.paused.add(session)
+            return session in self.paused
+
+    def release(self, session, size):
+        """
+        Uncounts a payload a callback is done with.  Returns True if a 
+        paused session may now resume.
+
+        :param session: The session the payload was received on.
+        :param size: The size the payload was counted with.
+        """
+        with self.__lock:
+            usage = self.__usage[session]
+            usage[0] -= 1
+            usage[1] -= size
+            if usage[0] == 0:
+                del self.__usage[session]
+            self.messages -= 1
+            self.bytes -= size
+
+            if not self.paused or self.__total_exceeds(False):
+                return False
+            return session not in self.paused \
+                or not self.__session_exceeds(session, False)
+
+    def resumable(self):
+        """
+        Unpauses and returns the sessions that are back below their low 
+        water marks.
+        """
+        with self.__lock:
+            if self.__total_exceeds(False):
+                return []
+            sessions = [session for session in self.paused 
+                if not self.__session_exceeds(session, False)]
+            self.paused.difference_update(sessions)
+            return sessions
+
+class OutboundBuffer(object):
+    """
+    Data waiting to be written to a socket.  Messages appended are merged so
+    that they go out with as few writes as the socket allows, and the time 
+    each one waited to be written is tracked.
+    """
+
+    def __init__(self, sock):
+        """
+        :param sock: The socket to write to.
+        """
+        self.socket  = sock
+        self.fileno  = sock.fileno()
+        if self.fileno < 0:
+            raise socket.error(errno.EBADF, "Socket is closed.")
+        self.data    = bytearray()
+        # Total bytes ever appended and written.
+        self.queued  = 0
+        self.written = 0
+        # (queued total at the end of a message, time it was queued, trace) 
+        # tuples for messages not yet completely written.
+        self.pending = deque()
+
+    def append(self, data, queued_at, trace=None):
+        """
+        Adds a message to the buffer.
+
+        :param data: The message to write.
+        :param queued_at: The time the message was queued for writing.
+        :param trace: The :class:`Trace` of the message, if sampled.
+        """
+        self.data += data
+        self.queued += len(data)
+        self.pending.append((self.queued, queued_at, trace))
+
+    def flush(self):
+        """
+        Writes as much of the buffer as the socket accepts without blocking.
+        Raises socket.error if the socket has failed.
+
+        Returns a (latency in seconds, trace) tuple for each message that 
+        was completely written.
+        """
+        try:
+            sent = self.socket.send(self.data)
+        except ssl.SSLError as err:
+            if err.args[0] in (ssl.SSL_ERROR_WANT_WRITE, 
+                    ssl.SSL_ERROR_WANT_READ):
+                return []
+            raise
+        except socket.error as err:
+            if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                return []
+            raise
+
+        del self.data[:sent]
+        self.written += sent
+
+        now = time.time()
+        written = []
+        while self.pending and self.pending[0][0] <= self.written:
+            _, queued_at, trace = self.pending.popleft()
+            written.append((now - queued_at, trace))
+        return written
+
+class SocketPoller(object):
+    """
+    Readiness notification for the IO loop of a :class:`PushClient`.
+
+    Uses epoll when the platform provides it, falling back to poll and 
+    finally select.  File descriptors are registered once rather than 
+    handed over on every call, so the cost of a wakeup is proportional to 
+    the number of ready sockets instead of the number of open sessions.
+    """
+
+    def __init__(self):
+        # A dict mapping registered file descriptors to their events.
+        self.registered = {}
+
+        self.__epoll = hasattr(select, 'epoll')
+
+        if self.__epoll:
+            self.__poller = select.epoll()
+            self.__masks  = (select.EPOLLIN, select.EPOLLOUT, 
+                             select.EPOLLERR | select.EPOLLHUP)
+        elif hasattr(select, 'poll'):
+            self.__poller = select.poll()
+            self.__masks  = (select.POLLIN, select.POLLOUT, 
+                             select.POLLERR | select.POLLHUP | select.POLLNVAL)
+        else:
+            # Plain select, limited to FD_SETSIZE descriptors.
+            self.__poller = None
+            self.__masks  = (EVENT_READ, EVENT_WRITE, 0)
+
+    def __to_mask(self, events):
+        """
+        Converts EVENT_READ/EVENT_WRITE flags to the native poller mask.
+        """
+        read_mask, write_mask, _ = self.__masks
+        mask = 0
+        if events & EVENT_READ:
+            mask |= read_mask
+        if events & EVENT_WRITE:
+            mask |= write_mask
+        return mask
+
+    def __from_mask(self, mask):
+        """
+        Converts a native poller mask to EVENT_READ/EVENT_WRITE flags.  Error
+        and hang up conditions are reported as readable so that the following
+        read observes the failure.
+        """
+        read_mask, write_mask, error_mask = self.__masks
+        events = 0
+        if mask & (read_mask | error_mask):
+            events |= EVENT_READ
+        if mask & write_mask:
+            events |= EVENT_WRITE
+        return events
+
+    def register(self, fileno, events=EVENT_READ):
+        """
+        Starts watching a file descriptor, or updates the events watched if
+        it is already registered.
+
+        :param fileno: The file descriptor to watch.
+        :param events: A combination of EVENT_READ and EVENT_WRITE.
+        """
+        if fileno in self.registered:
+            self.modify(fileno, events)
+            return
+
+        self.registered[fileno] = events
+        if self.__poller is not None:
+            try:
+                self.__poller.register(fileno, self.__to_mask(events))
+            except (IOError, OSError) as err:
+                # epoll still knows about a descriptor number that was 
+                # closed and reused, update it instead.
+                if err.errno != errno.EEXIST:
+                    del self.registered[fileno]
+                    raise
+                self.__poller.modify(fileno, self.__to_mask(events))
+
+    def modify(self, fileno, events):
+        """
+        Changes the events watched for an already registered file descriptor.
+
+        :param fileno: The file descriptor to update.
+        :param events: A combination of EVENT_READ and EVENT_WRITE.
+        """
+        if self.registered.get(fileno) == events:
+            return
+        self.registered[fileno] = events
+        if self.__poller is not None:
+            self.__poller.modify(fileno, self.__to_mask(events))
+
+    def unregister(self, fileno):
+        """
+        Stops watching a file descriptor.  Descriptors that were never 
+        registered, or that have already been closed, are ignored.
+
+        :param fileno: The file descriptor to stop watching.
+        """
+        if self.registered.pop(fileno, None) is None:
+            return
+        if self.__poller is not None:
+            try:
+                self.__poller.unregister(fileno)
+            except (IOError, OSError, KeyError, ValueError):
+                # Closing a descriptor removes it from epoll already.
+                pass
+
+    def poll(self, timeout=None):
+        """
+        Blocks until at least one registered file descriptor is ready and
+        returns a list of (fileno, events) tuples.
+
+        :param timeout: Seconds to wait, or None to wait indefinitely.
+        """
+        try:
+            if self.__epoll:
+                ready = self.__poller.poll(-1 if timeout is None else timeout)
+            elif self.__poller is not None:
+                ready = self.__poller.poll(None if timeout is None 
+                                            else int(timeout * 1000))
+            else:
+                readers = [fileno for fileno, events 
+                    in self.registered.items() if events & EVENT_READ]
+                writers = [fileno for fileno, events 
+                    in self.registered.items() if events & EVENT_WRITE]
+                readable, writable = \
+                    select.select(readers, writers, [], timeout)[0:2]
+                ready = {}
+                for fileno in readable:
+                    ready[fileno] = ready.get(fileno, 0) | EVENT_READ
+                for fileno in writable:
+                    ready[fileno] = ready.get(fileno, 0) | EVENT_WRITE
+                return list(ready.items())
+        except (select.error, IOError, OSError) as err:
+            # Interrupted by a signal, let the caller loop around.
+            if err.args[0] == errno.EINTR:
+                return []
+            raise
+
+        return [(fileno, self.__from_mask(mask)) for fileno, mask in ready]
+
+    def close(self):
+        """
+        Releases the underlying poller.
+        """
+        self.registered.clear()
+        if self.__poller is not None and hasattr(self.__poller, 'close'):
+            self.__poller.close()
+
+def _is_stale(connection):
+    """
+    Returns True if an idle HTTP connection can not be reused, either 
+    because it is closed, or because its socket is readable, which means 
+    the server has closed it (or sent something unexpected).
+
+    :param connection: The idle HTTPConnection.
+    """
+    sock = connection.sock
+    if sock is None:
+        return True
+    try:
+        if hasattr(select, 'poll'):
+            # Unlike select, poll takes descriptors above FD_SETSIZE.
+            poller = select.poll()
+            poller.register(sock, select.POLLIN | select.POLLPRI)
+            return bool(poller.poll(0))
+        return bool(select.select([sock], [], [], 0)[0])
+    except ValueError:
+        # Descriptor out of range for select, a failed request on it is 
+        # still retried.
+        return False
+    except (select.error, socket.error):
+        return True
+
+def _never_sent(err, sending):
+    """
+    Returns True if a request that failed on a reused connection certainly 
+    did not reach the server, because the connection was found closed 
+    while sending it.  A connection closed without a response is not 
+    enough, the server may have closed it after handling the request.
+
+    :param err: The exception the request failed with.
+    :param sending: Whether it was raised while sending the request.
+    """
+    return sending and isinstance(err, socket.error) \
+        and getattr(err, 'errno', None) \
+            in (errno.EPIPE, errno.ECONNRESET, errno.ECONNABORTED)
+
+class HTTPConnectionPool(object):
+    """
+    A thread safe, bounded pool of persistent HTTP connections to the iDigi 
+    web services.  Connections are kept alive between requests and reused, 
+    most recently used first, so that requests do not pay for a TCP and TLS 
+    handshake each.  Idle connections that the server has closed are 
+    detected and discarded before reuse, and a request that fails on a 
+    reused connection is retried once on a new one if its method is 
+    idempotent, or if the server cannot have received it.
+    """
+
+    def __init__(self, factory, size=DEFAULT_HTTP_POOL_SIZE, 
+        idle_timeout=DEFAULT_HTTP_IDLE_TIMEOUT):
+        """
+        :param factory: Function returning a new, unconnected 
+            HTTPConnection or HTTPSConnection.
+        :param size: Most connections in use at once, requests block while 
+            all of them are in use.
+        :param idle_timeout: Seconds an idle connection is kept for reuse.
+        """
+        self.factory      = factory
+        self.size         = size
+        self.idle_timeout = idle_timeout
+        # Number of connections created and of requests on reused ones.
+        self.created      = 0
+        self.reused       = 0
+        # Idle connections, as (connection, idle since) tuples.
+        self.__idle       = deque()
+        self.__slots      = BoundedSemaphore(size)
+        self.__lock       = Lock()
+        self.log          = logging.getLogger('http_connection_pool')
+
+    def __create(self):
+        """
+        Returns a new connection.
+        """
+        with self.__lock:
+            self.created += 1
+        return self.factory()
+
+    def __get(self):
+        """
+        Returns a tuple of a connection and whether it is being reused, 
+        preferring the most recently used idle connection.
+        """
+        now = time.time()
+        while True:
+            with self.__lock:
+                if not self.__idle:
+                    break
+                connection, idle_since = self.__idle.pop()
+
+            if now - idle_since < self.idle_timeout \
+                and not _is_stale(connection):
+                with self.__lock:
+                    self.reused += 1
+                return connection, True
+            connection.close()
+
+        return self.__create(), False
+
+    def __put(self, connection):
+        """
+        Returns a connection to the pool for reuse.
+        """
+        with self.__lock:
+            self.__idle.append((connection, time.time()))
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        Performs a request on a pooled connection and reads its response.  
+        Returns a tuple of the response and its content.
+
+        :param method: HTTP method (i.e. 'GET').
+        :param url: Path and query to request (i.e. '/ws/Monitor').
+        :param body: Optional request body.
+        :param headers: Optional dict of request headers.
+        """
+        self.__slots.acquire()
+        try:
+            connection, reused = self.__get()
+            try:
+                sending = True
+                try:
+                    connection.request(method, url, body, headers or {})
+                    sending = False
+                    response = connection.getresponse()
+                except (httplib.HTTPException, socket.error) as err:
+                    connection.close()
+                    if not reused or isinstance(err, socket.timeout) \
+                        or (method.upper() not in IDEMPOTENT_METHODS 
+                            and not _never_sent(err, sending)):
+                        raise
+                    # The server closed the connection while it was idle, 
+                    # retry on a new one.
+                    self.log.debug("Retrying %s %s on a new connection: %r." 
+                        % (method, url, err))
+                    connection = self.__create()
+                    connection.request(method, url, body, headers or {})
+                    response = connection.getresponse()
+                content = response.read()
+            except Exception:
+                connection.close()
+                raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                self.__put(connection)
+            return response, content
+        finally:
+            self.__slots.release()
+
+    def close(self):
+        """
+        Closes all idle connections.
+        """
+        with self.__lock:
+            idle, self.__idle = self.__idle, deque()
+        for connection, _ in idle:
+            connection.close()
+
+class RateLimiter(object):
+    """
+    A thread safe token bucket, allowing rate operations per second on 
+    average and bursts of up to burst operations.
+    """
+
+    def __init__(self, rate, burst=1):
+        """
+        :param rate: Operations allowed per second.
+        :param burst: Operations allowed at once after being idle.
+        """
+        self.rate      = float(rate)
+        self.burst     = burst
+        self.__tokens  = float(burst)
+        self.__updated = time.time()
+        self.__lock    = Lock()
+
+    def acquire(self):
+        """
+        Blocks until an operation is allowed.
+        """
+        while True:
+            with self.__lock:
+                now = time.time()
+                self.__tokens = min(self.burst, 
+                    self.__tokens + (now - self.__updated) * self.rate)
+                self.__updated = now
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+                wait = (1 - self.__tokens) / self.rate
+            time.sleep(wait)
+
+def _bulk(function, items, concurrency, rate=None):
+    """
+    Invokes function with each item, on up to concurrency threads at once 
+    and optionally rate limited.  Returns a list with a :class:`BulkResult` 
+    per item, in the order of items.
+
+    :param function: Function to invoke with each item.
+    :param items: The items to invoke function with.
+    :param concurrency: Most items handled at once.
+    :param rate: Most items started per second, unlimited if None.
+    """
+    items   = list(items)
+    results = [None] * len(items)
+    limiter = RateLimiter(rate, burst=concurrency) if rate else None
+    pending = Queue()
+    for index, item in enumerate(items):
+        pending.put((index, item))
+
+    def work():
+        while True:
+            try:
+                index, item = pending.get_nowait()
+            except Empty:
+                return
+            if limiter is not None:
+                limiter.acquire()
+            try:
+                results[index] = BulkResult(item, function(item), None)
+            except Exception as exception:
+                LOG.debug("Bulk operation failed for %r: %r." 
+                    % (item, exception))
+                results[index] = BulkResult(item, None, exception)
+
+    workers = [Thread(target=work) for _ in range(min(concurrency, 
+        len(items)))]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return results
+
+class ReconnectPolicy(object):
+    """
+    Decides how sessions whose connection is lost are reconnected.  The 
+    delay before an attempt grows exponentially with the number of failed 
+    attempts, up to max_delay, and is reduced by a random fraction of up to 
+    jitter so that sessions lost at once do not reconnect in lockstep.  At 
+    most max_concurrent sessions are connecting at a time.
+    """
+
+    def __init__(self, initial_delay=DEFAULT_RECONNECT_DELAY, 
+        max_delay=DEFAULT_RECONNECT_MAX_DELAY, multiplier=2.0, jitter=0.5, 
+        max_concurrent=DEFAULT_RECONNECT_CONCURRENCY):
+        """
+        :param initial_delay: Seconds before the first attempt.
+        :param max_delay: Most seconds between attempts.
+        :param multiplier: Factor the delay grows by per failed attempt.
+        :param jitter: Largest fraction of a delay randomly taken off it.
+        :param max_concurrent: Most sessions connecting at once.
+        """
+        self.initial_delay  = initial_delay
+        self.max_delay      = max_delay
+        self.multiplier     = multiplier
+        self.jitter         = jitter
+        self.max_concurrent = max_concurrent
+
+    def delay(self, attempts):
+        """
+        Returns the seconds to wait before the next attempt.
+
+        :param attempts: Number of consecutive failed attempts so far.
+        """
+        delay = min(self.max_delay, 
+            self.initial_delay * self.multiplier ** attempts)
+        return delay * (1 - self.jitter * random.random())
+
+class MonitorRegistry(object):
+    """
+    A client side index of the Monitors of an account, by their set of 
+    topics.  All Monitors are fetched with one paged listing and then looked
+    up from memory until the listing is older than ttl or is invalidated.  
+    The registry is kept up to date as the client creates and deletes 
+    Monitors.
+    """
+
+    def __init__(self, client, ttl=DEFAULT_MONITOR_TTL, 
+        page_size=DEFAULT_MONITOR_PAGE_SIZE):
+        """
+        :param client: The :class:`PushClient` to list Monitors with.
+        :param ttl: Seconds a listing is used before it is fetched again.
+        :param page_size: Monitors requested per page of a listing.
+        """
+        self.client      = client
+        self.ttl         = ttl
+        self.page_size   = page_size
+        # Time of the last listing, None if it has to be fetched again.
+        self.listed_at   = None
+        # Monitor ids by topic set, in listing order, and topic sets by 
+        # Monitor id.
+        self.__monitors  = {}
+        self.__topics    = {}
+        self.__lock      = Lock()
+
+    def __index(self, monitor_id, topics):
+        """
+        Adds a Monitor to the index, with the lock held.
+        """
+        key = _topic_key(topics)
+        self.__topics[str(monitor_id)] = key
+        self.__monitors.setdefault(key, []).append(monitor_id)
+
+    def refresh(self):
+        """
+        Replaces the index with a new listing of all Monitors.
+        """
+        with self.__lock:
+            self.__refresh()
+
+    def __refresh(self):
+        """
+        Replaces the index with a new listing of all Monitors, with the 
+        lock held.
+        """
+        monitors = self.client.list_monitors(self.page_size)
+        self.__monitors = {}
+        self.__topics   = {}
+        for monitor in monitors:
+            self.__index(monitor['monId'], monitor.get('monTopic', ''))
+        self.listed_at  = time.time()
+
+    def invalidate(self):
+        """
+        Forces the next lookup to fetch a new listing.
+        """
+        with self.__lock:
+            self.listed_at = None
+
+    def get(self, topics):
+        """
+        Returns the id of a Monitor of exactly the given topics, in any 
+        order, or None if there is none.
+
+        :param topics: a string list of topics.
+        """
+        with self.__lock:
+            if self.listed_at is None \
+                or time.time() - self.listed_at >= self.ttl:
+                self.__refresh()
+            monitor_ids = self.__monitors.get(_topic_key(topics))
+            return monitor_ids[0] if monitor_ids else None
+
+    def add(self, monitor_id, topics):
+        """
+        Records a Monitor that has been created.
+
+        :param monitor_id: id of the Monitor.
+        :param topics: a string list of topics of the Monitor.
+        """
+        with self.__lock:
+            if str(monitor_id) not in self.__topics:
+                self.__index(monitor_id, topics)
+
+    def remove(self, monitor_id):
+        """
+        Forgets a Monitor that has been deleted.
+
+        :param monitor_id: id of the Monitor.
+        """
+        with self.__lock:
+            key = self.__topics.pop(str(monitor_id), None)
+            if key is None:
+                return
+            monitor_ids = [other for other in self.__monitors[key] 
+                if str(other) != str(monitor_id)]
+            if monitor_ids:
+                self.__monitors[key] = monitor_ids
+            else:
+                del self.__monitors[key]
+
 class PushSession(object):
     """
     A PushSession is responsible for establishing a socket connection
@@ -147,7 +1594,8 @@ class PushSession(object):
     iDigi.
     """
     
-    def __init__(self, callback, monitor_id, client):
+    def __init__(self, callback, monitor_id, client, batch_count=None, 
+        batch_timeout=DEFAULT_BATCH_TIMEOUT, shard_key=None, envelope=False):
         """
         Creates a PushSession for use with interacting with iDigi's
         Push Functionality.
@@ -156,113 +1604,221 @@ class PushSession(object):
             Must have 1 required parameter that will contain the payload.
         :param monitor_id: The id of the Monitor to observe.
         :param client: The client object this session is derived from.
+        :param batch_count: If set, callback is invoked with a list of up to 
+            this many payloads instead of one payload at a time.
+        :param batch_timeout: Seconds a payload may wait for its batch to 
+            fill before the batch is delivered anyway.
+        :param shard_key: Optional function returning the key a payload is 
+            ordered by, payloads are ordered by monitor id otherwise.
+        :param envelope: Whether callback is handed :class:`PushMessage` 
+            instances instead of payloads.
         """
-        self.callback    = callback
-        self.monitor_id  = monitor_id
-        self.client      = client
-        self.socket      = None
-        self.log         = logging.getLogger("push_session[%s]" % monitor_id)
-
-        # Received protocol data holders.
-        self.data           = ""
+        self.callback      = callback
+        self.monitor_id    = monitor_id
+        self.client        = client
+        self.batch_count   = batch_count
+        self.batch_timeout = batch_timeout
+        self.shard_key     = shard_key
+        self.envelope      = envelope
+        self.port          = PUSH_OPEN_PORT
+        self.socket        = None
+        # Connection state (one of the STATE_ constants), consecutive failed
+        # reconnect attempts, the error of the last one and the time the 
+        # next one is scheduled for.
+        self.state         = STATE_CONNECTING
+        self.attempts      = 0
+        self.last_error    = None
+        self.next_attempt  = None
+        # Phase of the non-blocking handshake in progress (one of the PHASE_
+        # constants), None when not handshaking, and the ConnectionRequest 
+        # data not yet sent.
+        self.phase         = None
+        self.request       = None
+        # Set once the handshake begun by create_session or start has 
+        # finished, see wait().
+        self.handshaken    = Event()
+        # Whether the client has been given the connection's TLS session 
+        # to resume, which with TLS 1.3 only arrives with later reads.
+        self.tls_remembered = True
+        # Counters of the session's traffic, updated by the IO thread only 
+        # and summed per monitor by the client's metrics, and the time the 
+        # handshake in progress started.
+        self.bytes_read    = 0
+        self.frames_read   = 0
+        self.acks_sent     = 0
+        self.reconnects    = 0
+        self.connect_started = None
+        # Trace of the message being read, if sampled by a StageHook.
+        self.trace         = None
+        # SegmentLog messages are spooled to, if the client spools.
+        self.spool         = None
+        # Callback worker the session's unkeyed messages are handled by, 
+        # assigned when its first message is queued.
+        self.shard         = None
+        self.log           = logging.getLogger("push_session[%s]" % monitor_id)
+
+        # Received protocol data holders.  Reads fill buffer, and as many 
+        # messages as are complete within buffer[head:tail] are consumed 
+        # per read.  Messages too large for buffer are received into 
+        # large_buffer instead, which grows to fit the largest one seen.
+        self.buffer         = bytearray(READ_BUFFER_SIZE)
+        self.head           = 0
+        self.tail           = 0
+        self.large_buffer   = bytearray()
+        self.message        = None
+        self.received       = 0
+        self.response_type  = None
         self.message_length = 0
         
-    def send_connection_request(self):
+    def start(self):
         """
-        Sends a ConnectionRequest to the iDigi server using the credentials
-        established with the id of the monitor as defined in the monitor 
-        member.
+        Connects the session again once it was stopped.  Returns without 
+        blocking, the client's IO thread performs the connection handshake.
+        Use :meth:`wait` to block until it has finished, which raises the 
+        exception it failed with, if any.
         """
-        try:
-            self.log.info("Sending ConnectionRequest for Monitor %s." 
-                % self.monitor_id)
-            # Send connection request and perform a receive to ensure
-            # request is authenticated.
-            # Protocol Version = 1.
-            payload  = struct.pack('!H', 0x01)
-            # Username Length.
-            payload += struct.pack('!H', len(self.client.username))
-            # Username.
-            payload += self.client.username
-            # Password Length.
-            payload += struct.pack('!H', len(self.client.password))
-            # Password.
-            payload += self.client.password
-            # Monitor ID.
-            payload += struct.pack('!L', int(self.monitor_id))
-
-            # Header 6 Bytes : Type [2 bytes] & Length [4 Bytes]
-            # ConnectionRequest is Type 0x01.
-            data = struct.pack("!HL", CONNECTION_REQUEST, len(payload))
-
-            # The full payload.
-            data += payload
-
-            # Send Connection Request.
-            self.socket.send(data)
-
-            # Set a 60 second blocking on recv, if we don't get any data
-            # within 60 seconds, timeout which will throw an exception.
-            self.socket.settimeout(60)
-
-            # Should receive 10 bytes with ConnectionResponse.
-            response = self.socket.recv(10)
-
-            # Make socket blocking.
-            self.socket.settimeout(0)
-
-            if len(response) != 10:
-                raise PushException("Length of Connection Request Response \
-(%d) is not 10." % len(response))
-
-            # Type
-            response_type = int(struct.unpack("!H", response[0:2])[0])
-            if response_type != CONNECTION_RESPONSE:
-                raise PushException("Connection Response Type (%d) is not \
-ConnectionResponse Type (%d)." % (response_type, CONNECTION_RESPONSE))
+        if self.socket is not None:
+            raise Exception("Socket already established for %s." % self)
+        self.client.start_session(self)
+        return self
 
-            status_code = struct.unpack("!H", response[6:8])[0]
-            self.log.info("Got ConnectionResponse for Monitor %s. Status %s." 
-                % (self.monitor_id, status_code))
-            if status_code != STATUS_OK:
-                raise PushException("Connection Response Status Code (%d) is \
-not STATUS_OK (%d)." % (status_code, STATUS_OK))
-        except Exception, exception:
-            # Likely a socket exception, close it and raise an exception.
-            self.socket.close()
-            self.socket = None
-            raise exception
+    def stop(self):
+        """
+        Closes the socket associated with this session and puts Session 
+        into a state such that it can be re-established later with 
+        :meth:`start`.  The client will not reconnect it.
+        """
+        self.state = STATE_CLOSED
+        self.disconnect()
 
-    def start(self):
+    def disconnect(self):
         """
-        Creates a TCP connection to the iDigi Server and sends a 
-        ConnectionRequest message.
+        Closes the socket associated with this session, leaving its state 
+        as is so that the client may reconnect it.
         """
-        self.log.info("Starting Insecure Session for Monitor %s." 
-            % self.monitor_id)
         if self.socket is not None:
-            raise Exception("Socket already established for %s." % self)
-        
-        try:
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.socket.connect((self.client.hostname, PUSH_OPEN_PORT))
-            self.socket.setblocking(0)
-        except Exception, exception:
+            fileno = self.socket.fileno()
             self.socket.close()
             self.socket = None
-            raise exception
-        
-        self.send_connection_request()
-            
-    def stop(self):
+            # Discard any partially read message so a restart begins
+            # cleanly at a header.
+            self.head = self.tail = 0
+            self.message = None
+            self.received = 0
+            self.message_length = 0
+            self.trace = None
+            # Let the client forget about the socket.
+            self.client.session_stopped(self, fileno)
+
+    def connect(self):
         """
-        Closes the socket associated with this session and puts Session 
-        into a state such that it can be re-established later.
+        Begins a non-blocking connection to the iDigi Server, to be 
+        completed with :meth:`handshake` as the socket becomes ready.  
+        Returns the events to wait for.
         """
         if self.socket is not None:
+            raise Exception("Socket already established for %s." % self)
+
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket.setblocking(0)
+        error = self.socket.connect_ex((self.client.push_host, self.port))
+        if error not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
             self.socket.close()
             self.socket = None
-            self.data = None
+            raise socket.error(error, os.strerror(error))
+
+        self.phase   = PHASE_CONNECT
+        self.request = _connection_request(self.client.username, 
+            self.client.password, self.monitor_id)
+        return EVENT_WRITE
+
+    def tls_handshake(self):
+        """
+        Advances the TLS handshake of the connection.  Returns the events 
+        to wait for, or None once complete.  Plain sessions have none.
+        """
+        return None
+
+    def handshake(self):
+        """
+        Advances the connection handshake begun by :meth:`connect` as far as
+        the socket allows: connecting, the TLS handshake for secure 
+        sessions, sending the ConnectionRequest and reading the 
+        ConnectionResponse.  Returns the events to wait for, or None once 
+        the handshake is complete.  Raises an exception if it failed.
+
+        Data following the ConnectionResponse is left in the read buffer.
+        """
+        while True:
+            if self.phase == PHASE_CONNECT:
+                error = self.socket.getsockopt(socket.SOL_SOCKET, 
+                    socket.SO_ERROR)
+                if error:
+                    raise socket.error(error, os.strerror(error))
+                self.phase = PHASE_TLS
+
+            elif self.phase == PHASE_TLS:
+                events = self.tls_handshake()
+                if events is not None:
+                    return events
+                self.log.info("Sending ConnectionRequest for Monitor %s." 
+                    % self.monitor_id)
+                self.phase = PHASE_REQUEST
+
+            elif self.phase == PHASE_REQUEST:
+                try:
+                    sent = self.socket.send(self.request)
+                except ssl.SSLError as err:
+                    if err.args[0] in (ssl.SSL_ERROR_WANT_READ, 
+                                       ssl.SSL_ERROR_WANT_WRITE):
+                        return EVENT_WRITE
+                    raise
+                except socket.error as err:
+                    if err.args[0] in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        return EVENT_WRITE
+                    raise
+                self.request = self.request[sent:]
+                if self.request:
+                    return EVENT_WRITE
+                self.phase = PHASE_RESPONSE
+
+            elif self.phase == PHASE_RESPONSE:
+                # Should receive 10 bytes with ConnectionResponse.
+                if _recv(self) == NO_DATA:
+                    raise PushException("Connection closed before "
+                        "ConnectionResponse for Monitor %s." 
+                        % self.monitor_id)
+                if self.tail - self.head < 10:
+                    return EVENT_READ
+
+                status_code = _parse_connection_response(
+                    bytes(self.buffer[self.head:self.head + 10]))
+                self.head += 10
+                self.phase = None
+                self.request = None
+                self.log.info("Got ConnectionResponse for Monitor %s. "
+                    "Status %s." % (self.monitor_id, status_code))
+                return None
+
+            else:
+                return None
+
+    def wait(self, timeout=None):
+        """
+        Blocks until the connection handshake begun by 
+        :meth:`PushClient.create_session` or :meth:`start` has finished.
+        Returns the session, or raises the exception the handshake failed 
+        with.
+
+        :param timeout: Most seconds to wait, indefinitely if None.  Raises
+            a :class:`PushException` if exceeded.
+        """
+        if not self.handshaken.wait(timeout):
+            raise PushException("Timed out connecting Monitor %s." 
+                % self.monitor_id)
+        if self.state == STATE_CLOSED and self.last_error is not None:
+            raise self.last_error
+        return self
 
 class SecurePushSession(PushSession):
     """
@@ -271,7 +1827,8 @@ class SecurePushSession(PushSession):
     in ca_certs member file.
     """
     
-    def __init__(self, callback, monitor_id, client, ca_certs=None):
+    def __init__(self, callback, monitor_id, client, ca_certs=None, 
+        **kwargs):
         """
         Creates a PushSession wrapped in SSL for use with interacting with 
         iDigi's Push Functionality.
@@ -284,105 +1841,591 @@ class SecurePushSession(PushSession):
         :param ca_certs: Path to a file containing Certificates.  
             If not provided, the idigi.crt file provided with the module will 
             be used.  In most cases, the idigi.crt file should be acceptable.
+            Only used if the client has no shared ssl_context.
+
+        Remaining keyword arguments are those of :class:`PushSession`.
         """
-        PushSession.__init__(self, callback, monitor_id, client)
+        PushSession.__init__(self, callback, monitor_id, client, **kwargs)
         # Fall back on idigi.crt in the same path as this module if not 
         # specified.
         self.ca_certs = ca_certs if ca_certs is not None else IDIGI_CRT
-    
-    def start(self):
+        self.port     = PUSH_SECURE_PORT
+
+    def tls_handshake(self):
+        """
+        Wraps the connected socket in SSL and advances the TLS handshake.  
+        Returns the events to wait for, or None once complete.
+        """
+        if not isinstance(self.socket, ssl.SSLSocket):
+            self.log.info("Starting SSL Session for Monitor %s." 
+                % self.monitor_id)
+            self.socket = self.wrap_socket(self.socket, 
+                do_handshake_on_connect=False)
+
+        try:
+            self.socket.do_handshake()
+        except ssl.SSLError as err:
+            if err.args[0] == ssl.SSL_ERROR_WANT_READ:
+                return EVENT_READ
+            if err.args[0] == ssl.SSL_ERROR_WANT_WRITE:
+                return EVENT_WRITE
+            raise
+        self.tls_remembered = self.client.remember_tls_session(self.socket)
+        return None
+
+    def wrap_socket(self, sock, do_handshake_on_connect=True):
+        """
+        Wraps a socket in SSL using the client's shared SSLContext, resuming
+        the client's last TLS session with the server where possible.  The 
+        server's host name is sent (SNI) and, unless the client was created 
+        with check_hostname False, checked against its certificate.  
+        Without an SSLContext, the socket is wrapped validating against 
+        ca_certs.
+
+        :param sock: The socket to wrap.
+        :param do_handshake_on_connect: Whether connecting performs the TLS
+            handshake, or it is left to do_handshake.
+        """
+        context = getattr(self.client, 'ssl_context', None)
+        if context is None:
+            # Validate that certificate server uses matches what we expect.
+            if self.ca_certs is not None:
+                return ssl.wrap_socket(sock, cert_reqs=ssl.CERT_REQUIRED, 
+                    ca_certs=self.ca_certs, 
+                    do_handshake_on_connect=do_handshake_on_connect)
+            return ssl.wrap_socket(sock, 
+                do_handshake_on_connect=do_handshake_on_connect)
+
+        options = {}
+        if _TLS_SESSIONS:
+            options['session'] = self.client.tls_session()
+        return context.wrap_socket(sock, 
+            server_hostname=self.client.push_host,
+            do_handshake_on_connect=do_handshake_on_connect, **options)
+
+    def disconnect(self):
+        """
+        Closes the socket associated with this session, keeping its TLS 
+        session (which may only now carry a ticket) for resumption.
+        """
+        if self.socket is not None and self.phase is None:
+            self.client.remember_tls_session(self.socket)
+        PushSession.disconnect(self)
+
+def _load_spooled(session, record):
+    """
+    Reads a spooled PublishMessage from its log and returns a (data, 
+    compression) tuple to invoke the session's callback with: a 
+    :class:`PushMessage` for a session receiving envelopes, received when 
+    the message was spooled, the payload otherwise.
+
+    :param session: The session the message was received on.
+    :param record: The :class:`SpoolRecord` of the message.
+    """
+    body = record.data()
+    if session.envelope:
+        return PushMessage(session, body, record.timestamp), 0x00
+    _, compression, payload = _parse_publish_message(body)
+    return bytes(payload), compression
+
+def _shard_key(session, data, compression, trace=None):
+    """
+    Applies a session's shard_key function to a payload, uncompressing it 
+    first if needed.  Returns a (key, data, compression) tuple of the key,
+    None if the function failed, and the message to queue, uncompressed 
+    if it had to be for the key.  A spooled message is read from its log 
+    for the key and stays in the log.
+
+    :param session: The session the message was received on.
+    :param data: The payload, :class:`PushMessage` or :class:`SpoolRecord`.
+    :param compression: The compression flag of the payload.
+    :param trace: The :class:`Trace` of the message, if sampled.
+    """
+    if isinstance(data, SpoolRecord):
+        keyed, keyed_compression = _load_spooled(session, data)
+        if keyed_compression == 0x01:
+            keyed = zlib.decompress(keyed)
+    else:
+        if compression == 0x01:
+            if trace is not None:
+                trace.begin(STAGE_DECOMPRESS)
+            data = zlib.decompress(data)
+            compression = 0x00
+            if trace is not None:
+                trace.end(STAGE_DECOMPRESS)
+        keyed = data
+    try:
+        return session.shard_key(keyed), data, compression
+    except Exception as exception:
+        LOG.exception(exception)
+        return None, data, compression
+
+class CallbackWorkerPool(object):
+    """
+    A Worker Pool implementation that creates a number of predefined threads
+    used for invoking Session callbacks.  Each worker consumes its own queue 
+    (shard).  Every session is assigned a shard in turn, and its messages 
+    are routed to it unless the session's shard_key gives them a key, in 
+    which case they are routed by the key's hash.  Messages of a session, 
+    or with the same key, are therefore handled in the order they were 
+    received, while other messages are handled in parallel.  With more 
+    sessions (or keys) than workers, some share a worker, and a slow 
+    callback holds up the messages queued behind it.
+    """
+
+    def __consume_queue(self, queue):
+        """
+        Continually blocks until data is on the worker's queue, then calls 
+        the session's registered callback and sends a PublishMessageReceived 
+        if callback returned True.  Payloads of sessions in batched mode are 
+        held until their batch is full or has waited batch_timeout.
+
+        :param queue: The queue this worker consumes.
+        """
+        # Batches this worker is filling, mapping sessions to a tuple of 
+        # the time the batch is due and its queued messages.
+        batches = {}
+
+        while True:
+            timeout = None
+            if batches:
+                due = min(batch[0] for batch in batches.values())
+                timeout = max(0, due - time.time())
+
+            try:
+                item = queue.get(timeout=timeout)
+            except Empty:
+                item = None
+
+            if self.stopped:
+                # Dropped unacknowledged, iDigi sends them again.
+                for due, batch in batches.values():
+                    self.__release(batch)
+                batches.clear()
+                if item is _STOP_WORKER:
+                    queue.task_done()
+                    return
+                if item is not None:
+                    self.__release((item,))
+                    queue.task_done()
+                continue
+
+            if item is not None:
+                self.__queue_wait_seconds.observe(time.time() - item[5])
+                if item[6] is not None:
+                    item[6].end(STAGE_QUEUE)
+                session = item[0]
+                if session.batch_count:
+                    if session not in batches:
+                        batches[session] = \
+                            (time.time() + session.batch_timeout, [])
+                    batch = batches[session][1]
+                    batch.append(item)
+                    if len(batch) >= session.batch_count:
+                        del batches[session]
+                        self.__invoke_batch(session, batch)
+                        self.__release(batch)
+                else:
+                    self.__invoke(*item[:4], trace=item[6])
+                    self.__release((item,))
+                queue.task_done()
+
+            now = time.time()
+            for session, (due, batch) in list(batches.items()):
+                if due <= now:
+                    del batches[session]
+                    self.__invoke_batch(session, batch)
+                    self.__release(batch)
+
+    def __release(self, items):
+        """
+        Reports queued messages as handled.
+
+        :param items: The queued items that were handled.
+        """
+        if self.__done is not None:
+            for item in items:
+                self.__done(item[0], item[4])
+
+    def __acknowledge(self, session, block_id, trace=None):
+        """
+        Queues up a Successful PublishMessageReceived with the block id sent 
+        in request.
+
+        :param session: the session the message was received on.
+        :param block_id: the block_id of the message received.
+        :param trace: the Trace of the message received, if sampled.
+        """
+        if self.__write_queue is not None:
+            response_message = _publish_message_received(block_id)
+            if trace is not None:
+                trace.begin(STAGE_WRITE)
+            self.__write_queue.put((session.socket, response_message, 
+                time.time(), trace))
+            if self.__notify is not None:
+                self.__notify()
+
+    def __invoke(self, session, block_id, data, compression, trace=None):
+        """
+        Invokes a session's callback with a single payload and acknowledges 
+        it if the callback returned True.  A spooled payload is read from 
+        its log first, and completed in the log rather than acknowledged.
+        """
+        record   = None
+        accepted = False
+        if isinstance(data, SpoolRecord) and data.log.closed:
+            # Left to be replayed when the spool is next used.
+            return
+        try:
+            if isinstance(data, SpoolRecord):
+                record = data
+                data, compression = _load_spooled(session, record)
+            started = time.time()
+            if self.__process_pool is not None:
+                if trace is not None:
+                    trace.begin(STAGE_CALLBACK)
+                accepted = self.__process_pool.apply(_run_named_callback, 
+                    (session.callback, data, compression))
+            else:
+                if compression == 0x01:
+                    if trace is not None:
+                        trace.begin(STAGE_DECOMPRESS)
+                    data = zlib.decompress(data)
+                    compression = 0x00
+                    uncompressed = time.time()
+                    self.__decompress_seconds.observe(uncompressed - started)
+                    started = uncompressed
+                    if trace is not None:
+                        trace.end(STAGE_DECOMPRESS)
+                if trace is not None:
+                    trace.begin(STAGE_CALLBACK)
+                accepted = _run_callback(session.callback, data, compression)
+            self.__callback_seconds.observe(time.time() - started)
+            if trace is not None:
+                trace.end(STAGE_CALLBACK)
+
+            if accepted and record is None:
+                self.__acknowledge(session, block_id, trace)
+        except SpoolClosed:
+            # Closed since it was checked, left to be replayed.
+            pass
+        except Exception as exception:
+            self.log.exception(exception)
+        finally:
+            if record is not None:
+                record.complete(accepted)
+
+    def __invoke_batch(self, session, batch):
+        """
+        Invokes a session's callback with a list of payloads and 
+        acknowledges the messages it accepted.
+
+        :param session: the session the messages were received on.
+        :param batch: list of queued (session, block_id, data, compression, 
+            size, queued_at, trace) tuples.
+        """
+        # Spooled messages are left to be replayed once the spool is closed.
+        batch   = [item for item in batch if not 
+            isinstance(item[2], SpoolRecord) or not item[2].log.closed]
+        records = [item[2] if isinstance(item[2], SpoolRecord) else None 
+            for item in batch]
+        traces  = [item[6] for item in batch if item[6] is not None]
+        if not batch:
+            return
+        for trace in traces:
+            trace.begin(STAGE_CALLBACK)
+        accepted = [False] * len(batch)
+        try:
+            items = [_load_spooled(session, record) if record is not None 
+                else (item[2], item[3]) 
+                for item, record in zip(batch, records)]
+            started = time.time()
+            if self.__process_pool is not None:
+                accepted = self.__process_pool.apply(
+                    _run_named_batch_callback, (session.callback, items))
+            else:
+                accepted = _run_batch_callback(session.callback, items, 
+                    self.__decompress_seconds)
+            self.__callback_seconds.observe(time.time() - started)
+        except SpoolClosed:
+            # Closed since it was checked, left to be replayed.
+            return
+        except Exception as exception:
+            self.log.exception(exception)
+        finally:
+            for trace in traces:
+                trace.end(STAGE_CALLBACK)
+
+        for item, record, item_accepted in zip(batch, records, accepted):
+            if record is not None:
+                record.complete(item_accepted)
+            elif item_accepted:
+                self.__acknowledge(session, item[1], item[6])
+
+    def __init__(self, write_queue=None, size=1, notify=None, 
+        process_pool=None, done=None, metrics=None):
+        """
+        Creates a Callback Worker Pool for use in invoking Session Callbacks 
+        when data is received by a push client.
+
+        :param write_queue: Queue used for queueing up socket write events 
+            for when a payload message is received and processed.
+        :param size: The number of worker threads to invoke callbacks.
+        :param notify: Optional function called after a write event has 
+            been queued.
+        :param process_pool: Optional multiprocessing Pool to invoke 
+            callbacks in.  Session callbacks are then importable names 
+            rather than functions, and payloads are uncompressed by the 
+            pool's processes.  Workers still preserve ordering and wait 
+            for each callback's result to acknowledge it.
+        :param done: Optional function called with the session and size of 
+            every queued message once its callback has returned.
+        :param metrics: Optional :class:`Metrics` registry the pool's 
+            histograms are registered with.
+        """
+        self.__process_pool = process_pool
+        self.__done         = done
+        if metrics is None:
+            metrics = Metrics()
+        self.__queue_wait_seconds = metrics.histogram(
+            'idigi_push_callback_queue_wait_seconds', 
+            'Seconds payloads waited in a callback queue for a worker.')
+        self.__callback_seconds   = metrics.histogram(
+            'idigi_push_callback_seconds', 
+            'Seconds callbacks took to return, per invocation.')
+        self.__decompress_seconds = metrics.histogram(
+            'idigi_push_decompress_seconds', 
+            'Seconds payloads took to uncompress.')
+        # Used to queue up PublishMessageReceived events to be sent back to 
+        # the iDigi server.
+        self.__write_queue = write_queue
+        self.__notify      = notify
+        # Used to queue up sessions and data to callback with, one queue 
+        # per worker.  Queues are unbounded, reading is held back by the 
+        # client's FlowControl instead so that the IO thread never blocks.
+        self.__queues = [Queue() for _ in range(size)]
+        # Shard the next session without one is assigned.
+        self.__next_shard = 0
+        self.__shard_lock = Lock()
+        # Number of workers to create, the workers, and whether they have 
+        # been stopped.
+        self.size    = size
+        self.log     = logging.getLogger('callback_worker_pool')
+        self.stopped = False
+        self.__workers = []
+
+        for queue in self.__queues: 
+            worker = Thread(target=self.__consume_queue, args=(queue,))
+            worker.daemon = True
+            worker.start()
+            self.__workers.append(worker)
+
+    def stop(self, timeout=None):
+        """
+        Stops the workers.  Payloads still queued, and batches being filled, 
+        are dropped without invoking their callbacks or acknowledging them, 
+        so that iDigi sends them again.  Nothing may be queued after 
+        stopping.  Returns the number of workers still running a callback 
+        once the timeout expired, which exit once it returns.
+
+        :param timeout: Most seconds to wait for the workers to return from
+            the callbacks they are invoking, indefinitely if None.  A worker 
+            stopping the pool from a callback is not waited for.
+        """
+        self.stopped = True
+        for queue in self.__queues:
+            queue.put(_STOP_WORKER)
+        return _join_workers(self.__workers, timeout)
+
+    def queue_callback(self, session, block_id, data, compression=0x00, 
+        size=None, trace=None, key=None):
         """
-        Creates a SSL connection to the iDigi Server and sends a 
-        ConnectionRequest message.
+        Queues up a callback event to occur for a session with the given 
+        payload data.
+
+        Messages are sharded by the session's shard, or by their key.  If 
+        no key is given for a session with a shard_key function, it is 
+        applied in the calling thread, uncompressing the payload first.  
+        :class:`PushClient` computes keys on a 
+        :class:`DecompressionWorkerPool` instead.
+
+        :param session: the session with a defined callback function to call.
+        :param block_id: the block_id of the message received.
+        :param data: the data payload of the message received, or the 
+            :class:`SpoolRecord` of a spooled message.
+        :param compression: the compression flag of the message received, 
+            compressed data is uncompressed by the worker before invoking 
+            the callback.
+        :param size: the size the message is reported done with, the length
+            of data if not provided.
+        :param trace: the :class:`Trace` of the message, if sampled.  Its 
+            queue stage is expected to have begun.
+        :param key: the key returned by the session's shard_key function 
+            for the message, if already computed.
         """
-        self.log.info("Starting SSL Session for Monitor %s." 
-            % self.monitor_id)
-        if self.socket is not None:
-            raise Exception("Socket already established for %s." % self)
-        
-        try:
-            # Create socket, wrap in SSL and connect.
-            self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            # Validate that certificate server uses matches what we expect.
-            if self.ca_certs is not None:
-                self.socket = ssl.wrap_socket(self.socket, 
-                                                cert_reqs=ssl.CERT_REQUIRED, 
-                                                ca_certs=self.ca_certs)
-            else:
-                self.socket = ssl.wrap_socket(self.socket)
+        if size is None:
+            size = len(data)
+        if key is None and session.shard_key is not None:
+            try:
+                key, data, compression = _shard_key(session, data, 
+                    compression, trace)
+            except Exception as exception:
+                # Fall back on the session's shard.
+                self.log.exception(exception)
 
-            self.socket.connect((self.client.hostname, PUSH_SECURE_PORT))
-            self.socket.setblocking(0)
-        except Exception, exception:
-            self.socket.close()
-            self.socket = None
-            raise exception
-            
-        self.send_connection_request()
+        if key is not None:
+            queue = self.__queues[hash(key) % self.size]
+        else:
+            if session.shard is None:
+                with self.__shard_lock:
+                    if session.shard is None:
+                        session.shard = self.__next_shard
+                        self.__next_shard = (self.__next_shard + 1) \
+                            % self.size
+            queue = self.__queues[session.shard % self.size]
+        queue.put((session, block_id, data, compression, size, time.time(), 
+            trace))
+
+    def depth(self):
+        """
+        Returns the number of payloads queued and not yet picked up by a 
+        worker.
+        """
+        return sum(queue.qsize() for queue in self.__queues)
 
-class CallbackWorkerPool(object):
+class DecompressionWorkerPool(object):
     """
     A Worker Pool implementation that creates a number of predefined threads
-    used for invoking Session callbacks.
+    used for uncompressing payloads, and computing the keys of sessions 
+    with a shard_key function, before they are handed to a 
+    :class:`CallbackWorkerPool`.  Each session is always served by the same 
+    worker so that its messages stay in order.
     """
 
-    def __consume_queue(self):
+    def __consume_queue(self, queue):
         """
-        Continually blocks until data is on the internal queue, then calls 
-        the session's registered callback and sends a PublishMessageReceived 
-        if callback returned True.
+        Continually blocks until data is on the worker's queue, uncompresses 
+        it and queues up the callback.
+
+        :param queue: The queue this worker consumes.
         """
         while True:
-            session, block_id, data = self.__queue.get()
+            item = queue.get()
+            if item is _STOP_WORKER:
+                queue.task_done()
+                return
+            session, block_id, data, compression, size, trace = item
+            if self.stopped:
+                if self.__done is not None:
+                    self.__done(session, size)
+                queue.task_done()
+                continue
             try:
-                if session.callback(data):
-                    # Send a Successful PublishMessageReceived with the 
-                    # block id sent in request
-                    if self.__write_queue is not None:
-                        response_message = struct.pack('!HHH', 
-                                            PUBLISH_MESSAGE_RECEIVED, 
-                                            block_id, 200)
-                        self.__write_queue.put((session.socket, 
-                            response_message))
-            except Exception, exception:
+                if compression == 0x01:
+                    if trace is not None:
+                        trace.begin(STAGE_DECOMPRESS)
+                    started = time.time()
+                    data = zlib.decompress(data)
+                    compression = 0x00
+                    self.__decompress_seconds.observe(time.time() - started)
+                    if trace is not None:
+                        trace.end(STAGE_DECOMPRESS)
+                    if self.__resized is not None:
+                        self.__resized(session, size, len(data))
+                        size = len(data)
+                key = None
+                if session.shard_key is not None:
+                    key, data, compression = _shard_key(session, data, 
+                        compression)
+                self.__callback_pool.queue_callback(session, block_id, 
+                    data, compression, size=size, trace=trace, key=key)
+            except Exception as exception:
                 self.log.exception(exception)
+                if self.__done is not None:
+                    self.__done(session, size)
 
-            self.__queue.task_done()
-
+            queue.task_done()
 
-    def __init__(self, write_queue=None, size=1):
+    def __init__(self, callback_pool, size=1, done=None, metrics=None, 
+        resized=None):
         """
-        Creates a Callback Worker Pool for use in invoking Session Callbacks 
-        when data is received by a push client.
-
-        :param write_queue: Queue used for queueing up socket write events 
-            for when a payload message is received and processed.
-        :param size: The number of worker threads to invoke callbacks.
+        Creates a Decompression Worker Pool.
+
+        :param callback_pool: Pool to hand uncompressed payloads to.
+        :param size: The number of worker threads to uncompress payloads.
+        :param done: Optional function called with the session and size of 
+            a payload that failed to uncompress, and so never reaches the 
+            callback pool.
+        :param metrics: Optional :class:`Metrics` registry the pool's 
+            histogram is registered with.
+        :param resized: Optional function called with the session, and the
+            old and new size of a payload it uncompressed.  The payload is 
+            then reported done with its new size.
         """
-        # Used to queue up PublishMessageReceived events to be sent back to 
-        # the iDigi server.
-        self.__write_queue = write_queue
-        # Used to queue up sessions and data to callback with.
-        self.__queue = Queue(size)
-        # Number of workers to create.
-        self.size = size
-        self.log  = logging.getLogger('callback_worker_pool')
-
-        for _ in range(size): 
-            worker = Thread(target=self.__consume_queue)
+        self.__callback_pool = callback_pool
+        self.__done          = done
+        self.__resized       = resized
+        if metrics is None:
+            metrics = Metrics()
+        self.__decompress_seconds = metrics.histogram(
+            'idigi_push_decompress_seconds', 
+            'Seconds payloads took to uncompress.')
+        # One queue per worker, sessions are assigned to a worker by 
+        # monitor id.
+        self.__queues = [Queue() for _ in range(size)]
+        # Number of workers to create, the workers, and whether they have 
+        # been stopped.
+        self.size    = size
+        self.log     = logging.getLogger('decompression_worker_pool')
+        self.stopped = False
+        self.__workers = []
+
+        for queue in self.__queues:
+            worker = Thread(target=self.__consume_queue, args=(queue,))
             worker.daemon = True
             worker.start()
+            self.__workers.append(worker)
 
-    def queue_callback(self, session, block_id, data):
+    def stop(self, timeout=None):
         """
-        Queues up a callback event to occur for a session with the given 
-        payload data.  Will block if the queue is full.
+        Stops the workers.  Payloads still queued are dropped without being 
+        handed to the callback pool.  Nothing may be queued after stopping.
+        Returns the number of workers still running once the timeout 
+        expired.
 
-        :param session: the session with a defined callback function to call.
+        :param timeout: Most seconds to wait for the workers to exit, 
+            indefinitely if None.
+        """
+        self.stopped = True
+        for queue in self.__queues:
+            queue.put(_STOP_WORKER)
+        return _join_workers(self.__workers, timeout)
+
+    def queue_decompress(self, session, block_id, data, compression=0x01, 
+        size=None, trace=None):
+        """
+        Queues up a payload to be uncompressed if needed, keyed if its 
+        session has a shard_key function, and handed to the callback pool.
+
+        :param session: the session the message was received on.
         :param block_id: the block_id of the message received.
-        :param data: the data payload of the message received.
+        :param data: the payload of the message received, or its 
+            :class:`PushMessage` or :class:`SpoolRecord`.
+        :param compression: the compression flag of the payload.
+        :param size: the size the message is reported done with, the length
+            of data if not provided.
+        :param trace: the :class:`Trace` of the message, if sampled.
+        """
+        if size is None:
+            size = len(data)
+        queue = self.__queues[hash(session.monitor_id) % self.size]
+        queue.put((session, block_id, data, compression, size, trace))
+
+    def depth(self):
+        """
+        Returns the number of payloads queued and not yet uncompressed.
         """
-        self.__queue.put((session, block_id, data))
+        return sum(queue.qsize() for queue in self.__queues)
 
 class PushClient(object):
     """
@@ -390,54 +2433,372 @@ class PushClient(object):
     """
     
     def __init__(self, username, password, hostname='developer.idigi.com', 
-                secure=True, ca_certs=None, workers=1):
+                secure=True, ca_certs=None, workers=1, decompress_workers=0,
+                executor='thread', flow_control=None, 
+                http_pool_size=DEFAULT_HTTP_POOL_SIZE, 
+                monitor_ttl=DEFAULT_MONITOR_TTL, reconnect_policy=None, 
+                push_port=None, spool=None, check_hostname=True):
         """
         Creates a Push Client for use in creating monitors and creating sessions 
         for them.
         
         :param username: Username to authenticate with.
         :param password: Password to authenticate with.
-        :param hostname: Hostname of iDigi server to connect to.
+        :param hostname: Hostname of iDigi server to connect to, optionally 
+            with the port of its web services (i.e. 'localhost:8080').
         :param secure: Whether or not to create a secure SSL wrapped session.
         :param ca_certs: Path to a file containing Certificates.  
             If not provided, the idigi.crt file provided with the module will 
             be used.  In most cases, the idigi.crt file should be acceptable.
+            Web services are validated against ca_certs if provided, with 
+            host names checked, or the platform's trusted certificates.
         :param workers: Number of workers threads to process callback calls.
+            Sessions are assigned a worker in turn, which handles their 
+            messages in order.  With more sessions than workers, sessions 
+            share a worker, and a slow callback holds up the messages of 
+            the others.
+        :param decompress_workers: Number of worker threads dedicated to 
+            uncompressing payloads, and computing the keys of sessions with
+            a shard_key.  Every message passes through them, compressed or 
+            not, so that each session's messages stay in order.  If 0, 
+            payloads are uncompressed by the callback workers, and as many 
+            decompression workers as workers are created for the first 
+            session with a shard_key, serving only sessions with a 
+            shard_key.  Either way the IO thread never uncompresses.
+        :param executor: Where callbacks run, 'thread' to invoke them in the 
+            worker threads or 'process' to invoke them in a pool of workers 
+            processes.  The process executor sidesteps the GIL for CPU bound 
+            callbacks.  It requires callbacks to be module level functions, 
+            or their importable names, and uncompresses payloads in the 
+            worker processes.
+        :param flow_control: A :class:`FlowControl` limiting payloads 
+            received but not yet handled by a callback.  While a session is
+            over its limits, its socket is not read.  If not provided, a 
+            FlowControl with default limits is used.
+        :param http_pool_size: Most persistent connections used at once for 
+            web service requests.
+        :param monitor_ttl: Seconds :meth:`get_monitor` answers from one 
+            listing of all Monitors, see :class:`MonitorRegistry`.  If None,
+            get_monitor queries iDigi on every call instead.
+        :param reconnect_policy: A :class:`ReconnectPolicy` for sessions 
+            whose connection is lost.  If not provided, a ReconnectPolicy 
+            with default settings is used.
+        :param push_port: Port sessions connect to, PUSH_SECURE_PORT or 
+            PUSH_OPEN_PORT by default.
+        :param spool: Optional :class:`Spool` that sessions write received 
+            messages to.  Spooled messages are acknowledged as soon as they 
+            are written, and callbacks read them back from the spool, 
+            which replays those not yet handled when a session of the same
+            Monitor is next created.  Spooled messages do not count against
+            flow_control, so reading is never held back by callbacks and 
+            the spool is bounded by the disk only.
+        :param check_hostname: Whether secure push sessions check that the 
+            server's certificate names hostname.  Only turn this off for 
+            servers whose certificate does not.
         """
+        if executor not in ('thread', 'process'):
+            raise ValueError("Unknown executor %r." % executor)
         self.hostname     = hostname
+        # Sessions connect to the host without any web services port.
+        self.push_host    = hostname.partition(':')[0]
+        self.push_port    = push_port
+        self.spool        = spool
         self.username     = username
         self.password     = password
         self.secure       = secure
         self.ca_certs     = ca_certs
+        # Built once and shared by every secure session, along with the 
+        # last TLS session to resume.
+        self.ssl_context  = _ssl_context(ca_certs if ca_certs is not None 
+            else IDIGI_CRT, check_hostname) if secure else None
+        self.__tls_session = None
+        # Web services are validated against the platform's trusted 
+        # certificates, or ca_certs if given, with host names checked.  
+        # Shared by every web service connection.
+        self.http_ssl_context = ssl.create_default_context(cafile=ca_certs) \
+            if secure and hasattr(ssl, 'create_default_context') else None
         
         # A dict mapping Sockets to their PushSessions
         self.sessions          = {}
-        # IO thread is used monitor sockets and consume data.
+        # Poller used by the IO thread to wait on session sockets.
+        self.__poller          = SocketPoller()
+        # Control events (registering sessions, closing) handed to the IO 
+        # thread.  Writing to the wakeup pipe interrupts a blocked poll.  
+        # The pipe and poller are closed under the lock, once the IO thread
+        # is done with them.
+        self.__control_queue   = Queue()
+        self.__wakeup_lock     = Lock()
+        self.__wakeup_r, self.__wakeup_w = os.pipe()
+        for fileno in (self.__wakeup_r, self.__wakeup_w):
+            fcntl.fcntl(fileno, fcntl.F_SETFL, 
+                fcntl.fcntl(fileno, fcntl.F_GETFL) | os.O_NONBLOCK)
+        self.__poller.register(self.__wakeup_r)
+        # Whether the IO thread has been asked to check the write queue.
+        self.__write_pending   = False
+        # IO thread is used monitor sockets, consume data and write to them.
         self.__io_thread       = None
-        # Writer thread is used to send data on sockets.
-        self.__writer_thread   = None
+        self.__io_thread_lock  = Lock()
+        # Timers run by the IO thread, a heap of (due, sequence, function, 
+        # args) tuples.
+        self.__timers          = []
+        self.__timer_sequence  = 0
+        # Lost sessions being reconnected, those waiting for a connect slot,
+        # and the number of connects in progress.
+        self.reconnect_policy  = reconnect_policy \
+            if reconnect_policy is not None else ReconnectPolicy()
+        self.__reconnecting    = set()
+        self.__connect_queue   = deque()
+        self.__connecting      = 0
         # Write queue is used to queue up data to write to sockets.
         self.__write_queue     = Queue()
+        # A dict mapping Sockets to OutboundBuffers with unwritten data.
+        self.__outbound        = {}
+        # Counters and histograms of the push pipeline, see __init_metrics.
+        self.metrics           = Metrics()
+        # Totals of the session counters by counter and monitor id, over 
+        # every session of a monitor there has been.  Updated by the IO 
+        # thread only.
+        self.__monitor_counters = dict((attribute, {}) for attribute in 
+            ('bytes_read', 'frames_read', 'acks_sent', 'reconnects'))
+        # Registered (StageHook, sample) tuples, replaced rather than 
+        # modified so that the IO thread reads them without locking, and 
+        # the number of messages read while any were registered.
+        self.__hooks           = ()
+        self.__hooks_lock      = Lock()
+        self.__sequence        = 0
+        # Limits on pending payloads, pausing sessions that exceed them.
+        self.flow_control      = flow_control if flow_control is not None \
+            else FlowControl()
+        # Whether the IO thread has been asked to resume paused sessions.
+        self.__resume_pending  = False
+        # Processes that callbacks are invoked in, with the process 
+        # executor.  Created before any thread is started.
+        self.__process_pool    = multiprocessing.Pool(workers) \
+            if executor == 'process' else None
         # A pool that monitors callback events and invokes them.
         self.__callback_pool   = CallbackWorkerPool(self.__write_queue, 
-                                                    size=workers)
+                                    size=workers, notify=self.__notify_write,
+                                    process_pool=self.__process_pool,
+                                    done=self.__message_done,
+                                    metrics=self.metrics)
+        # An optional pool dedicated to uncompressing payloads, created for
+        # the first session with a shard_key if not requested.
+        self.__decompress_pool = DecompressionWorkerPool(self.__callback_pool,
+            size=decompress_workers, done=self.__message_done, 
+            metrics=self.metrics, resized=self.flow_control.resize) \
+            if decompress_workers > 0 else None
+        # Whether the decompression pool handles the messages of every 
+        # session, rather than only serving sessions with a shard_key.
+        self.__decompress_all  = decompress_workers > 0
+        self.__pool_lock       = Lock()
+
+        # Persistent connections shared by the web service requests.
+        self.http_pool         = HTTPConnectionPool(self.get_http_connection, 
+                                    size=http_pool_size)
+        # Monitors of the account by topics, used by get_monitor.
+        self.monitors          = MonitorRegistry(self, ttl=monitor_ttl) \
+            if monitor_ttl is not None else None
 
         self.closed            = False
         self.log               = logging.getLogger('push_client')
+        self.__init_metrics()
 
         self.headers           = {
             'Authorization': 'Basic ' \
-            + base64.encodestring('%s:%s' %
-                (self.username,self.password))[:-1]
+            + base64.b64encode(_to_bytes('%s:%s' %
+                (self.username,self.password))).decode('ascii')
         }
 
+    def __init_metrics(self):
+        """
+        Registers the client's metrics.  Per session counters are kept on 
+        the sessions and only summed up when the metrics are read, so that 
+        the IO thread updates them without locking.
+        """
+        metrics = self.metrics
+        self.__handshake_seconds = metrics.histogram(
+            'idigi_push_handshake_seconds', 
+            'Seconds from connecting a session to its ConnectionResponse.')
+        self.__ack_seconds       = metrics.histogram(
+            'idigi_push_ack_latency_seconds', 
+            'Seconds acknowledgements waited to be written to a socket.')
+        # Time PublishMessageReceived acknowledgements wait between their 
+        # callback returning and being written to the socket, summarized 
+        # from the histogram they are recorded in.
+        self.ack_latency         = LatencyStats(self.__ack_seconds)
+        self.__io_wakeups        = metrics.counter(
+            'idigi_push_io_wakeups_total', 
+            'Times the IO thread woke up from polling.')
+
+        for attribute, name, help in (
+            ('bytes_read', 'idigi_push_session_read_bytes_total', 
+                'Bytes read off a session\'s socket.'),
+            ('frames_read', 'idigi_push_session_read_frames_total', 
+                'Protocol messages read off a session\'s socket.'),
+            ('acks_sent', 'idigi_push_session_acks_sent_total', 
+                'PublishMessageReceived acknowledgements written.'),
+            ('reconnects', 'idigi_push_session_reconnects_total', 
+                'Times a session\'s connection was lost and restarted.')):
+            metrics.collected_counter(name, help, 
+                self.__session_counter(attribute))
+
+        metrics.gauge('idigi_push_sessions', 'Sessions by connection state.',
+            self.__session_states)
+        metrics.gauge('idigi_push_callback_queue_depth', 
+            'Payloads queued for a callback worker.', 
+            self.__callback_pool.depth)
+        metrics.gauge('idigi_push_decompress_queue_depth', 
+            'Payloads queued for a decompression worker.', 
+            lambda: self.__decompress_pool.depth() 
+                if self.__decompress_pool is not None else 0)
+        metrics.gauge('idigi_push_write_queue_depth', 
+            'Acknowledgements queued for the IO thread to write.', 
+            self.__write_queue.qsize)
+        metrics.gauge('idigi_push_pending_messages', 
+            'Payloads received and not yet handled by a callback.', 
+            lambda: self.flow_control.messages)
+        metrics.gauge('idigi_push_pending_bytes', 
+            'Bytes of payloads received and not yet handled by a callback.', 
+            lambda: self.flow_control.bytes)
+
+    def add_hook(self, hook, sample=1):
+        """
+        Registers a :class:`StageHook` to observe messages through the 
+        stages of the push pipeline.
+
+        :param hook: The StageHook.
+        :param sample: The hook observes 1 in this many messages read.
+        """
+        if sample < 1:
+            raise ValueError("sample must be at least 1.")
+        with self.__hooks_lock:
+            self.__hooks = self.__hooks + ((hook, sample),)
+
+    def remove_hook(self, hook):
+        """
+        Unregisters a :class:`StageHook`.  Messages it already sampled are 
+        still handed to it.
+
+        :param hook: The StageHook to remove.
+        """
+        with self.__hooks_lock:
+            self.__hooks = tuple(registered for registered in self.__hooks 
+                if registered[0] is not hook)
+
+    def __sample(self, session):
+        """
+        Returns a :class:`Trace` for the message about to be read on a 
+        session if any hook samples it, otherwise None.  Runs on the IO 
+        thread.
+
+        :param session: The session the message is read on.
+        """
+        hooks = self.__hooks
+        if not hooks:
+            return None
+        self.__sequence += 1
+        sequence = self.__sequence
+        sampled = [hook for hook, sample in hooks if sequence % sample == 0]
+        if not sampled:
+            return None
+        return Trace(sampled, session.monitor_id, sequence)
+
+    def __all_sessions(self):
+        """
+        Returns the sessions that are connected, connecting or waiting to 
+        reconnect.  Safe to call from any thread.
+        """
+        sessions = set(list(self.sessions.values()) 
+            + list(self.__reconnecting))
+        sessions.discard(None)
+        return sessions
+
+    def __session_counter(self, attribute):
+        """
+        Returns a function reading a counter summed over the sessions of 
+        each monitor, past and present, labelled by monitor id.
+
+        :param attribute: The PushSession attribute holding the counter.
+        """
+        totals = self.__monitor_counters[attribute]
+        def collect():
+            return [({'monitor_id': monitor_id}, total) 
+                for monitor_id, total in list(totals.items())]
+        return collect
+
+    def __count(self, session, attribute, amount=1):
+        """
+        Increases a counter of a session, and its monitor's total.  Runs on 
+        the IO thread.
+
+        :param session: The session counted for.
+        :param attribute: The PushSession attribute holding the counter.
+        :param amount: Amount to increase the counter by.
+        """
+        setattr(session, attribute, getattr(session, attribute) + amount)
+        totals = self.__monitor_counters[attribute]
+        totals[session.monitor_id] = totals.get(session.monitor_id, 0) \
+            + amount
+
+    def __session_states(self):
+        """
+        Returns the number of sessions in every connection state.
+        """
+        states = dict((state, 0) for state in 
+            (STATE_CONNECTING, STATE_CONNECTED, STATE_RECONNECTING))
+        for session in self.__all_sessions():
+            if session.state in states:
+                states[session.state] += 1
+        return [({'state': state}, count) for state, count in 
+            sorted(states.items())]
+
     def get_http_connection(self):
         """
         Returns a HTTPConnection or HTTPSConnection (depending on whether or 
         not secure is set) to be used for interfacing with iDigi web services.
         """
-        return httplib.HTTPSConnection(self.hostname) if self.secure \
-            else httplib.HTTPConnection(self.hostname)
+        if not self.secure:
+            return httplib.HTTPConnection(self.hostname)
+        if self.http_ssl_context is not None:
+            return httplib.HTTPSConnection(self.hostname, 
+                context=self.http_ssl_context)
+        return httplib.HTTPSConnection(self.hostname)
+
+    def tls_session(self):
+        """
+        Returns the TLS session to resume when connecting to the server, or
+        None if there is none.
+        """
+        return self.__tls_session
+
+    def remember_tls_session(self, sock):
+        """
+        Keeps the TLS session of a connected SSL socket for later 
+        connections to resume.  TLS 1.3 sessions are kept once they carry 
+        a ticket.  Returns False if the session may still be worth keeping
+        after more has been read from the socket.
+
+        :param sock: A connected SSL socket.
+        """
+        tls_session = getattr(sock, 'session', None)
+        if tls_session is None:
+            return True
+        if tls_session.has_ticket or sock.version() != 'TLSv1.3':
+            self.__tls_session = tls_session
+            return True
+        return False
+
+    def __request(self, method, url, body=None):
+        """
+        Performs an authenticated request against the iDigi web services on
+        a pooled connection.  Returns a tuple of the response and its 
+        content.
+
+        :param method: HTTP method (i.e. 'GET').
+        :param url: Path and query to request (i.e. '/ws/Monitor').
+        :param body: Optional request body.
+        """
+        return self.http_pool.request(method, url, body, self.headers)
 
 
     def create_monitor(self, topics, batch_size=1, batch_duration=0, 
@@ -456,38 +2817,19 @@ class PushClient(object):
         
         Returns a string of the created Monitor Id (i.e. 9001)
         """
-        # Create Monitor Request XML.
-        monitor_req = DOM.createDocument(None, "Monitor", None)
-        root = monitor_req.documentElement
-
-        attrs = { 'monTopic' : ','.join(topics), 
-                    'monBatchSize' : str(batch_size),
-                    'monBatchDuration' : str(batch_duration),
-                    'monFormatType' : format_type,
-                    'monTransportType' : 'tcp',
-                    'monCompression' : compression }
-
-        for tag, value in attrs.items():
-            element = monitor_req.createElement(tag)
-            element.appendChild(monitor_req.createTextNode(value))
-            root.appendChild(element)
-
-        request = root.toxml()
+        request = _monitor_request(topics, batch_size, batch_duration, 
+            compression, format_type)
 
         # POST Monitor Request.
-        connection = self.get_http_connection()
-        connection.request('POST', '/ws/Monitor', request, self.headers)
-        response = connection.getresponse()
-        try:
-            if response.status == 201:
-                location = response.getheader('location').split('/')[-1]
-                return location
-            else:
-                raise Exception("Monitor Could not be Created (%d): %s" \
-                    % (response.status, response.read()))
-        finally:
-            connection.close()
-
+        response, content = self.__request('POST', '/ws/Monitor', request)
+        if response.status == 201:
+            location = response.getheader('location').split('/')[-1]
+            if self.monitors is not None:
+                self.monitors.add(location, topics)
+            return location
+        else:
+            raise Exception("Monitor Could not be Created (%d): %s" \
+                % (response.status, content))
 
     def delete_monitor(self, monitor_id):
         """
@@ -496,87 +2838,568 @@ class PushClient(object):
 
         :param monitor_id: id of the Monitor (i.e. 1000).
         """
-
-        connection = self.get_http_connection()
-        connection.request('DELETE', '/ws/Monitor/%s' % monitor_id, 
-                            headers=self.headers)
-        response = connection.getresponse()
-
-        try:
-            if response.status != 200:
-                raise Exception("Monitor Could not be Deleted (%s): %s" \
-                    % (response.status, response.read()))
-        finally:
-            connection.close()
+        response, content = self.__request('DELETE', 
+            '/ws/Monitor/%s' % monitor_id)
+        if response.status != 200:
+            raise Exception("Monitor Could not be Deleted (%s): %s" \
+                % (response.status, content))
+        if self.monitors is not None:
+            self.monitors.remove(monitor_id)
         
     def get_monitor(self, topics):
         """
         Attempts to find a Monitor in iDigi that matches the input list of 
-        topics.
+        topics.  Unless the client was created without a monitor_ttl, the 
+        Monitor is looked up in :attr:`monitors`, which lists all Monitors 
+        at once and matches topics in any order.
         
         :param topics: a string list of topics 
             (i.e. ['DeviceCore[U]', 'FileDataCore']).
         
         Returns a monitor ID if found, otherwise None.
         """
-        # Query for Monitor conditionally by monTopic.
-        params = {'condition' : "monTopic='%s'" % ','.join(topics)}
-        url = '/ws/Monitor/.json?' + urllib.urlencode([(key, params[key]) \
-            for key in params])
-        
-        connection = self.get_http_connection()
-        connection.request('GET', url, headers=self.headers)
+        if self.monitors is not None:
+            return self.monitors.get(topics)
 
-        response = connection.getresponse()
+        url = _monitor_query(topics)
+        
+        response, content = self.__request('GET', url)
+        if response.status != 200:
+            raise Exception("Monitor Could not be Retrieved (%s): %s" \
+                % (response.status, content))
+
+        monitor_data = json.loads(content.decode('utf-8'))
+
+        # If no matching Monitor found, return None.
+        if monitor_data['resultSize'] == '0': 
+            return None
+        # Otherwise grab the first found monitor's id.
+        return monitor_data['items'][0]['monId']
+        
+    def list_monitors(self, page_size=DEFAULT_MONITOR_PAGE_SIZE):
+        """
+        Lists all Monitors of the account, page by page.
 
-        try:
-            content = response.read()
+        :param page_size: Most Monitors requested per page.
 
+        Returns a list of the Monitors, as dicts of their fields (i.e. 
+        monId and monTopic).
+        """
+        monitors = []
+        while True:
+            response, content = self.__request('GET', 
+                _monitor_listing(len(monitors), page_size))
             if response.status != 200:
-                raise Exception("Monitor Could not be Retrieved (%s): %s" \
+                raise Exception("Monitors Could not be Listed (%s): %s" \
                     % (response.status, content))
 
-            monitor_data = json.loads(content)
+            page = json.loads(content.decode('utf-8'))
+            items = page.get('items', [])
+            monitors.extend(items)
+
+            remaining = page.get('remainingSize')
+            if not items or (int(remaining) == 0 if remaining is not None 
+                    else len(items) < page_size):
+                return monitors
+
+    def create_monitors(self, specs, concurrency=None, rate=None):
+        """
+        Creates many Monitors concurrently.
+
+        :param specs: The Monitors to create, each either a list of topics 
+            or a dict of :meth:`create_monitor` keyword arguments.
+        :param concurrency: Most Monitors created at once, http_pool_size 
+            by default.
+        :param rate: Most requests started per second, unlimited if None.
+
+        Returns a list with a :class:`BulkResult` per spec, in order, 
+        holding the Monitor id or the exception raised creating it.
+        """
+        def create(spec):
+            if isinstance(spec, dict):
+                return self.create_monitor(**spec)
+            return self.create_monitor(spec)
+
+        return _bulk(create, specs, concurrency or self.http_pool.size, rate)
+
+    def delete_monitors(self, monitor_ids, concurrency=None, rate=None):
+        """
+        Deletes many Monitors concurrently.
+
+        :param monitor_ids: ids of the Monitors to delete.
+        :param concurrency: Most Monitors deleted at once, http_pool_size 
+            by default.
+        :param rate: Most requests started per second, unlimited if None.
+
+        Returns a list with a :class:`BulkResult` per Monitor id, in order, 
+        holding the exception raised deleting it, if any.
+        """
+        return _bulk(self.delete_monitor, monitor_ids, 
+            concurrency or self.http_pool.size, rate)
+
+    def create_sessions(self, pairs, concurrency=DEFAULT_BULK_CONCURRENCY, 
+        rate=None):
+        """
+        Creates many Sessions and waits for them to connect.
+
+        :param pairs: (callback, monitor_id) tuples, or (callback, 
+            monitor_id, options) tuples where options is a dict of 
+            :meth:`create_session` keyword arguments.
+        :param concurrency: Most sessions connecting at once.
+        :param rate: Most connections started per second, unlimited if None.
+
+        Returns a list with a :class:`BulkResult` per pair, in order, 
+        holding the connected PushSession or the exception connecting it 
+        failed with.
+        """
+        def create(pair):
+            options = pair[2] if len(pair) > 2 else {}
+            return self.create_session(pair[0], pair[1], **options).wait()
+
+        return _bulk(create, pairs, concurrency, rate)
+
+    def __wakeup(self):
+        """
+        Interrupts the IO thread if it is blocked waiting on sockets.
+        """
+        with self.__wakeup_lock:
+            if self.__wakeup_w is None:
+                # The IO thread is done.
+                return
+            try:
+                os.write(self.__wakeup_w, b'\x00')
+            except OSError as err:
+                # Pipe is full, so a wakeup is already pending.
+                if err.errno != errno.EAGAIN:
+                    raise
+
+    def __close_io(self):
+        """
+        Closes the poller and the wakeup pipe, once the IO thread has exited
+        or if it never started.
+        """
+        with self.__wakeup_lock:
+            if self.__wakeup_w is None:
+                return
+            self.__poller.close()
+            os.close(self.__wakeup_r)
+            os.close(self.__wakeup_w)
+            self.__wakeup_r = self.__wakeup_w = None
+
+    def __control(self, function, *args):
+        """
+        Hands a control event to the IO thread and wakes it up.
+
+        :param function: Callable to invoke on the IO thread.
+        :param args: Arguments to invoke the callable with.
+        """
+        self.__control_queue.put((function, args))
+        self.__wakeup()
+
+    def __process_control_events(self):
+        """
+        Drains the wakeup pipe and runs any pending control events.
+        """
+        try:
+            while os.read(self.__wakeup_r, 4096):
+                pass
+        except OSError as err:
+            if err.errno != errno.EAGAIN:
+                raise
+
+        while True:
+            try:
+                function, args = self.__control_queue.get_nowait()
+            except Empty:
+                break
+            function(*args)
+
+    def __discard_outbound(self, fileno):
+        """
+        Drops unwritten data for a socket that is being closed.
+
+        :param fileno: The file descriptor of the socket.
+        """
+        self.__outbound.pop(fileno, None)
+
+    def __discard_session(self, session, fileno):
+        """
+        Forgets a session whose socket has been closed.  Runs on the IO 
+        thread.
+
+        :param session: The session that was stopped.
+        :param fileno: The file descriptor the session's socket had.
+        """
+        # The descriptor may have been reused by a restarted session.
+        if self.sessions.get(fileno) is session and session.socket is None:
+            del self.sessions[fileno]
+            self.__poller.unregister(fileno)
+            self.__discard_outbound(fileno)
+            if session.phase is not None:
+                # Stopped while handshaking.
+                session.phase = None
+                self.__handshake_done(session, 
+                    PushException("Session for Monitor %s stopped while "
+                        "connecting." % session.monitor_id))
+
+    def session_stopped(self, session, fileno):
+        """
+        Called by a session when its socket is closed so that the IO thread 
+        stops watching it.
+
+        :param session: The session that was stopped.
+        :param fileno: The file descriptor the session's socket had.
+        """
+        self.__control(self.__discard_session, session, fileno)
+
+    def __call_later(self, delay, function, *args):
+        """
+        Schedules a function to run on the IO thread after a delay.  Runs 
+        on the IO thread.
+
+        :param delay: Seconds to wait.
+        :param function: Callable to invoke.
+        :param args: Arguments to invoke the callable with.
+        """
+        self.__timer_sequence += 1
+        heapq.heappush(self.__timers, 
+            (time.time() + delay, self.__timer_sequence, function, args))
+
+    def __run_timers(self):
+        """
+        Runs timers that are due and returns the seconds until the next 
+        one, or None if there is none.  Runs on the IO thread.
+        """
+        while self.__timers:
+            due = self.__timers[0][0]
+            now = time.time()
+            if due > now:
+                return due - now
+            _, _, function, args = heapq.heappop(self.__timers)
+            function(*args)
+        return None
 
-            # If no matching Monitor found, return None.
-            if monitor_data['resultSize'] == '0': 
-                return None
-            # Otherwise grab the first found monitor's id.
-            return monitor_data['items'][0]['monId']
-        finally:
-            connection.close()
-        
     def __restart_session(self, session):
         """
-        Restarts and re-establishes session.
+        Closes a session whose connection was lost and schedules it to be 
+        reconnected.  Runs on the IO thread.
 
         :param session: The session to restart.
         """
         # remove old session key, if socket is None, that means the
         # session was closed by user and there is no need to restart.
         if session.socket is not None:
-            self.log.info("Attempting restart session for Monitor Id %s."
-             % session.monitor_id)
-            del self.sessions[session.socket.fileno()]
-            session.stop()
-            session.start()
-            self.sessions[session.socket.fileno()] = session
+            fileno = session.socket.fileno()
+            del self.sessions[fileno]
+            self.__poller.unregister(fileno)
+            self.__discard_outbound(fileno)
+            session.disconnect()
+            session.state = STATE_RECONNECTING
+            self.__count(session, 'reconnects')
+            self.__reconnecting.add(session)
+            self.__schedule_reconnect(session)
+
+    def __schedule_reconnect(self, session):
+        """
+        Schedules a reconnect attempt after the session's backoff delay.  
+        Runs on the IO thread.
+
+        :param session: The session to reconnect.
+        """
+        delay = self.reconnect_policy.delay(session.attempts)
+        session.next_attempt = time.time() + delay
+        self.log.info("Reconnecting Monitor %s in %.1f seconds." 
+            % (session.monitor_id, delay))
+        self.__call_later(delay, self.__reconnect, session)
+
+    def __reconnect(self, session):
+        """
+        Starts a non-blocking handshake for a session, see 
+        :meth:`__begin_handshake`, or queues it while max_concurrent 
+        sessions are already connecting.  Runs on the IO thread, like the 
+        handshake itself.
+
+        :param session: The session to reconnect.
+        """
+        if session.state == STATE_CLOSED \
+            or session not in self.__reconnecting:
+            # Stopped while waiting, and maybe started again since.
+            self.__reconnecting.discard(session)
+            return
+        if self.__connecting >= self.reconnect_policy.max_concurrent:
+            self.__connect_queue.append(session)
+            return
+
+        self.log.info("Attempting restart session for Monitor Id %s."
+            % session.monitor_id)
+        self.__connecting += 1
+        session.next_attempt = None
+        self.__begin_handshake(session)
+
+    def __begin_handshake(self, session):
+        """
+        Starts connecting a session and watches its socket until the 
+        handshake completes or HANDSHAKE_TIMEOUT passes.  Runs on the IO 
+        thread.
+
+        :param session: The session to connect.
+        """
+        if session.state == STATE_CLOSED and session not in self.__reconnecting:
+            # Stopped before the IO thread got to it.
+            self.__handshake_done(session, PushException("Session for "
+                "Monitor %s stopped while connecting." % session.monitor_id))
+            return
+
+        session.state = STATE_CONNECTING
+        session.connect_started = time.time()
+        try:
+            events = session.connect()
+        except Exception as exception:
+            self.__handshake_done(session, exception)
+            return
+
+        fileno = session.socket.fileno()
+        self.sessions[fileno] = session
+        self.__poller.register(fileno, events)
+        self.__call_later(HANDSHAKE_TIMEOUT, self.__handshake_timeout, 
+            session, session.socket)
+
+    def __handshake_timeout(self, session, sock):
+        """
+        Aborts a handshake that is still in progress on the same socket.  
+        Runs on the IO thread.
+
+        :param session: The session that was connecting.
+        :param sock: The socket the handshake was started on.
+        """
+        if session.phase is not None and session.socket is sock:
+            self.__abort_handshake(session, sock.fileno(), 
+                PushException("Timed out connecting Monitor %s in phase %s." 
+                    % (session.monitor_id, session.phase)))
+
+    def __advance_handshake(self, session, fileno):
+        """
+        Advances a session's handshake when its socket is ready.  Runs on 
+        the IO thread.
+
+        :param session: The session that is connecting.
+        :param fileno: The file descriptor of the session's socket.
+        """
+        try:
+            events = session.handshake()
+        except Exception as exception:
+            self.__abort_handshake(session, fileno, exception)
+            return
+
+        if events is not None:
+            self.__poller.modify(fileno, events)
+            return
+
+        self.__poller.modify(fileno, self.__events(session, fileno))
+        self.__handshake_done(session, None)
+        # Messages may have arrived along with the ConnectionResponse.
+        while session.phase is None and self.__read_session(session):
+            pass
+
+    def __abort_handshake(self, session, fileno, error):
+        """
+        Closes a session whose handshake failed.  Runs on the IO thread.
+
+        :param session: The session that was connecting.
+        :param fileno: The file descriptor of the session's socket.
+        :param error: The exception the handshake failed with.
+        """
+        if self.sessions.get(fileno) is session:
+            del self.sessions[fileno]
+            self.__poller.unregister(fileno)
+            self.__discard_outbound(fileno)
+        session.phase = None
+        session.disconnect()
+        self.__handshake_done(session, error)
+
+    def __handshake_done(self, session, error):
+        """
+        Handles the outcome of a session's handshake.  Runs on the IO 
+        thread.
+
+        :param session: The session that was connecting.
+        :param error: The exception the handshake failed with, if any.
+        """
+        if error is None and session.connect_started is not None:
+            self.__handshake_seconds.observe(
+                time.time() - session.connect_started)
+        if session in self.__reconnecting:
+            self.__reconnected(session, error)
+            return
+
+        if error is not None:
+            self.log.error("Could not connect Monitor %s: %r." 
+                % (session.monitor_id, error))
+            session.state = STATE_CLOSED
+            session.last_error = error
+        else:
+            session.state = STATE_CONNECTED
+        session.handshaken.set()
+
+    def __reconnected(self, session, error):
+        """
+        Handles the outcome of a reconnect attempt.  Runs on the IO thread.
+
+        :param session: The session that was connecting.
+        :param error: The exception the attempt failed with, if any.
+        """
+        self.__connecting -= 1
+        if session.state == STATE_CLOSED:
+            # Stopped while connecting.
+            self.__reconnecting.discard(session)
+        elif error is not None:
+            self.log.error("Restart failed for Monitor %s: %r." 
+                % (session.monitor_id, error))
+            session.attempts += 1
+            session.last_error = error
+            session.state = STATE_RECONNECTING
+            self.__schedule_reconnect(session)
+        else:
+            session.attempts = 0
+            session.last_error = None
+            session.state = STATE_CONNECTED
+            self.__reconnecting.discard(session)
+
+        while self.__connect_queue \
+            and self.__connecting < self.reconnect_policy.max_concurrent:
+            self.__reconnect(self.__connect_queue.popleft())
+
+    def __events(self, session, fileno):
+        """
+        Returns the events to watch a session's socket for.  Sockets are 
+        read unless their session is paused, and written to while they have
+        outbound data.
+
+        :param session: The session the socket belongs to.
+        :param fileno: The file descriptor of the socket.
+        """
+        events = 0 if session in self.flow_control.paused else EVENT_READ
+        if fileno in self.__outbound:
+            events |= EVENT_WRITE
+        return events
+
+    def __message_done(self, session, size):
+        """
+        Called by the worker pools when a payload has been handled, wakes 
+        up the IO thread if a paused session may resume.
 
-    def __writer(self):
+        :param session: The session the payload was received on.
+        :param size: The size the payload was counted with.
         """
-        Indefinitely checks the writer queue for data to write
-        to socket.
+        if session.spool is not None:
+            # Spooled payloads are not counted.
+            return
+        if self.flow_control.release(session, size) \
+            and not self.__resume_pending:
+            self.__resume_pending = True
+            self.__control(self.__resume_sessions)
+
+    def __resume_sessions(self):
         """
-        while not self.closed:
+        Resumes reading the sockets of sessions that are back below their 
+        low water marks.  Runs on the IO thread.
+        """
+        self.__resume_pending = False
+        for session in self.flow_control.resumable():
+            try:
+                fileno = session.socket.fileno() \
+                    if session.socket is not None else None
+            except socket.error:
+                fileno = None
+            if self.sessions.get(fileno) is not session:
+                continue
+            self.log.debug("Resuming reads for Monitor %s." 
+                % session.monitor_id)
+            self.__poller.modify(fileno, self.__events(session, fileno))
+            # Messages buffered when the session paused, and decrypted data 
+            # already read off the socket, will not be reported by the 
+            # poller.
+            if self.__drain(session):
+                while self.__read_session(session):
+                    pass
+
+    def __notify_write(self):
+        """
+        Wakes up the IO thread to write newly queued data, unless it has 
+        already been woken up for a write it has not yet picked up.
+        """
+        if not self.__write_pending:
+            self.__write_pending = True
+            self.__wakeup()
+
+    def __process_write_queue(self):
+        """
+        Moves everything queued for writing into the outbound buffers of 
+        their sockets and writes as much as each socket accepts.  Runs on 
+        the IO thread.
+        """
+        self.__write_pending = False
+        flush = set()
+        while True:
             try:
-                sock, data = self.__write_queue.get(timeout=0.1)
-                self.__write_queue.task_done()
-                sock.send(data)
+                sock, data, queued_at, trace = \
+                    self.__write_queue.get_nowait()
             except Empty:
-                pass # nothing to write after timeout
-            except socket.error, err:
-                if err.errno == errno.EBADF:
-                    self.__clean_dead_sessions()
+                break
+            self.__write_queue.task_done()
+
+            try:
+                fileno = sock.fileno() if sock is not None else None
+            except socket.error:
+                fileno = None
+            session = self.sessions.get(fileno)
+            if session is None or session.socket is not sock:
+                # Socket has since been closed, the message is moot.
+                continue
+
+            buf = self.__outbound.get(fileno)
+            if buf is None:
+                buf = self.__outbound[fileno] = OutboundBuffer(sock)
+            buf.append(data, queued_at, trace)
+            flush.add(fileno)
+
+        for fileno in flush:
+            self.__flush(fileno)
+
+    def __flush(self, fileno):
+        """
+        Writes as much of a socket's outbound buffer as it accepts, and 
+        watches the socket for writability while data remains.  Runs on 
+        the IO thread.
+
+        :param fileno: The file descriptor of the socket to write to.
+        """
+        buf = self.__outbound.get(fileno)
+        if buf is None:
+            return
+
+        try:
+            written = buf.flush()
+            for latency, trace in written:
+                self.__ack_seconds.observe(latency)
+                if trace is not None:
+                    trace.end(STAGE_WRITE)
+            if written and fileno in self.sessions:
+                self.__count(self.sessions[fileno], 'acks_sent', 
+                    len(written))
+        except socket.error as err:
+            # The read side notices the failure and restarts the session.
+            self.log.error("Write failed for Monitor %s: %s." 
+                % (self.sessions[fileno].monitor_id 
+                    if fileno in self.sessions else fileno, err))
+            buf.data = None
+
+        if not buf.data:
+            del self.__outbound[fileno]
+
+        session = self.sessions.get(fileno)
+        if session is not None and fileno in self.__poller.registered:
+            self.__poller.modify(fileno, self.__events(session, fileno))
 
     def __clean_dead_sessions(self):
         """
@@ -584,153 +3407,432 @@ class PushClient(object):
         were removed (indicates a stopped session).  
         In these cases, remove the session.
         """
-        for sck in self.sessions.keys():
+        for sck in list(self.sessions.keys()):
             session = self.sessions[sck]
             if session.socket is None:
                 del self.sessions[sck]
+                self.__poller.unregister(sck)
+                self.__discard_outbound(sck)
+
+    def __read_session(self, session):
+        """
+        Performs one read on a session's socket and forwards every complete 
+        PublishMessage now buffered on to the callback pool.
+
+        :param session: The session whose socket is ready for reading.
+
+        Returns True if the session may have more buffered data to read 
+        without waiting on the socket again.
+        """
+        if session.socket is None:
+            # Socket has since been closed, stop watching it.
+            self.__clean_dead_sessions()
+            return False
+
+        try:
+            received = _recv(session)
+        except socket.error as err:
+            self.log.error("Read failed for Monitor %s: %s." 
+                % (session.monitor_id, err))
+            received = NO_DATA
+        if received == NO_DATA:
+            # No data could be read, assume socket closed.
+            self.log.error("Socket closed for Monitor %s." 
+                % session.monitor_id)
+            self.__restart_session(session)
+            return False
+        if received > 0:
+            self.__count(session, 'bytes_read', received)
+        if not session.tls_remembered:
+            session.tls_remembered = self.remember_tls_session(session.socket)
+
+        return self.__drain(session)
+
+    def __drain(self, session):
+        """
+        Forwards the complete PublishMessages buffered for a session on to 
+        the worker pools, until the session pauses.  Messages left over are
+        forwarded once it resumes.
+
+        :param session: The session whose buffered data to consume.
+
+        Returns True if the session may have more buffered data to read 
+        without waiting on the socket again.
+        """
+        frames = 0
+        while session not in self.flow_control.paused:
+            # If no defined message length, nothing has been 
+            # consumed yet, parse the header.
+            if session.message_length == 0:
+                if _read_msg_header(session) == INCOMPLETE:
+                    break
+                session.trace = self.__sample(session)
+                if session.trace is not None:
+                    session.trace.begin(STAGE_READ)
+
+            data = _read_msg(session)
+            if data is None:
+                # Data not completely read, wait for more.
+                break
+            frames += 1
+            trace, session.trace = session.trace, None
+            if trace is not None:
+                trace.end(STAGE_READ)
+
+            if session.response_type != PUBLISH_MESSAGE:
+                self.log.warn("Response Type (%x) does " \
+                    "not match PublishMessage (%x)" \
+                    % (session.response_type, PUBLISH_MESSAGE))
+                continue
+
+            self.__dispatch(session, data, trace)
+        if frames:
+            self.__count(session, 'frames_read', frames)
+
+        if session.spool is not None and session.socket is not None:
+            # Write out acknowledgements of the messages spooled.
+            fileno = session.socket.fileno()
+            if fileno in self.__outbound:
+                self.__flush(fileno)
+
+        if session in self.flow_control.paused:
+            # Stop reading until callbacks catch up.  Messages still 
+            # buffered are held until the session resumes.
+            self.log.debug("Pausing reads for Monitor %s." 
+                % session.monitor_id)
+            fileno = session.socket.fileno()
+            if self.sessions.get(fileno) is session:
+                self.__poller.modify(fileno, self.__events(session, fileno))
+            return False
+
+        return self.__has_pending(session)
+
+    def __dispatch(self, session, data, trace=None):
+        """
+        Parses a complete PublishMessage and enqueues its payload to be 
+        handed to the session's callback.
+
+        :param session: The session the message was received on.
+        :param data: The PublishMessage body.
+        :param trace: The :class:`Trace` of the message, if sampled.
+        """
+        if trace is not None:
+            trace.begin(STAGE_DISPATCH)
+
+        if session.spool is not None:
+            self.__spool(session, data, trace)
+            return
+
+        if session.envelope:
+            # Uncompressing is left to the callback, if it needs the data.
+            message = PushMessage(session, data)
+            self.flow_control.acquire(session, len(message.payload))
+            if trace is not None:
+                trace.block_id = message.block_id
+                trace.end(STAGE_DISPATCH)
+                trace.begin(STAGE_QUEUE)
+            self.__queue(session, message.block_id, message, 
+                size=len(message.payload), trace=trace)
+            return
+
+        block_id, compression, payload = _parse_publish_message(data)
+
+        # The buffer will be reused, take a copy of the payload.  
+        # Uncompressing is left to the worker pools so that large payloads 
+        # do not hold up reads on other sessions.
+        payload = bytes(payload)
+        self.flow_control.acquire(session, len(payload))
+        if trace is not None:
+            trace.block_id = block_id
+            trace.end(STAGE_DISPATCH)
+            trace.begin(STAGE_QUEUE)
+
+        self.__queue(session, block_id, payload, compression, trace=trace)
+
+    def __spool(self, session, data, trace=None):
+        """
+        Writes a complete PublishMessage to the session's spool, queues up 
+        its acknowledgement and hands the record to the callback pool, 
+        which reads the message back when a worker gets to it.  Spooled 
+        messages are not counted by the client's FlowControl, as they are 
+        held on disk rather than in memory.
+
+        :param session: The session the message was received on.
+        :param data: The PublishMessage body.
+        :param trace: The :class:`Trace` of the message, if sampled.
+        """
+        block_id = struct.unpack_from('!H', data)[0]
+        record = session.spool.append(data, time.time())
+
+        # Written out once every buffered message has been read.
+        fileno = session.socket.fileno()
+        buf = self.__outbound.get(fileno)
+        if buf is None:
+            buf = self.__outbound[fileno] = OutboundBuffer(session.socket)
+        if trace is not None:
+            trace.block_id = block_id
+            trace.end(STAGE_DISPATCH)
+            trace.begin(STAGE_WRITE)
+        buf.append(_publish_message_received(block_id), time.time(), trace)
+
+        if trace is not None:
+            trace.begin(STAGE_QUEUE)
+        self.__queue(session, block_id, record, size=record.size, 
+            trace=trace)
+
+    def __queue(self, session, block_id, data, compression=0x00, size=None,
+        trace=None):
+        """
+        Hands a message to the decompression pool if its session has a 
+        shard_key or the client has decompress_workers, to the callback pool
+        otherwise.  Every message of a session takes the same path, 
+        compressed or not, so that they stay in order.
+        """
+        if self.__decompress_pool is not None \
+            and (self.__decompress_all or session.shard_key is not None):
+            self.__decompress_pool.queue_decompress(session, block_id, data, 
+                compression, size=size, trace=trace)
+        else:
+            self.__callback_pool.queue_callback(session, block_id, data, 
+                compression, size=size, trace=trace)
+
+    def __has_pending(self, session):
+        """
+        Returns True if an SSL session holds decrypted data that the poller 
+        cannot see because it has already been read off the socket.
+
+        :param session: The session to check.
+        """
+        sck = session.socket
+        return sck is not None and hasattr(sck, 'pending') \
+            and sck.pending() > 0
 
     def __select(self):
         """
-        While the client is not marked as closed, performs a socket select
-        on all PushSession sockets.  If any data is received, parses and
-        forwards it on to the callback function.  If the callback is 
-        successful, a PublishMessageReceived message is sent.
+        While the client is not marked as closed, waits on all PushSession 
+        sockets for data.  If any data is received, parses and forwards it 
+        on to the callback function.  If the callback is successful, a 
+        PublishMessageReceived message is sent.
         """
         try:
+            # Pick up sessions registered before the thread started.
+            self.__process_control_events()
+            self.__process_write_queue()
+
             while not self.closed:
                 try:
-                    inputready = \
-                        select.select(self.sessions.keys(), [], [], 0.1)[0]
-                    for sock in inputready:
-                        session = self.sessions[sock]
-                        sck = session.socket
-                        
-                        if sck is None:
-                            # Socket has since been deleted, continue
+                    # Block until there is socket or control activity, or
+                    # a timer is due.
+                    timeout = self.__run_timers()
+                    ready = self.__poller.poll(timeout)
+                    self.__io_wakeups.inc()
+                    for fileno, events in ready:
+                        if fileno == self.__wakeup_r:
+                            self.__process_control_events()
+                            self.__process_write_queue()
+                            continue
+
+                        session = self.sessions.get(fileno)
+                        if session is None:
+                            # Session has since been removed.
+                            self.__poller.unregister(fileno)
                             continue
 
-                        # If no defined message length, nothing has been 
-                        # consumed yet, parse the header.
-                        if session.message_length == 0:
-                            # Read header information before receiving rest of
-                            # message.
-                            response_type = _read_msg_header(session)
-                            if response_type == NO_DATA:
-                                # No data could be read, assume socket closed.
-                                if session.socket is not None:
-                                    self.log.error("Socket closed for " \
-                                        "Monitor %s." % session.monitor_id)
-                                    self.__restart_session(session)
-                                continue
-                            elif response_type == INCOMPLETE:
-                                # More Data to be read.  Continue.
-                                continue
-                            elif response_type != PUBLISH_MESSAGE:
-                                self.log.warn("Response Type (%x) does " \
-                                    "not match PublishMessage (%x)" \
-                                    % (response_type, PUBLISH_MESSAGE))
-                                continue
-
-                        try:
-                            if not _read_msg(session):
-                                # Data not completely read, continue.
-                                continue
-                        except PushException, err:
-                            # If Socket is None, it was closed,
-                            # otherwise it was closed when it shouldn't
-                            # have been restart it.
-                            session.data = ""
-                            session.message_length = 0
-
-                            if session.socket is None:
-                                del self.sessions[sck]
-                            else:
-                                self.log.exception(err)	
-                                self.__restart_session(session)
+                        if session.phase is not None:
+                            self.__advance_handshake(session, fileno)
                             continue
 
-                        # We received full payload, 
-                        # clear session data and parse it.
-                        data = session.data
-                        session.data = ""
-                        session.message_length = 0
-                        block_id = struct.unpack('!H', data[0:2])[0]
-                        compression = struct.unpack('!B', data[4:5])[0]
-                        payload = data[10:]
-
-                        if compression == 0x01:
-                            # Data is compressed, uncompress it.
-                            payload = zlib.decompress(payload)
-                       
-                        # Enqueue payload into a callback queue to be
-                        # invoked.
-                        self.__callback_pool.queue_callback(session, 
-                            block_id, payload)
-                except select.error, err:
+                        if events & EVENT_WRITE:
+                            self.__flush(fileno)
+
+                        if events & EVENT_READ:
+                            while self.__read_session(session):
+                                pass
+                except select.error as err:
                     # Evaluate sessions if we get a bad file descriptor, if 
                     # socket is gone, delete the session.
                     if err.args[0] == errno.EBADF:
                         self.__clean_dead_sessions()
-                except Exception, err:
+                except Exception as err:
                     self.log.exception(err)
         finally:
-            for session in self.sessions.values():
+            # Make a last attempt at writing pending acknowledgements.
+            self.__process_write_queue()
+            for session in list(self.sessions.values()) \
+                + list(self.__reconnecting):
                 if session is not None: 
                     session.stop()
-    
+            self.__process_control_events()
+            self.__close_io()
+
     def __init_threads(self):
         """
-        Initializes the IO and Writer threads
+        Initializes the IO thread
         """
-        if self.__io_thread is None:
-            self.__io_thread = Thread(target=self.__select)
-            self.__io_thread.start()
-
-        if self.__writer_thread is None:
-            self.__writer_thread = Thread(target=self.__writer)
-            self.__writer_thread.start()
+        with self.__io_thread_lock:
+            if self.__io_thread is None and not self.closed:
+                self.__io_thread = Thread(target=self.__select)
+                self.__io_thread.start()
 
            
-    def create_session(self, callback, monitor_id):
+    def create_session(self, callback, monitor_id, batch_count=None, 
+        batch_timeout=DEFAULT_BATCH_TIMEOUT, shard_key=None, envelope=False):
         """
         Creates and Returns a PushSession instance based on the input monitor
         and callback.  When data is received, callback will be invoked.
         If neither monitor or monitor_id are specified, throws an Exception.
+
+        Returns without waiting for the session to connect, which the IO 
+        thread does for all new sessions at once.  Failing to connect, or a
+        ConnectionResponse refusing the session, is therefore not raised 
+        here, unlike in earlier versions, but logged and raised by the 
+        session's :meth:`PushSession.wait`.  Call it to block until the 
+        session has connected.
         
         :param callback: Callback function to call when PublishMessage 
             messages are received. Expects 1 argument which will contain the 
             payload of the pushed message.  Additionally, expects 
             function to return True if callback was able to process 
-            the message, False or None otherwise.
+            the message, False or None otherwise.  With the process 
+            executor, a module level function or its importable name 
+            (i.e. 'mypackage.handlers:on_event').
         :param monitor_id: The id of the Monitor, will be queried 
             to understand parameters of the monitor.
+        :param batch_count: Opt in to batched callbacks.  If set, callback 
+            is instead invoked with a list of up to batch_count payloads, in 
+            the order they were received.  Returning True acknowledges every 
+            message of the batch, False or None acknowledges none of them, 
+            and returning a list of booleans (one per payload) acknowledges 
+            each message individually.
+        :param batch_timeout: In batched mode, the most seconds a payload 
+            waits for its batch to fill before the batch is delivered.
+        :param shard_key: Callbacks are invoked in the order messages were 
+            received for each monitor, while different monitors are handled 
+            by workers in parallel.  To order by something finer grained, 
+            pass a function that returns a key for a payload (i.e. its device
+            id).  Payloads with equal keys are then handled in order and 
+            payloads with different keys in parallel, though keys are 
+            spread over workers by hash so different keys may share one.  
+            Payloads are uncompressed and keyed by the decompression 
+            workers, see decompress_workers.
+        :param envelope: If True, callback (and shard_key) is handed a 
+            :class:`PushMessage` instead of the payload.  It exposes the 
+            message header, the session and the time the message was 
+            received, and uncompresses and decodes the payload only when 
+            it is accessed.  Sessions of messages handed to the process 
+            executor are None.
         """
         self.log.info("Creating Session for Monitor %s." % monitor_id)
-        session = SecurePushSession(callback, monitor_id, self, self.ca_certs) \
-            if self.secure else PushSession(callback, monitor_id, self)
+        if self.__process_pool is not None:
+            callback = _callback_name(callback)
+
+        options = { 'batch_count' : batch_count, 
+                    'batch_timeout' : batch_timeout,
+                    'shard_key' : shard_key,
+                    'envelope' : envelope }
+        session = SecurePushSession(callback, monitor_id, self, self.ca_certs,
+                **options) \
+            if self.secure else PushSession(callback, monitor_id, self, 
+                **options)
+        if self.push_port is not None:
+            session.port = self.push_port
+        if shard_key is not None:
+            with self.__pool_lock:
+                if self.__decompress_pool is None:
+                    # Keys are computed off the IO thread.
+                    self.__decompress_pool = DecompressionWorkerPool(
+                        self.__callback_pool, size=self.__callback_pool.size, 
+                        done=self.__message_done, metrics=self.metrics, 
+                        resized=self.flow_control.resize)
+        if self.spool is not None:
+            session.spool = self.spool.log(monitor_id)
+            self.__replay(session)
+
+        self.start_session(session)
+        return session
 
-        session.start()
-        self.sessions[session.socket.fileno()] = session
-        
+    def start_session(self, session):
+        """
+        Connects a session of this client that is not connected, i.e. one 
+        that was stopped, see :meth:`PushSession.start`.  Returns without 
+        blocking, the IO thread performs the connection handshake.  Use the 
+        session's :meth:`PushSession.wait` to block until it has finished.
+
+        :param session: The session to connect.
+        """
+        session.handshaken.clear()
+        if self.closed:
+            # No IO thread is left to connect the session, fail its wait.
+            session.last_error = PushException("Client is stopped.")
+            session.state      = STATE_CLOSED
+            session.handshaken.set()
+            return
+        session.last_error = None
+        session.state      = STATE_CONNECTING
+        # The IO thread connects the session without blocking.
+        self.__control(self.__start, session)
         self.__init_threads()
-        return session
+
+    def __start(self, session):
+        """
+        Begins the handshake of a session handed to start_session.  Runs on
+        the IO thread.
+
+        :param session: The session to connect.
+        """
+        # A session stopped while reconnecting is connected afresh.
+        self.__reconnecting.discard(session)
+        self.__begin_handshake(session)
     
+    def __replay(self, session):
+        """
+        Queues up the messages of a session's spool that were not handled 
+        before, ahead of any the session receives.
+
+        :param session: The session, with a spool.
+        """
+        records = session.spool.replay()
+        if records:
+            self.log.info("Replaying %d spooled messages for Monitor %s." 
+                % (len(records), session.monitor_id))
+        for record in records:
+            self.__queue(session, None, record, size=record.size)
+
     def stop_all(self):
         """
-        Stops all session activity.  Blocks until io and writer thread dies.
+        Stops all session activity.  Blocks until io thread dies, and for 
+        up to WORKER_STOP_TIMEOUT seconds per worker pool until the worker 
+        threads have returned from the callbacks they were invoking.  May be
+        called from a callback.  Messages still queued for callbacks are 
+        dropped unacknowledged, for iDigi to send again.  If the client 
+        spools, the spool is closed, and messages not yet handled are 
+        replayed when it is next used.  The client's file descriptors are 
+        closed, and it can not be used to connect sessions anymore.
         """
-        if self.__io_thread is not None:
-            self.log.info("Waiting for I/O thread to stop...")
+        with self.__io_thread_lock:
+            # Sessions created from now on are never connected.
             self.closed = True
+            io_thread = self.__io_thread
+        if io_thread is not None:
+            self.log.info("Waiting for I/O thread to stop...")
+            self.__wakeup()
             
-            while self.__io_thread.is_alive():
-                time.sleep(1)
-
-        if self.__writer_thread is not None:
-            self.log.info("Waiting for Writer Thread to stop...")
-            self.closed = True
-
-            while self.__writer_thread.is_alive():
+            while io_thread.is_alive():
                 time.sleep(1)
+        self.__close_io()
+
+        with self.__pool_lock:
+            pools = [pool for pool in (self.__decompress_pool, 
+                self.__callback_pool) if pool is not None]
+        for pool in pools:
+            running = pool.stop(WORKER_STOP_TIMEOUT)
+            if running:
+                self.log.warning("%d workers are still busy after stopping, "
+                    "leaving them to exit once done." % running)
+        if self.__process_pool is not None:
+            self.__process_pool.terminate()
+        if self.spool is not None:
+            self.spool.close()
+        self.http_pool.close()
 
         self.log.info("All worker threads stopped.")
\ No newline at end of file
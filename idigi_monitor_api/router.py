@@ -0,0 +1,178 @@
+# ***************************************************************************
+# Copyright (c) 2012 Digi International Inc.,
+# All rights not expressly granted are reserved.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Digi International Inc. 11001 Bren Road East, Minnetonka, MN 55343
+#
+# ***************************************************************************
+"""
+Routes the Msg events of a Monitor to handlers by topic.
+
+A :class:`TopicRouter` is a session callback.  It splits every payload
+into its Msg events and hands each to the handlers registered for the
+longest prefix of its topic, so that a single Monitor and session can
+serve many topics.
+"""
+import logging
+
+from .splitter import split_messages
+
+class _Node(object):
+    """
+    A node of the topic prefix index.
+    """
+    __slots__ = ('children', 'handlers')
+
+    def __init__(self):
+        self.children = {}
+        self.handlers = []
+
+def _topic_path(topic, customer_id=False):
+    """
+    Splits a topic into the segments it is indexed by.  Monitor topic
+    options (i.e. '[U]') are dropped.
+
+    :param topic: A topic, i.e. 'DeviceCore' or '1210/DeviceCore/7201/0'.
+    :param customer_id: Whether the topic starts with a customer id, as the
+        topics of Msg events do, which is dropped.
+    """
+    segments = [segment for segment in topic.split('/') if segment]
+    if customer_id and segments and segments[0].isdigit():
+        segments = segments[1:]
+    if segments and '[' in segments[0]:
+        segments[0] = segments[0][:segments[0].index('[')]
+    return segments
+
+def _message_topic(message):
+    """
+    Returns the topic of a Msg, parsed from json (a dict) or xml (an
+    Element), or None if it has none.
+    """
+    if isinstance(message, dict):
+        return message.get('topic')
+    return message.findtext('topic')
+
+class TopicRouter(object):
+    """
+    A session callback dispatching each Msg to handlers by its topic.
+
+    Handlers are registered for a topic prefix without the customer id,
+    i.e. 'DeviceCore' or 'FileDataCore/00000000-00000000-00409DFF-FF000000',
+    and are invoked with the Msg (a dict for json, an Element for xml).  A
+    Msg is handed to every handler of the longest registered prefix of its
+    topic, or to the default handler if no prefix matches.  A payload is
+    acknowledged once every handler its Msgs were handed to has returned
+    True.  Msgs no handler matches are logged and count as handled.
+
+    The router accepts payloads, :class:`PushMessage` envelopes and, in
+    batched mode, lists of either.
+    """
+
+    def __init__(self, format_type='json', default=None):
+        """
+        :param format_type: The format_type of the Monitor, 'json' or 'xml'.
+            Ignored for PushMessage envelopes, which know their format.
+        :param default: Optional handler for Msgs no prefix matches.
+        """
+        self.format_type = format_type
+        self.default     = default
+        self.__root      = _Node()
+        self.__topics    = []
+        self.log         = logging.getLogger('topic_router')
+
+    def route(self, topic, handler):
+        """
+        Registers a handler for a topic prefix.  Handlers of the same
+        prefix are invoked in the order they were registered.
+
+        :param topic: The topic prefix, i.e. 'DeviceCore'.
+        :param handler: Function invoked with each matching Msg, expected to
+            return True if it handled the Msg.
+        """
+        node = self.__root
+        for segment in _topic_path(topic):
+            child = node.children.get(segment)
+            if child is None:
+                child = node.children[segment] = _Node()
+            node = child
+        node.handlers.append(handler)
+        if topic not in self.__topics:
+            self.__topics.append(topic)
+
+    def topics(self):
+        """
+        Returns the list of registered topics, suitable for
+        :meth:`PushClient.create_monitor`.
+        """
+        return list(self.__topics)
+
+    def handlers(self, topic):
+        """
+        Returns the handlers a Msg of a topic is dispatched to.
+
+        :param topic: The topic of a Msg, i.e. '1210/DeviceCore/7201/0'.
+        """
+        node     = self.__root
+        handlers = node.handlers
+        for segment in _topic_path(topic, customer_id=True):
+            node = node.children.get(segment)
+            if node is None:
+                break
+            if node.handlers:
+                handlers = node.handlers
+        if not handlers and self.default is not None:
+            return [self.default]
+        return handlers
+
+    def dispatch(self, message):
+        """
+        Hands a Msg to its handlers.  Returns True if all of them handled
+        it.
+
+        :param message: The Msg, a dict for json or an Element for xml.
+        """
+        topic = _message_topic(message)
+        handlers = self.handlers(topic) if topic is not None \
+            else ([self.default] if self.default is not None else [])
+        if not handlers:
+            self.log.debug("No handler for topic %s." % topic)
+            return True
+
+        handled = True
+        for handler in handlers:
+            if not handler(message):
+                handled = False
+        return handled
+
+    def __route_payload(self, payload):
+        """
+        Dispatches every Msg of one payload or PushMessage.
+        """
+        if hasattr(payload, 'messages'):
+            messages = payload.messages()
+        else:
+            messages = split_messages(payload, self.format_type)
+
+        handled = True
+        for message in messages:
+            if not self.dispatch(message):
+                handled = False
+        return handled
+
+    def __call__(self, data):
+        """
+        Session callback entry point.
+
+        :param data: A payload or PushMessage, or a list of them in batched
+            mode.
+
+        Returns True if every Msg was handled, or a list of such booleans
+        for a list of payloads.
+        """
+        if isinstance(data, list):
+            return [self.__route_payload(payload) for payload in data]
+        return self.__route_payload(data)
@@ -0,0 +1,153 @@
+# ***************************************************************************
+# Copyright (c) 2012 Digi International Inc.,
+# All rights not expressly granted are reserved.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Digi International Inc. 11001 Bren Road East, Minnetonka, MN 55343
+#
+# ***************************************************************************
+"""
+Splits the Document payload of a PublishMessage into its Msg events.
+
+A Monitor created with a batch_size greater than 1 may push a Document
+holding many Msg entries at once.  The functions here parse such a Document
+incrementally and yield each Msg as soon as it has been parsed, so that the
+first event can be handled before the rest of the batch is parsed and only
+one event is held in memory at a time.
+"""
+import io
+import json
+import re
+
+try:
+    import xml.etree.cElementTree as ElementTree
+except ImportError:
+    import xml.etree.ElementTree as ElementTree
+
+# Whitespace allowed between JSON tokens.
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+_DECODER = json.JSONDecoder()
+
+def split_messages(data, format_type='json'):
+    """
+    Yields each Msg of a Document payload, in the order they appear.
+
+    :param data: The (uncompressed) payload of a PublishMessage.
+    :param format_type: The format_type of the Monitor, 'json' or 'xml'.
+
+    Json messages are yielded as dicts and xml messages as ElementTree
+    Elements.
+    """
+    if format_type == 'json':
+        return split_json_messages(data)
+    elif format_type == 'xml':
+        return split_xml_messages(data)
+    raise ValueError("Unknown format_type %r." % format_type)
+
+def _skip(text, index):
+    """
+    Returns the index of the first non whitespace character at or after
+    index.
+    """
+    return _WHITESPACE.match(text, index).end()
+
+def _expect(text, index, characters):
+    """
+    Returns the character at index, raising a ValueError if it is not one
+    of characters.
+    """
+    character = text[index:index + 1]
+    if not character or character not in characters:
+        raise ValueError("Expecting one of %r at char %d."
+            % (characters, index))
+    return character
+
+def _find_member(text, index, name):
+    """
+    Finds a member of the JSON object starting at index and returns the
+    index its value starts at, or None if the object has no such member.
+    Values of the members before it are parsed to be skipped.
+
+    :param text: The JSON text.
+    :param index: Index of the object's opening brace.
+    :param name: Name of the member to find.
+    """
+    _expect(text, index, '{')
+    index = _skip(text, index + 1)
+    if _expect(text, index, '"}') == '}':
+        return None
+
+    while True:
+        key, index = _DECODER.raw_decode(text, index)
+        index = _skip(text, index)
+        _expect(text, index, ':')
+        index = _skip(text, index + 1)
+        if key == name:
+            return index
+
+        index = _skip(text, _DECODER.raw_decode(text, index)[1])
+        if _expect(text, index, ',}') == '}':
+            return None
+        index = _skip(text, index + 1)
+
+def split_json_messages(data):
+    """
+    Yields each Msg of a json Document payload as a dict.  A Document
+    holding a single Msg yields that Msg only.
+
+    :param data: The (uncompressed) json payload of a PublishMessage.
+    """
+    text = data.decode('utf-8') if isinstance(data, bytes) else data
+
+    index = _find_member(text, _skip(text, 0), 'Document')
+    if index is None:
+        return
+    index = _find_member(text, index, 'Msg')
+    if index is None:
+        return
+
+    if text[index:index + 1] != '[':
+        yield _DECODER.raw_decode(text, index)[0]
+        return
+
+    index = _skip(text, index + 1)
+    if text[index:index + 1] == ']':
+        return
+    while True:
+        message, index = _DECODER.raw_decode(text, index)
+        yield message
+        index = _skip(text, index)
+        if _expect(text, index, ',]') == ']':
+            return
+        index = _skip(text, index + 1)
+
+def split_xml_messages(data):
+    """
+    Yields each Msg of an xml Document payload as an ElementTree Element.
+    Every Msg is detached from the Document once it has been yielded.
+
+    :param data: The (uncompressed) xml payload of a PublishMessage.
+    """
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+
+    document = None
+    depth    = 0
+    for event, element in ElementTree.iterparse(io.BytesIO(data),
+        events=('start', 'end')):
+        if event == 'start':
+            depth += 1
+            if depth == 1:
+                document = element
+            continue
+
+        depth -= 1
+        if depth == 1 and element.tag == 'Msg':
+            yield element
+            # Drop the Msg from the Document so that memory is held for
+            # one Msg at a time.
+            document.remove(element)
@@ -0,0 +1,490 @@
+# ***************************************************************************
+# Copyright (c) 2012 Digi International Inc.,
+# All rights not expressly granted are reserved.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Digi International Inc. 11001 Bren Road East, Minnetonka, MN 55343
+#
+# ***************************************************************************
+"""
+Durable spooling of received PublishMessages.
+
+A :class:`Spool` keeps an append-only :class:`SegmentLog` per Monitor in a
+directory.  A client spooling its sessions writes every PublishMessage to
+the log and acknowledges it to iDigi right away, and callbacks consume the
+messages from the log.  Each log checkpoints the offset up to which
+messages have been handled, and messages past the checkpoint are replayed
+when the log is opened again, so a message is handled at least once even
+if the process dies with messages in flight.
+
+A log is a series of memory-mapped segment files named by the offset of
+their first record.  Each record is a 4 byte length, 4 byte CRC32 and 8
+byte time the record was appended, followed by the message.  The CRC covers
+the time and the message.  A zero length marks the end of a segment's data.
+"""
+import bisect
+import logging
+import mmap
+import os
+import struct
+import time
+import zlib
+
+from collections import deque
+from threading import Lock
+
+# Record header: length of the record's data, CRC32 of its time and data,
+# and the time it was appended.
+_HEADER = struct.Struct('!LLd')
+
+# Offset in the header of the part the CRC covers.
+_CRC_START = 8
+
+# Default size of a segment file.  Records larger than this get a segment
+# of their own.
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+
+# Default seconds between writes of a log's checkpoint.
+DEFAULT_CHECKPOINT_INTERVAL = 1.0
+
+# Name of the file holding a log's checkpoint.
+CHECKPOINT_FILE = 'checkpoint'
+
+class SpoolClosed(Exception):
+    """
+    Raised when a :class:`SegmentLog` is used after it was closed.  Its 
+    records not yet handled are replayed when it is next opened.
+    """
+    pass
+
+class SpoolRecord(object):
+    """
+    A reference to a record of a :class:`SegmentLog`, handed to callback
+    workers in place of the data it holds.
+    """
+    __slots__ = ('log', 'offset', 'size', 'timestamp')
+
+    def __init__(self, log, offset, size, timestamp):
+        """
+        :param log: The SegmentLog holding the record.
+        :param offset: Offset of the record in the log.
+        :param size: Size of the record's data.
+        :param timestamp: Time the record was appended.
+        """
+        self.log       = log
+        self.offset    = offset
+        self.size      = size
+        self.timestamp = timestamp
+
+    @property
+    def end(self):
+        """
+        Offset of the record that follows this one.
+        """
+        return self.offset + _HEADER.size + self.size
+
+    def data(self):
+        """
+        Returns a copy of the record's data.
+        """
+        return self.log.read(self)
+
+    def complete(self, handled):
+        """
+        Reports the record as done with, see :meth:`SegmentLog.complete`.
+        """
+        self.log.complete(self, handled)
+
+    def __repr__(self):
+        return 'SpoolRecord(%r, %d, %d)' % (self.log.directory, self.offset,
+            self.size)
+
+class _Segment(object):
+    """
+    A memory-mapped segment file of a log.
+    """
+
+    def __init__(self, path, base, size):
+        """
+        Opens a segment file, creating it with size bytes if needed.
+
+        :param path: Path of the file.
+        :param base: Log offset of the segment's first byte.
+        :param size: Size of a new file.
+        """
+        self.path = path
+        self.base = base
+        with open(path, 'a+b') as segment_file:
+            segment_file.seek(0, os.SEEK_END)
+            if segment_file.tell() < size:
+                segment_file.truncate(size)
+            self.size = max(size, segment_file.tell())
+            self.map  = mmap.mmap(segment_file.fileno(), self.size)
+        # Position past the segment's last record, once known.
+        self.tail = None
+
+    def record(self, position):
+        """
+        Returns the (size, crc, timestamp) header of the record at position,
+        or None if the segment's data ends there.
+        """
+        if position + _HEADER.size > self.size:
+            return None
+        header = _HEADER.unpack_from(self.map, position)
+        if header[0] == 0 or position + _HEADER.size + header[0] > self.size:
+            return None
+        return header
+
+    def scan(self):
+        """
+        Finds the end of the segment's valid records, and clears what
+        follows a torn or corrupt record.
+        """
+        position = 0
+        while True:
+            header = self.record(position)
+            if header is None:
+                break
+            size, crc, _ = header
+            start = position + _HEADER.size
+            if zlib.crc32(self.map[position + _CRC_START:start + size]) \
+                & 0xffffffff != crc:
+                break
+            position = start + size
+        if position + _HEADER.size <= self.size:
+            self.map[position:position + _HEADER.size] = b'\x00' * _HEADER.size
+        self.tail = position
+
+    def close(self):
+        self.map.close()
+
+class SegmentLog(object):
+    """
+    An append-only log of records in memory-mapped segment files, with a
+    checkpoint of the records handled.
+
+    Records are appended by one thread, and read and completed by any.
+    Records are completed out of order, and the checkpoint advances past
+    every record completed as handled up to the first one that is not.  A
+    record completed as not handled therefore holds the checkpoint back
+    until the log is opened again and replays it.  Segments wholly before
+    the checkpoint are deleted once the checkpoint is written.
+    """
+
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE,
+        sync=False, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+        """
+        Opens the log in a directory, creating it if needed, and recovers
+        its records up to the first torn or corrupt one.
+
+        :param directory: Directory of the log's files.
+        :param segment_size: Size of a segment file.
+        :param sync: Whether every append is flushed to disk before it
+            returns.  Otherwise appends survive the process dying but not
+            the machine failing before the system writes them back.
+        :param checkpoint_interval: Seconds between writes of the
+            checkpoint.  Records handled since the last write are replayed
+            after a crash.
+        """
+        self.directory           = directory
+        self.segment_size        = segment_size
+        self.sync                = sync
+        self.checkpoint_interval = checkpoint_interval
+        self.log                 = logging.getLogger('segment_log[%s]'
+            % directory)
+        self.__lock              = Lock()
+        # Offsets of the records appended or replayed and not yet passed
+        # by the checkpoint, in order, and whether each was handled (None
+        # while in flight).
+        self.__pending           = deque()
+        self.__handled           = {}
+        self.__stalled           = None
+        self.__written_at        = 0
+        # Set once closed, records are then left to be replayed.
+        self.closed              = False
+        # Whether the records past the checkpoint have been replayed.
+        self.__replayed          = False
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.checkpoint = self.__read_checkpoint()
+        self.__written  = self.checkpoint
+
+        self.__segments = []
+        for name in sorted(os.listdir(directory)):
+            if name.endswith('.log'):
+                self.__segments.append(_Segment(os.path.join(directory,
+                    name), int(name[:-4]), segment_size))
+        # Segments left behind by a crash before their deletion.
+        while len(self.__segments) > 1 \
+            and self.__segments[1].base <= self.checkpoint:
+            self.__remove(self.__segments.pop(0))
+        if not self.__segments:
+            self.__segments.append(self.__create(self.checkpoint, 0))
+        self.__segments[-1].scan()
+        self.__bases = [segment.base for segment in self.__segments]
+
+    def __read_checkpoint(self):
+        """
+        Returns the offset stored in the checkpoint file, 0 if there is none.
+        """
+        try:
+            with open(os.path.join(self.directory, CHECKPOINT_FILE)) as f:
+                return int(f.read().strip() or 0)
+        except (IOError, OSError, ValueError):
+            return 0
+
+    def __create(self, base, size):
+        """
+        Creates the segment starting at a log offset, large enough for a
+        record of size bytes.
+        """
+        segment = _Segment(os.path.join(self.directory, '%020d.log' % base),
+            base, max(self.segment_size, 2 * _HEADER.size + size))
+        segment.tail = 0
+        return segment
+
+    def __remove(self, segment):
+        """
+        Unmaps and deletes a segment.
+        """
+        segment.close()
+        try:
+            os.remove(segment.path)
+        except OSError as err:
+            self.log.error("Could not remove %s: %s" % (segment.path, err))
+
+    @property
+    def end(self):
+        """
+        Offset the next record will be appended at.
+        """
+        segment = self.__segments[-1]
+        return segment.base + segment.tail
+
+    def append(self, data, timestamp=None):
+        """
+        Appends a record and returns its :class:`SpoolRecord`.
+
+        :param data: The record's data.
+        :param timestamp: Time stored with the record, i.e. when its data 
+            was received, now if not provided.
+        """
+        data = bytes(data)
+        size = len(data)
+        if timestamp is None:
+            timestamp = time.time()
+        with self.__lock:
+            if self.closed:
+                raise SpoolClosed(self.directory)
+            segment = self.__segments[-1]
+            position = segment.tail
+            if position + _HEADER.size + size > segment.size:
+                # Roll over to a new segment.
+                segment = self.__create(segment.base + position, size)
+                self.__segments.append(segment)
+                self.__bases.append(segment.base)
+                position = 0
+
+            start = position + _HEADER.size
+            segment.map[start:start + size] = data
+            # Mark the end of data after the record, then publish the
+            # record by writing its header.
+            if start + size + _HEADER.size <= segment.size:
+                segment.map[start + size:start + size + _HEADER.size] = \
+                    b'\x00' * _HEADER.size
+            crc = zlib.crc32(data, zlib.crc32(struct.pack('!d', timestamp)))
+            _HEADER.pack_into(segment.map, position, size, crc & 0xffffffff,
+                timestamp)
+            segment.tail = start + size
+            if self.sync:
+                # Only the pages written to, from the first page boundary.
+                first = position - position % mmap.PAGESIZE
+                segment.map.flush(first, min(segment.size,
+                    segment.tail + _HEADER.size) - first)
+
+            record = SpoolRecord(self, segment.base + position, size, 
+                timestamp)
+            self.__pending.append(record.offset)
+            self.__handled[record.offset] = None
+        return record
+
+    def read(self, record):
+        """
+        Returns a copy of a record's data.
+
+        :param record: The :class:`SpoolRecord` to read.
+        """
+        with self.__lock:
+            if self.closed:
+                raise SpoolClosed(self.directory)
+            segment = self.__segments[
+                bisect.bisect_right(self.__bases, record.offset) - 1]
+            start = record.offset - segment.base + _HEADER.size
+            return segment.map[start:start + record.size]
+
+    def replay(self):
+        """
+        Returns a :class:`SpoolRecord` for every record past the checkpoint
+        that was written before the log was opened, in order, to be handled
+        again.  Only the first call returns them, later ones return an 
+        empty list.
+        """
+        records = []
+        with self.__lock:
+            if self.closed:
+                raise SpoolClosed(self.directory)
+            if self.__replayed:
+                return records
+            self.__replayed = True
+            # Records appended since the log was opened are in flight.
+            end = self.__pending[0] if self.__pending else self.end
+            offset = self.checkpoint
+            for segment in self.__segments:
+                if segment.base + segment.size <= offset:
+                    continue
+                position = max(0, offset - segment.base)
+                while segment.base + position < end:
+                    header = segment.record(position)
+                    if header is None:
+                        break
+                    records.append(SpoolRecord(self, segment.base + position,
+                        header[0], header[2]))
+                    position += _HEADER.size + header[0]
+            for record in reversed(records):
+                self.__pending.appendleft(record.offset)
+                self.__handled[record.offset] = None
+        return records
+
+    def complete(self, record, handled):
+        """
+        Reports a record as done with, advancing the checkpoint past every
+        record handled up to the first that is still in flight or was not
+        handled.
+
+        :param record: The :class:`SpoolRecord` done with.
+        :param handled: Whether the record was handled.  If False, it is
+            replayed when the log is next opened.
+        """
+        with self.__lock:
+            if self.closed or record.offset not in self.__handled:
+                return
+            self.__handled[record.offset] = bool(handled)
+            if not handled and self.__stalled is None:
+                self.__stalled = record.offset
+                self.log.warning("Record at %d was not handled, it will be "
+                    "replayed when the log is reopened." % record.offset)
+
+            while self.__pending and self.__handled[self.__pending[0]]:
+                offset = self.__pending.popleft()
+                del self.__handled[offset]
+                self.checkpoint = self.__end_of(offset)
+
+            if time.time() - self.__written_at >= self.checkpoint_interval:
+                self.__write_checkpoint()
+
+    def __end_of(self, offset):
+        """
+        Returns the offset following the record at offset.  Runs with the
+        lock held.
+        """
+        segment = self.__segments[bisect.bisect_right(self.__bases, offset)
+            - 1]
+        position = offset - segment.base
+        return offset + _HEADER.size + segment.record(position)[0]
+
+    def __write_checkpoint(self):
+        """
+        Writes the checkpoint and deletes the segments wholly before it.
+        Runs with the lock held.
+        """
+        self.__written_at = time.time()
+        if self.checkpoint == self.__written:
+            return
+        path = os.path.join(self.directory, CHECKPOINT_FILE)
+        with open(path + '.tmp', 'w') as checkpoint_file:
+            checkpoint_file.write('%d\n' % self.checkpoint)
+            checkpoint_file.flush()
+            if self.sync:
+                os.fsync(checkpoint_file.fileno())
+        os.rename(path + '.tmp', path)
+        self.__written = self.checkpoint
+
+        while len(self.__segments) > 1 \
+            and self.__segments[1].base <= self.checkpoint:
+            self.__remove(self.__segments.pop(0))
+            self.__bases.pop(0)
+
+    def flush(self):
+        """
+        Writes the checkpoint and flushes every segment to disk.
+        """
+        with self.__lock:
+            self.__write_checkpoint()
+            for segment in self.__segments:
+                segment.map.flush()
+
+    def close(self):
+        """
+        Writes the checkpoint and closes the log.  Records not yet handled
+        are replayed when the log is opened again.
+        """
+        with self.__lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.__write_checkpoint()
+            for segment in self.__segments:
+                segment.map.flush()
+                segment.close()
+            self.__segments = []
+            self.__bases = []
+
+class Spool(object):
+    """
+    A directory of :class:`SegmentLog` instances, one per Monitor, used by
+    a :class:`PushClient` to spool its sessions' messages.
+    """
+
+    def __init__(self, directory, segment_size=DEFAULT_SEGMENT_SIZE,
+        sync=False, checkpoint_interval=DEFAULT_CHECKPOINT_INTERVAL):
+        """
+        :param directory: Directory holding the logs.
+        :param segment_size: Size of a segment file.
+        :param sync: Whether appends are flushed to disk before messages
+            are acknowledged, see :class:`SegmentLog`.
+        :param checkpoint_interval: Seconds between writes of a log's
+            checkpoint.
+        """
+        self.directory           = directory
+        self.segment_size        = segment_size
+        self.sync                = sync
+        self.checkpoint_interval = checkpoint_interval
+        self.__logs              = {}
+        self.__lock              = Lock()
+
+    def log(self, monitor_id):
+        """
+        Returns the log of a Monitor, opening it if needed.
+
+        :param monitor_id: The id of the Monitor.
+        """
+        with self.__lock:
+            log = self.__logs.get(str(monitor_id))
+            if log is None:
+                log = self.__logs[str(monitor_id)] = SegmentLog(
+                    os.path.join(self.directory, str(monitor_id)),
+                    self.segment_size, self.sync, self.checkpoint_interval)
+            return log
+
+    def close(self):
+        """
+        Closes every log.
+        """
+        with self.__lock:
+            for log in self.__logs.values():
+                log.close()
+            self.__logs = {}
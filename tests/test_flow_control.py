@@ -0,0 +1,111 @@
+# ***************************************************************************
+# Copyright (c) 2012 Digi International Inc.,
+# All rights not expressly granted are reserved.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Digi International Inc. 11001 Bren Road East, Minnetonka, MN 55343
+#
+# ***************************************************************************
+"""
+Tests of the flow control of sessions: pausing at the high water marks and
+resuming below the low ones.  Run with 'python -m unittest discover tests'.
+"""
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..'))
+
+import idigi_monitor_api.push_client
+
+push_client = sys.modules['idigi_monitor_api.push_client']
+FlowControl = push_client.FlowControl
+
+class FlowControlTest(unittest.TestCase):
+
+    def setUp(self):
+        self.session = object()
+        self.other   = object()
+
+    def test_water_marks(self):
+        flow = FlowControl(session_messages=10, session_bytes=(100, 20),
+            total_messages=None, total_bytes=None)
+        self.assertEqual(flow.session_messages, (10, 5))
+        self.assertEqual(flow.session_bytes, (100, 20))
+        self.assertEqual(flow.total_messages, None)
+        for limit in (0, (10, 10), (10, -1)):
+            self.assertRaises(ValueError, FlowControl, session_messages=limit)
+
+    def test_pauses_at_session_high_water_mark(self):
+        flow = FlowControl(session_messages=4, session_bytes=None,
+            total_bytes=None)
+        for _ in range(3):
+            self.assertFalse(flow.acquire(self.session, 10))
+        self.assertTrue(flow.acquire(self.session, 10))
+        self.assertEqual(flow.paused, set([self.session]))
+        self.assertEqual(flow.usage(self.session), (4, 40))
+        # Other sessions are unaffected by a session's limits.
+        self.assertFalse(flow.acquire(self.other, 10))
+
+    def test_resumes_below_session_low_water_mark(self):
+        flow = FlowControl(session_messages=(4, 1), session_bytes=None,
+            total_bytes=None)
+        for _ in range(4):
+            flow.acquire(self.session, 10)
+
+        # Still above the low water mark.
+        self.assertFalse(flow.release(self.session, 10))
+        self.assertFalse(flow.release(self.session, 10))
+        self.assertEqual(flow.resumable(), [])
+        self.assertEqual(flow.paused, set([self.session]))
+
+        self.assertTrue(flow.release(self.session, 10))
+        self.assertEqual(flow.resumable(), [self.session])
+        self.assertEqual(flow.paused, set())
+        self.assertEqual(flow.resumable(), [])
+
+    def test_byte_limits(self):
+        flow = FlowControl(session_messages=None, session_bytes=(100, 50),
+            total_bytes=None)
+        self.assertFalse(flow.acquire(self.session, 60))
+        self.assertTrue(flow.acquire(self.session, 40))
+        self.assertTrue(flow.release(self.session, 60))
+        self.assertEqual(flow.resumable(), [self.session])
+
+    def test_total_limits_pause_every_session(self):
+        flow = FlowControl(session_messages=None, session_bytes=None,
+            total_messages=(3, 1), total_bytes=None)
+        self.assertFalse(flow.acquire(self.session, 1))
+        self.assertFalse(flow.acquire(self.other, 1))
+        self.assertTrue(flow.acquire(self.other, 1))
+        self.assertTrue(flow.acquire(self.session, 1))
+        self.assertEqual(flow.paused, set([self.session, self.other]))
+
+        # Nothing resumes until the total is back at its low water mark.
+        flow.release(self.other, 1)
+        flow.release(self.other, 1)
+        self.assertEqual(flow.resumable(), [])
+        self.assertTrue(flow.release(self.session, 1))
+        self.assertEqual(set(flow.resumable()),
+            set([self.session, self.other]))
+        self.assertEqual((flow.messages, flow.bytes), (1, 1))
+
+    def test_resize(self):
+        flow = FlowControl(session_messages=None, session_bytes=100,
+            total_bytes=None)
+        self.assertFalse(flow.acquire(self.session, 10))
+        # Uncompressing the payload counts it at its new size.
+        self.assertTrue(flow.resize(self.session, 10, 120))
+        self.assertEqual(flow.usage(self.session), (1, 120))
+        self.assertFalse(flow.resize(self.other, 10, 120))
+
+        self.assertTrue(flow.release(self.session, 120))
+        self.assertEqual(flow.usage(self.session), (0, 0))
+        self.assertEqual(flow.resumable(), [self.session])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+# ***************************************************************************
+# Copyright (c) 2012 Digi International Inc.,
+# All rights not expressly granted are reserved.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Digi International Inc. 11001 Bren Road East, Minnetonka, MN 55343
+#
+# ***************************************************************************
+"""
+Tests of sessions connecting to a local server: the handshake, failures
+raised through the session and restarting.  Run with
+'python -m unittest discover tests'.
+"""
+import logging
+import os
+import sys
+import time
+import unittest
+from threading import Event
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..'))
+
+import idigi_monitor_api.push_client
+from idigi_monitor_api.local_server import LocalServer
+
+push_client = sys.modules['idigi_monitor_api.push_client']
+
+TIMEOUT = 10
+
+class Collector(object):
+    """
+    A session callback counting the payloads it is invoked with, setting
+    done once it has seen count of them.
+    """
+
+    def __init__(self, count):
+        self.count    = count
+        self.payloads = []
+        self.done     = Event()
+
+    def __call__(self, data):
+        self.payloads.append(data)
+        if len(self.payloads) >= self.count:
+            self.done.set()
+        return True
+
+class SessionTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger('push_client').setLevel(logging.CRITICAL)
+        self.server = LocalServer(http_port=None, push_port=0,
+            secure_port=None, messages=3, batch_size=1, username='user',
+            password='secret').start()
+        self.monitor_id = self.server.add_monitor('DeviceCore',
+            monCompression='none')
+        self.clients = []
+
+    def tearDown(self):
+        for client in self.clients:
+            client.stop_all()
+        self.server.stop()
+
+    def client(self, password='secret'):
+        client = push_client.PushClient('user', password,
+            hostname='127.0.0.1', secure=False,
+            push_port=self.server.push_port)
+        self.clients.append(client)
+        return client
+
+    def test_messages_are_delivered(self):
+        callback = Collector(3)
+        session = self.client().create_session(callback, self.monitor_id)
+        self.assertTrue(session.wait(TIMEOUT) is session)
+        self.assertEqual(session.state, push_client.STATE_CONNECTED)
+        self.assertTrue(callback.done.wait(TIMEOUT))
+        self.assertEqual(len(callback.payloads), 3)
+
+    def test_failed_handshake_is_raised_by_wait(self):
+        # create_session returns before the handshake is answered.
+        session = self.client('wrong').create_session(Collector(1),
+            self.monitor_id)
+        try:
+            session.wait(TIMEOUT)
+        except push_client.PushException as e:
+            self.assertTrue('403' in str(e))
+        else:
+            self.fail('wait did not raise the failed handshake')
+        self.assertEqual(session.state, push_client.STATE_CLOSED)
+        self.assertTrue(session.last_error is not None)
+
+    def test_restart(self):
+        callback = Collector(6)
+        session = self.client().create_session(callback, self.monitor_id)
+        session.wait(TIMEOUT)
+        session.stop()
+        self.assertEqual(session.state, push_client.STATE_CLOSED)
+
+        # start returns at once, and reconnects in the background.
+        self.assertTrue(session.start() is session)
+        session.wait(TIMEOUT)
+        self.assertEqual(session.state, push_client.STATE_CONNECTED)
+        self.assertTrue(callback.done.wait(TIMEOUT))
+
+    def test_session_after_stop_all(self):
+        client = self.client()
+        client.stop_all()
+        session = client.create_session(Collector(1), self.monitor_id)
+        self.assertRaises(push_client.PushException, session.wait, TIMEOUT)
+
+if __name__ == '__main__':
+    unittest.main()
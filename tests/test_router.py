@@ -0,0 +1,133 @@
+# ***************************************************************************
+# Copyright (c) 2012 Digi International Inc.,
+# All rights not expressly granted are reserved.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Digi International Inc. 11001 Bren Road East, Minnetonka, MN 55343
+#
+# ***************************************************************************
+"""
+Tests of the topic router and of the splitting of Document payloads it
+relies on.  Run with 'python -m unittest discover tests'.
+"""
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..'))
+
+from idigi_monitor_api.router import TopicRouter
+from idigi_monitor_api.splitter import split_messages
+
+def json_payload(*topics):
+    """
+    Returns a json Document payload holding a Msg for each topic.
+    """
+    messages = [{'topic': topic, 'operation': 'UPDATE'} for topic in topics]
+    return json.dumps({'Document': {'Msg': messages}}).encode('utf-8')
+
+def xml_payload(*topics):
+    """
+    Returns an xml Document payload holding a Msg for each topic.
+    """
+    messages = ''.join('<Msg><topic>%s</topic></Msg>' % topic
+        for topic in topics)
+    return ('<Document>%s</Document>' % messages).encode('utf-8')
+
+class Recorder(object):
+    """
+    A handler recording the topics of the Msgs it is invoked with.
+    """
+
+    def __init__(self, result=True):
+        self.topics = []
+        self.result = result
+
+    def __call__(self, message):
+        if isinstance(message, dict):
+            self.topics.append(message['topic'])
+        else:
+            self.topics.append(message.findtext('topic'))
+        return self.result
+
+class SplitterTest(unittest.TestCase):
+
+    def test_json(self):
+        messages = list(split_messages(json_payload('1/A/1', '1/B/2')))
+        self.assertEqual([message['topic'] for message in messages],
+            ['1/A/1', '1/B/2'])
+
+    def test_json_single_message(self):
+        data = json.dumps({'Document': {'Msg': {'topic': '1/A/1'}}})
+        messages = list(split_messages(data.encode('utf-8')))
+        self.assertEqual(messages, [{'topic': '1/A/1'}])
+
+    def test_xml(self):
+        messages = list(split_messages(xml_payload('1/A/1', '1/B/2'), 'xml'))
+        self.assertEqual([message.findtext('topic') for message in messages],
+            ['1/A/1', '1/B/2'])
+
+class TopicRouterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.core   = Recorder()
+        self.device = Recorder()
+        self.files  = Recorder()
+        self.router = TopicRouter()
+        self.router.route('DeviceCore', self.core)
+        self.router.route('DeviceCore/7201', self.device)
+        self.router.route('FileDataCore[U]', self.files)
+
+    def test_topics(self):
+        self.assertEqual(self.router.topics(),
+            ['DeviceCore', 'DeviceCore/7201', 'FileDataCore[U]'])
+
+    def test_longest_prefix(self):
+        self.assertTrue(self.router(json_payload('1210/DeviceCore/7201/0',
+            '1210/DeviceCore/7202/0', '1210/FileDataCore/a.txt')))
+        self.assertEqual(self.core.topics, ['1210/DeviceCore/7202/0'])
+        self.assertEqual(self.device.topics, ['1210/DeviceCore/7201/0'])
+        self.assertEqual(self.files.topics, ['1210/FileDataCore/a.txt'])
+
+    def test_handlers_of_a_prefix(self):
+        other = Recorder()
+        self.router.route('DeviceCore', other)
+        self.assertEqual(self.router.handlers('1210/DeviceCore/7202/0'),
+            [self.core, other])
+        self.assertEqual(self.router.topics().count('DeviceCore'), 1)
+
+    def test_unmatched(self):
+        self.assertEqual(self.router.handlers('1210/XbeeCore/0'), [])
+        self.assertTrue(self.router(json_payload('1210/XbeeCore/0')))
+
+        default = Recorder(False)
+        router = TopicRouter(default=default)
+        router.route('DeviceCore', self.core)
+        self.assertFalse(router(json_payload('1210/XbeeCore/0')))
+        self.assertEqual(default.topics, ['1210/XbeeCore/0'])
+
+    def test_unhandled_message_is_not_acknowledged(self):
+        self.router.route('DeviceCore/7202', Recorder(False))
+        self.assertFalse(self.router(json_payload('1210/DeviceCore/7201/0',
+            '1210/DeviceCore/7202/0')))
+        # Every Msg is still dispatched.
+        self.assertEqual(self.device.topics, ['1210/DeviceCore/7201/0'])
+
+    def test_batch(self):
+        self.router.route('DeviceCore/7202', Recorder(False))
+        self.assertEqual(self.router([json_payload('1210/DeviceCore/7201/0'),
+            json_payload('1210/DeviceCore/7202/0')]), [True, False])
+
+    def test_xml(self):
+        router = TopicRouter('xml')
+        router.route('DeviceCore', self.core)
+        self.assertTrue(router(xml_payload('1210/DeviceCore/7201/0')))
+        self.assertEqual(self.core.topics, ['1210/DeviceCore/7201/0'])
+
+if __name__ == '__main__':
+    unittest.main()
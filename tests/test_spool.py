@@ -0,0 +1,171 @@
+# ***************************************************************************
+# Copyright (c) 2012 Digi International Inc.,
+# All rights not expressly granted are reserved.
+#
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this file,
+# You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Digi International Inc. 11001 Bren Road East, Minnetonka, MN 55343
+#
+# ***************************************************************************
+"""
+Tests of the spool's segment log: recovery, CRC checks and checkpoints.
+Run with 'python -m unittest discover tests'.
+"""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    '..'))
+
+from idigi_monitor_api.spool import SegmentLog, SpoolClosed
+
+def segment_files(directory):
+    """
+    Returns the sorted names of a log's segment files.
+    """
+    return sorted(name for name in os.listdir(directory)
+        if name.endswith('.log'))
+
+class SegmentLogTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def open(self, **kwargs):
+        kwargs.setdefault('segment_size', 4096)
+        kwargs.setdefault('checkpoint_interval', 0)
+        return SegmentLog(self.directory, **kwargs)
+
+    def test_read_back(self):
+        log = self.open()
+        payloads = [os.urandom(100 + index * 10) for index in range(60)]
+        payloads.append(b'x' * 10000)
+        records = [log.append(payload) for payload in payloads]
+        self.assertEqual([record.data() for record in records], payloads)
+        self.assertTrue(len(segment_files(self.directory)) > 1)
+        log.close()
+
+    def test_replay_after_crash(self):
+        log = self.open()
+        records = [log.append(b'%d' % index) for index in range(10)]
+        for record in records[:4]:
+            record.complete(True)
+        # Not closed, as if the process died.
+        del log
+
+        log = self.open()
+        self.assertEqual([record.data() for record in log.replay()],
+            [b'%d' % index for index in range(4, 10)])
+        log.close()
+
+    def test_timestamp_is_kept(self):
+        log = self.open()
+        log.append(b'first', 1000.5)
+        log.append(b'second')
+        log.close()
+
+        log = self.open()
+        records = log.replay()
+        self.assertEqual(records[0].timestamp, 1000.5)
+        self.assertTrue(records[1].timestamp > 1000.5)
+        log.close()
+
+    def test_checkpoint_waits_for_earlier_records(self):
+        log = self.open()
+        records = [log.append(b'record') for _ in range(3)]
+        records[2].complete(True)
+        records[1].complete(True)
+        self.assertEqual(log.checkpoint, 0)
+        records[0].complete(True)
+        self.assertEqual(log.checkpoint, records[2].end)
+        log.close()
+
+        log = self.open()
+        self.assertEqual(log.replay(), [])
+        log.close()
+
+    def test_unhandled_record_is_replayed(self):
+        log = self.open()
+        records = [log.append(b'%d' % index) for index in range(3)]
+        records[0].complete(True)
+        records[1].complete(False)
+        records[2].complete(True)
+        self.assertEqual(log.checkpoint, records[1].offset)
+        log.close()
+
+        log = self.open()
+        self.assertEqual([record.data() for record in log.replay()],
+            [b'1', b'2'])
+        log.close()
+
+    def test_consumed_segments_are_deleted(self):
+        log = self.open()
+        records = [log.append(b'x' * 1000) for _ in range(20)]
+        segments = len(segment_files(self.directory))
+        for record in records[:-1]:
+            record.complete(True)
+        self.assertTrue(len(segment_files(self.directory)) < segments)
+        self.assertEqual(records[-1].data(), b'x' * 1000)
+        log.close()
+
+    def test_corrupt_record_is_dropped(self):
+        log = self.open()
+        log.append(b'first')
+        torn = log.append(b'second')
+        log.close()
+
+        name = segment_files(self.directory)[-1]
+        with open(os.path.join(self.directory, name), 'r+b') as segment:
+            segment.seek(torn.offset - int(name[:-4]) + 8)
+            segment.write(b'X')
+
+        log = self.open()
+        self.assertEqual([record.data() for record in log.replay()],
+            [b'first'])
+        appended = log.append(b'third')
+        self.assertEqual(appended.offset, torn.offset)
+        log.close()
+
+        log = self.open()
+        self.assertEqual([record.data() for record in log.replay()],
+            [b'first', b'third'])
+        log.close()
+
+    def test_replay_once(self):
+        log = self.open()
+        log.append(b'old')
+        log.close()
+
+        log = self.open()
+        self.assertEqual(len(log.replay()), 1)
+        new = log.append(b'new')
+        self.assertEqual(log.replay(), [])
+        new.complete(True)
+        # The replayed record is still in flight.
+        self.assertEqual(log.checkpoint, 0)
+        log.close()
+
+    def test_sync(self):
+        log = self.open(sync=True)
+        records = [log.append(b'x' * 700) for _ in range(20)]
+        self.assertEqual(records[-1].data(), b'x' * 700)
+        log.close()
+
+    def test_closed(self):
+        log = self.open()
+        record = log.append(b'record')
+        log.close()
+        self.assertRaises(SpoolClosed, record.data)
+        self.assertRaises(SpoolClosed, log.append, b'record')
+        record.complete(True)
+
+if __name__ == '__main__':
+    unittest.main()